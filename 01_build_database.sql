@@ -2,6 +2,7 @@
 --SET ROLE "gvcaadmin";
 
 --TODO make this not require editing every year
+-- Also runs on DuckDB (see utilities.run_sql_script()), so stick to SQL both understand, e.g. ISO timestamps
 CREATE SCHEMA sac_survey_2024;
 SET SCHEMA 'sac_survey_2024';
 
@@ -15,10 +16,10 @@ CREATE TABLE collectors
 );
 
 INSERT INTO collectors(collector_id, collector_description, collector_created)
-VALUES ('454577449', 'SAC Testing', '01/04/2024 09:29:00 AM'),
-       ('454577492', 'Dr Garrow Email', '01/04/2024 09:31:00 AM'),
-       ('454577519', 'Newsletters', '01/04/2024 09:33:00 AM'),
-       ('454577536', 'Other', '01/04/2024 09:34:00')
+VALUES ('454577449', 'SAC Testing', '2024-01-04 09:29:00'),
+       ('454577492', 'Dr Garrow Email', '2024-01-04 09:31:00'),
+       ('454577519', 'Newsletters', '2024-01-04 09:33:00'),
+       ('454577536', 'Other', '2024-01-04 09:34:00')
 ;
 
 
@@ -72,7 +73,7 @@ CREATE TABLE question_rank_responses
 (
     respondent_id  BIGINT  NOT NULL
         CONSTRAINT question_rank_responses_respondents_fk REFERENCES respondents (respondent_id),
-    question_id    INTEGER NOT NULL
+    question_id    SMALLINT NOT NULL
         CONSTRAINT question_rank_responses_question_fk REFERENCES questions (question_id),
     grammar        BOOLEAN NOT NULL,
     middle         BOOLEAN NOT NULL,
@@ -99,6 +100,39 @@ CREATE TABLE question_open_responses
 );
 
 
+-- One row per respondent loaded by `02_data_ingest.py --incremental`, so re-exports only load new or changed rows
+CREATE TABLE ingest_watermarks
+(
+    respondent_id BIGINT NOT NULL
+        CONSTRAINT ingest_watermarks_pk PRIMARY KEY,
+    end_datetime  TIMESTAMP,
+    row_hash      TEXT   NOT NULL
+);
+
+
+-- Rows committed so far by `02_data_ingest.py --batch-size`, so a failed ingest can continue with --resume
+CREATE TABLE ingest_checkpoints
+(
+    input_file TEXT    NOT NULL
+        CONSTRAINT ingest_checkpoints_pk PRIMARY KEY,
+    rows_done  INTEGER NOT NULL,
+    completed  BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+
+-- Rows which `02_data_ingest.py --reject` set aside instead of loading, with the column (if known) and the error
+CREATE TABLE rejected_rows
+(
+    input_file    TEXT      NOT NULL,
+    row_number    INTEGER   NOT NULL,
+    respondent_id TEXT,
+    column_index  SMALLINT,
+    error         TEXT      NOT NULL,
+    raw_row       TEXT[]    NOT NULL,
+    rejected_at   TIMESTAMP NOT NULL DEFAULT now()
+);
+
+
 CREATE TABLE question_response_mapping
 (
     question_id    SMALLINT
@@ -0,0 +1,90 @@
+/*
+ Materialized views the reports read instead of re-aggregating the raw responses.  Run after 01_build_database.sql.
+
+ 02_data_ingest.py refreshes them after every load, and 03_QA_Checks.sql after applying soft deletes, with
+ REFRESH MATERIALIZED VIEW CONCURRENTLY so reports can keep reading them during the refresh.  Postgres only; DuckDB
+ has no materialized views, so the charts aggregate the raw tables there.
+ */
+SET search_path to sac_survey_2024;
+
+
+-- One row per respondent, with the segments the reports break responses out by
+CREATE MATERIALIZED VIEW respondent_segments AS
+WITH respondent_levels AS
+         (
+             SELECT respondent_id,
+                    BOOL_OR(grammar) AS grammar,
+                    BOOL_OR(middle)  AS middle,
+                    BOOL_OR(high)    AS high
+             FROM (SELECT respondent_id, grammar, middle, high
+                   FROM question_rank_responses
+                   UNION ALL
+                   SELECT respondent_id, grammar, middle, high
+                   FROM question_open_responses) AS responses
+             GROUP BY respondent_id
+         )
+SELECT respondent_id,
+       num_individuals_in_response,
+       COALESCE(grammar, FALSE)      AS grammar,
+       COALESCE(middle, FALSE)       AS middle,
+       COALESCE(high, FALSE)         AS high,
+       tenure,
+       CASE WHEN tenure IS NULL THEN 'Did not answer'
+            WHEN tenure <= 1 THEN '1 Year'
+            WHEN tenure <= 3 THEN '2-3 Years'
+            ELSE 'More than 3 Years'
+           END                       AS tenure_bucket,
+       tenure = 1                    AS first_year,
+       CASE WHEN tenure = 1 THEN 'First Year Family'
+            WHEN NOT tenure = 1 THEN 'Returning Family'
+            ELSE 'Did not answer'
+           END                       AS first_year_segment,
+       any_support,
+       CASE WHEN any_support THEN 'Received Support'
+            WHEN NOT any_support THEN 'Did not Receive Support'
+            ELSE 'Did not answer'
+           END                       AS support_segment,
+       minority,
+       CASE WHEN minority THEN 'Minority'
+            WHEN NOT minority THEN 'Not Minority'
+            ELSE 'Did not answer'
+           END                       AS minority_segment,
+       COALESCE(soft_delete, FALSE)  AS soft_delete
+FROM respondents
+         LEFT JOIN
+     respondent_levels USING (respondent_id)
+WITH DATA
+;
+
+-- REFRESH ... CONCURRENTLY needs a unique index covering every row
+CREATE UNIQUE INDEX respondent_segments_pk ON respondent_segments (respondent_id);
+
+
+-- Rank responses to each question, counted by level, response value, and segment.  Each rank response belongs to
+-- exactly one level (see 03_QA_Checks.sql).  Weighted counts and averages use num_individuals_in_response:
+-- SUM(weighted_score) / SUM(weighted_responses) is the average score of any combination of rows.
+CREATE MATERIALIZED VIEW rank_response_aggregates AS
+SELECT question_id,
+       CASE WHEN question_rank_responses.grammar THEN 'Grammar'
+            WHEN question_rank_responses.middle THEN 'Middle'
+            WHEN question_rank_responses.high THEN 'High'
+           END                                                AS level,
+       response_value,
+       support_segment,
+       minority_segment,
+       first_year_segment,
+       tenure_bucket,
+       soft_delete,
+       COUNT(0)                                               AS num_responses,
+       SUM(num_individuals_in_response)                       AS weighted_responses,
+       SUM(response_value * num_individuals_in_response)      AS weighted_score
+FROM question_rank_responses
+         JOIN
+     respondent_segments USING (respondent_id)
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+WITH DATA
+;
+
+CREATE UNIQUE INDEX rank_response_aggregates_pk
+    ON rank_response_aggregates (question_id, level, response_value, support_segment, minority_segment,
+                                 first_year_segment, tenure_bucket, soft_delete);
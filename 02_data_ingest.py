@@ -1,29 +1,182 @@
 # TODO refactor this whole thing to be config based.  Given text[], standardized text output, indexes, etc.
 #      One major problem is that questions are defined separately in the database and the functions below.  If the text doesn't match exactly, there are silent errors.
 
+import argparse
+import hashlib
+import json
 import logging
+import os
+import re
+import time
+from array import array
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from csv import reader as csv_reader
+from datetime import datetime
+from functools import partial
+from io import StringIO
+from itertools import compress, islice
+from operator import itemgetter
+from pathlib import Path
 
-from sqlalchemy import create_engine, text
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError
 
-from utilities import load_env_vars
+from utilities import (
+    SCRIPT_SCHEMA,
+    is_duckdb,
+    load_env_vars,
+    refresh_aggregate_views,
+    run_sql_script,
+)
 
-INPUT_FILEPATH, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+# checked when the script is run, since --dry-run and --input don't need them all
+INPUT_FILEPATH, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars(
+    required=()
+)
 
+# compiled column plans, keyed by a hash of the header rows, so repeat runs can skip inspecting the header
+PLAN_CACHE_DIR = Path("cache")
 
-def inspect_header(conn):
+
+def read_header(reader="arrow", filepath=None):
+    """
+    Read the two header rows of the survey export.
+
+    :param reader: "arrow" or "csv", see iter_export_rows()
+    :param filepath: export to read; default is INPUT_FILEPATH
+    :return raw_header, raw_sub_header: list(str), list(str)
+    """
+    filepath = filepath or INPUT_FILEPATH
+    if reader == "arrow":
+        # only the first block or two of the export are parsed
+        blocks = []
+        for block in stream_export_batches(filepath):
+            blocks.append(block)
+            if sum(block.num_rows for block in blocks) >= 2:
+                break
+        header_rows = pa.Table.from_batches(blocks).slice(0, 2)
+        raw_header, raw_sub_header = (
+            list(row)
+            for row in zip(
+                *(column.to_pylist() for column in header_rows.columns)
+            )
+        )
+        return raw_header, raw_sub_header
+
+    with open(filepath, "r") as f_in:
+        raw_data_reader = csv_reader(f_in)
+        raw_header = raw_data_reader.__next__()
+        raw_sub_header = raw_data_reader.__next__()
+    return raw_header, raw_sub_header
+
+
+def iter_export_rows(reader="arrow", batch_size=10000):
+    """
+    Iterate over the rows of the survey export after the two header rows.
+
+    :param reader: "arrow" parses the file a block at a time into columns of strings with stream_export_batches(),
+                   and only turns batch_size rows at a time into Python objects, so memory stays flat however big
+                   the export is.  "csv" reads it line by line with the csv module.
+    :param batch_size: rows converted at a time by the arrow reader
+    :return: generator of rows, each a sequence of str
+    """
+    if reader == "arrow":
+        header_rows = 2
+        for block in stream_export_batches(INPUT_FILEPATH):
+            skipped = min(header_rows, block.num_rows)
+            block = block.slice(skipped)
+            header_rows -= skipped
+            for start in range(0, block.num_rows, batch_size):
+                batch = block.slice(start, batch_size)
+                # to_numpy() is much faster than to_pylist() for strings
+                yield from zip(
+                    *(
+                        column.to_numpy(zero_copy_only=False).tolist()
+                        for column in batch.columns
+                    )
+                )
+        return
+
+    with open(INPUT_FILEPATH, "r") as f_in:
+        raw_data_reader = csv_reader(f_in)
+        # header rows; read_header() reads them separately
+        raw_data_reader.__next__()
+        raw_data_reader.__next__()
+        yield from raw_data_reader
+
+
+# bytes of the export parsed at a time by stream_export_batches()
+EXPORT_BLOCK_SIZE = 1 << 20
+
+
+def read_export_table(filepath):
+    """
+    Parse the whole survey export, header rows included, with the pyarrow CSV reader from a memory map.  For the
+    frames which need every row at once; the row pipeline streams the export with stream_export_batches() instead.
+
+    :param filepath: path to the export
+    :return: pyarrow.Table with columns named "0", "1", ...
+    """
+    with pa.memory_map(str(filepath), "r") as source:
+        return pyarrow.csv.read_csv(source, **export_csv_options(filepath))
+
+
+def stream_export_batches(filepath):
+    """
+    Parse the survey export EXPORT_BLOCK_SIZE bytes at a time with the streaming pyarrow CSV reader, so only one
+    block is in memory at once.
+
+    :param filepath: path to the export
+    :return: generator of pyarrow.RecordBatch, header rows included, with columns named "0", "1", ...
+    """
+    with open(filepath, "rb") as f_in:
+        yield from pyarrow.csv.open_csv(f_in, **export_csv_options(filepath))
+
+
+def export_csv_options(filepath):
+    """
+    pyarrow.csv options which keep every column of the export as strings, with blanks as empty strings, the same as
+    the csv module.
+
+    :param filepath: path to the export
+    :return: dict of read_options, parse_options and convert_options
+    """
+    # only the width of the first line is needed to type every column as a string, rather than letting arrow guess
+    with open(filepath, "r", newline="") as f_in:
+        column_names = [str(i) for i in range(len(next(csv_reader(f_in))))]
+    return dict(
+        read_options=pyarrow.csv.ReadOptions(
+            column_names=column_names, block_size=EXPORT_BLOCK_SIZE
+        ),
+        # open responses can span lines
+        parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types={name: pa.string() for name in column_names},
+            strings_can_be_null=False,
+        ),
+    )
+
+
+def inspect_header(conn, reader="arrow", catalog=None, filepath=None):
     """
     Run only to check out the file structure and figure out what is in each column.
     Fix known errors and validate.
     Return a list with info about each column in the survey data, aka "header information."
 
+    :param conn: sqlalchemy connection; may be None if catalog is given
+    :param reader: "arrow" or "csv", see iter_export_rows()
+    :param catalog: question catalog from load_catalog(), to use instead of the questions table
+    :param filepath: export to read; default is INPUT_FILEPATH
     :return questions: dict(int: {'question description': str, 'question context': str, 'question type': str})
     """
     # get headers, organize columns
-    with open(INPUT_FILEPATH, "r") as f_in:
-        raw_data_reader = csv_reader(f_in)
-        raw_header = raw_data_reader.__next__()
-        raw_sub_header = raw_data_reader.__next__()
+    raw_header, raw_sub_header = read_header(reader, filepath)
 
     # fill empty columns with the appropriate question
     raw_questions = {}
@@ -42,17 +195,18 @@ def inspect_header(conn):
         }
 
     logging.info(raw_questions)
-    raw_questions = fix_questions(conn, raw_questions)
+    raw_questions = fix_questions(conn, raw_questions, catalog)
     validate_fixed_questions(raw_questions)
     return raw_questions
 
 
-def fix_questions(conn, questions):
+def fix_questions(conn, questions, catalog=None):
     """
     fix typos in questions, and add additional context where needed.
 
-    :param conn: sqlalchemy connection
+    :param conn: sqlalchemy connection; may be None if catalog is given
     :param questions: dict(int: {'question description': str, 'question context': str})
+    :param catalog: question catalog from load_catalog(), to use instead of the questions table
     :return questions:
     """
     # Typo with wrong type of apostrophe
@@ -125,11 +279,14 @@ def fix_questions(conn, questions):
             questions[i]["question context"] = "High School"
 
     # Add additional information to each header
-    question_info_from_db = conn.execute(
-        text(
-            f"SELECT question_id, question_type, question_text FROM {DATABASE_SCHEMA}.questions;"
-        )
-    ).fetchall()
+    if catalog is not None:
+        question_info_from_db = catalog["questions"]
+    else:
+        question_info_from_db = conn.execute(
+            text(
+                f"SELECT question_id, question_type, question_text FROM {DATABASE_SCHEMA}.questions;"
+            )
+        ).fetchall()
 
     # Add in identifiers and types from the database
     for i, q in questions.items():
@@ -393,6 +550,166 @@ def validate_fixed_questions(questions):
         )
 
 
+def load_catalog(filepath="01_build_database.sql"):
+    """
+    Load the question catalog without a database, for dry runs.
+
+    :param filepath: either the SQL which builds the database, whose INSERTs into questions and
+                     question_response_mapping are read, or a json file with the same two keys
+    :return catalog: {"questions": [(question_id, question_type, question_text)],
+                      "question_response_mapping": [(question_id, response_value, response_text)]}
+    """
+    if str(filepath).endswith(".json"):
+        with open(filepath, "r") as f_in:
+            catalog = json.load(f_in)
+    else:
+        with open(filepath, "r") as f_in:
+            build_sql = f_in.read()
+        catalog = {
+            "questions": [
+                (question_id, question_type, question_text)
+                for question_id, question_type, question_text, _ in read_sql_inserts(
+                    build_sql, "questions"
+                )
+            ],
+            "question_response_mapping": read_sql_inserts(
+                build_sql, "question_response_mapping"
+            ),
+        }
+    return {
+        key: [tuple(values) for values in catalog[key]]
+        for key in ["questions", "question_response_mapping"]
+    }
+
+
+def read_sql_inserts(sql, tablename):
+    """
+    Read the rows of the INSERT INTO tablename ... VALUES (...), (...); statements in a SQL script.
+    Only handles the literals used in 01_build_database.sql: quoted strings, integers, TRUE and FALSE.
+
+    :return: list of tuples
+    """
+    rows = []
+    for values_sql in re.findall(
+        rf"INSERT INTO {tablename}\s*\([^)]*\)\s*VALUES\s*(.*?\))\s*;",
+        sql,
+        flags=re.DOTALL | re.IGNORECASE,
+    ):
+        row = None
+        for token in re.findall(r"'(?:[^']|'')*'|[()]|[^\s,()']+", values_sql):
+            if token == "(":
+                row = []
+            elif token == ")":
+                rows.append(tuple(row))
+            elif token.startswith("'"):
+                row.append(token[1:-1].replace("''", "'"))
+            elif token.upper() in ("TRUE", "FALSE"):
+                row.append(token.upper() == "TRUE")
+            else:
+                row.append(int(token))
+    return rows
+
+
+def load_column_plan(conn, use_cache=True, reader="arrow"):
+    """
+    Get the column plan for the survey export.
+    Plans are saved in PLAN_CACHE_DIR, keyed by a hash of the two header rows, the schema and its catalog (the
+    questions and question_response_mapping rows), so fixing and validating the header only happens the first time
+    a new export layout or catalog is seen.
+
+    :param conn: sqlalchemy connection
+    :param use_cache: set False to ignore any saved plan and rebuild it from the header
+    :param reader: "arrow" or "csv", see iter_export_rows()
+    :return plan: see build_column_plan()
+    """
+    raw_header, raw_sub_header = read_header(reader)
+    catalog = read_catalog(conn)
+    header_hash = hashlib.sha256(
+        json.dumps(
+            [raw_header, raw_sub_header, DATABASE_SCHEMA, catalog]
+        ).encode()
+    ).hexdigest()
+    cache_file = PLAN_CACHE_DIR / f"column_plan_{header_hash[:16]}.json"
+
+    if use_cache and cache_file.exists():
+        logging.info("Using saved column plan %s", cache_file)
+        with open(cache_file, "r") as f_in:
+            return json.load(f_in)
+
+    plan = build_column_plan(inspect_header(conn, reader, catalog))
+
+    PLAN_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, "w") as f_out:
+        json.dump(plan, f_out)
+    logging.info("Saved column plan %s", cache_file)
+    return plan
+
+
+def read_catalog(conn):
+    """
+    Read the question catalog from the database, in the same form as load_catalog().
+
+    :param conn: sqlalchemy connection
+    :return catalog: {"questions": [[question_id, question_type, question_text]],
+                      "question_response_mapping": [[question_id, response_value, response_text]]}, sorted
+    """
+    return {
+        "questions": [
+            list(row)
+            for row in conn.execute(
+                text(
+                    f"SELECT question_id, question_type, question_text FROM {DATABASE_SCHEMA}.questions "
+                    "ORDER BY question_id;"
+                )
+            )
+        ],
+        "question_response_mapping": [
+            list(row)
+            for row in conn.execute(
+                text(
+                    f"SELECT question_id, response_value, response_text FROM {DATABASE_SCHEMA}.question_response_mapping "
+                    "ORDER BY question_id, response_value;"
+                )
+            )
+        ],
+    }
+
+
+def build_column_plan(questions):
+    """
+    Compile the header information into a plan that lets each row be parsed in a single pass over its columns.
+
+    :param questions: dict(int: {'question description': str, 'question context': str, 'question type': str})
+    :return plan: list with one entry per column.  None if the column isn't loaded into a response table, otherwise
+                  [question_id, question_type, [grammar, middle, high, whole_school], converter]
+    """
+    converters = {"rank": "int", "open response": "text"}
+
+    plan = []
+    for i in range(len(questions)):
+        question = questions[i]
+        converter = converters.get(question.get("question type"))
+        if converter is None:
+            plan.append(None)
+            continue
+
+        context = question["question context"]
+        plan.append(
+            [
+                question["question_id"],
+                question["question type"],
+                [
+                    context == "Grammar School",
+                    context == "Middle School",
+                    context == "High School",
+                    context == "Whole School",
+                ],
+                converter,
+            ]
+        )
+    return plan
+
+
 def get_question_response(
     questions: dict, question_description: str, response_row: dict
 ) -> int:
@@ -413,206 +730,2191 @@ def get_question_response(
             return convert_to_int(response_row[i])
 
 
-def main():
+# primary key of each table written by ingest, used to upsert rows which were already loaded
+PRIMARY_KEYS = {
+    "respondents": ["respondent_id"],
+    "question_rank_responses": [
+        "respondent_id",
+        "high",
+        "middle",
+        "grammar",
+        "question_id",
+    ],
+    "question_open_responses": [
+        "respondent_id",
+        "question_id",
+        "grammar",
+        "middle",
+        "high",
+        "whole_school",
+    ],
+    "ingest_watermarks": ["respondent_id"],
+    "ingest_checkpoints": ["input_file"],
+}
+
+
+def add_to_table(conn, tablename: str, **kwargs) -> None:
     """
-    Insert rows of data into the database.  Tables must already exist.
+    Insert values into table.
+    Current data model dictates that, at a minimum, all "question_*_response" tables should have the following in kwargs:
+        * question_id
+        * respondent_id
 
-    :return:
+    :param conn: connection to database
+    :param tablename: name of the table into which the values will be inserted
+    :param kwargs: values are inserted into a column with the same name as the key
+    :return: None
     """
-    eng = create_engine(DATABASE_CONNECTION_STRING)
-    with open(INPUT_FILEPATH, "r") as f_in, eng.connect() as conn:
-        raw_data_reader = csv_reader(f_in)
+    keys = kwargs.keys()
+    query = text(
+        f'INSERT INTO {tablename} ({", ".join(list(keys))}) '
+        f'VALUES ({", ".join([":" + k for k in keys])})'
+    )
+    conn.execute(query, {**{"tablename": tablename}, **kwargs})
 
-        raw_questions = inspect_header(conn)
-        # since the questions have been fixed, skip reading those here
-        header = raw_data_reader.__next__()
-        sub_header = raw_data_reader.__next__()
 
-        # database setup
-        conn.execute(text("BEGIN TRANSACTION;"))
-        conn.execute(text(f"SET SCHEMA '{DATABASE_SCHEMA}';"))
-        logging.info(f"Writing to schema: {DATABASE_SCHEMA}")
+def upsert_to_table(conn, tablename: str, **kwargs) -> None:
+    """
+    Same as add_to_table(), but if a row with the same primary key already exists it is updated instead.
 
-        # each row represents one respondent's answers to every question.
-        # Parse each row into separate tables
-        for i, row in enumerate(raw_data_reader):
-            logging.info(f"Processing row {i}")
+    :param conn: connection to database
+    :param tablename: name of the table into which the values will be inserted
+    :param kwargs: values are inserted into a column with the same name as the key
+    :return: None
+    """
+    keys = kwargs.keys()
+    query = text(
+        f'INSERT INTO {tablename} ({", ".join(list(keys))}) '
+        f'VALUES ({", ".join([":" + k for k in keys])}) '
+        + on_conflict_clause(tablename, keys)
+    )
+    conn.execute(query, kwargs)
 
-            # Includes questions 1, 2, 12, 13, 14, and meta information
-            populate_respondents(conn, raw_questions, row)
 
-            # iterate through all questions.  Check the question type, then insert data into the correct place
-            for question_id, question_type, question_text in conn.execute(
-                text(
-                    f"""SELECT question_id, question_type, question_text FROM
-                     {DATABASE_SCHEMA}.questions;"""
-                )
-            ).all():
-                logging.info(f"Processing question {question_id} for row {i}")
-                if question_type == "rank":
-                    populate_rank_response(
-                        conn, question_id, question_text, raw_questions, row
-                    )
-                if question_type == "open response":
-                    populate_open_response(
-                        conn, question_id, question_text, raw_questions, row
-                    )
+def on_conflict_clause(tablename: str, columns) -> str:
+    """
+    Build the ON CONFLICT clause which updates every non-key column of an existing row.
+    Columns which aren't given, like respondents.soft_delete, keep their current value.
+    """
+    primary_key = PRIMARY_KEYS[tablename]
+    updates = [
+        f"{column} = EXCLUDED.{column}"
+        for column in columns
+        if column not in primary_key
+    ]
+    return f'ON CONFLICT ({", ".join(primary_key)}) ' + (
+        f'DO UPDATE SET {", ".join(updates)}' if updates else "DO NOTHING"
+    )
 
-        conn.execute(text("END TRANSACTION;"))
 
+class BulkLoader:
+    """
+    Buffer rows in memory instead of sending one INSERT per value, then load each table with a single
+    COPY FROM STDIN.  Has the same call signature as add_to_table() so main() can use either.
+    """
 
-def populate_respondents(conn, questions, row):
-    # Create the respondent, including demographic information
-    grammar_rank_questions = [
-        convert_to_int(row[i])
-        for i, q in questions.items()
-        if q["question context"] == "Grammar School"
-        and row[i]
-        and q["question type"] == "rank"
+    # respondents must be loaded first to satisfy the foreign keys on the response tables
+    TABLE_ORDER = [
+        "respondents",
+        "question_rank_responses",
+        "question_open_responses",
     ]
-    middle_rank_questions = [
-        convert_to_int(row[i])
-        for i, q in questions.items()
-        if q["question context"] == "Middle School"
-        and row[i]
-        and q["question type"] == "rank"
-    ]
-    high_rank_questions = [
-        convert_to_int(row[i])
-        for i, q in questions.items()
-        if q["question context"] == "High School"
-        and row[i]
-        and q["question type"] == "rank"
-    ]
-    all_rank_questions = (
-        grammar_rank_questions + middle_rank_questions + high_rank_questions
-    )
-    add_to_table(
-        conn,
-        tablename="respondents",
-        respondent_id=row[0],
-        collector_id=row[1],
-        start_datetime=row[2],
-        end_datetime=row[3],
-        num_individuals_in_response=(
-            1
-            if row[9]
-            == "Each parent or guardian will submit a separate survey, and we will submit two surveys."
-            else (
-                2
-                if row[9]
-                == "All parents and guardians will coordinate responses, and we will submit only one survey."
-                else None
-            )
-        ),
-        tenure=int(row[133]) if row[133] else None,
-        minority=convert_to_bool(row[135]),
-        any_support=convert_to_bool(row[134]),
-        grammar_avg=(
-            sum(grammar_rank_questions) / len(grammar_rank_questions)
-            if len(grammar_rank_questions) > 0
-            else None
-        ),
-        middle_avg=(
-            sum(middle_rank_questions) / len(middle_rank_questions)
-            if len(middle_rank_questions) > 0
-            else None
-        ),
-        high_avg=(
-            sum(high_rank_questions) / len(high_rank_questions)
-            if len(high_rank_questions) > 0
-            else None
-        ),
-        overall_avg=(
-            sum(all_rank_questions) / len(all_rank_questions)
-            if len(all_rank_questions) > 0
-            else None
-        ),
-    )
 
+    def __init__(self, upsert=False):
+        """
+        :param upsert: update rows which already exist, matching on the primary key, instead of failing
+        """
+        self.upsert = upsert
+        self.tables = {}  # tablename: (column names, [row values])
 
-def populate_rank_response(
-    conn, question_id, question_text, raw_questions, row
-):
-    # Iterate through the columns of responses.  If it matches the question and has a response, insert it into the db
-    for question, response in zip(raw_questions.values(), row):
-        logging.debug(f"question_id: {question_id}")
-        logging.debug(f"question_text: {question_text}")
-        if question["question description"] == question_text and response:
-            logging.debug(
-                f'{question["question context"]} response: {response}'
-            )
-            add_to_table(
-                conn,
-                tablename="question_rank_responses",
-                respondent_id=row[0],
-                question_id=question_id,
-                grammar=question["question context"] == "Grammar School",
-                middle=question["question context"] == "Middle School",
-                high=question["question context"] == "High School",
-                response_value=convert_to_int(response),
-            )
-
-
-def populate_open_response(
-    conn, question_id, question_text, raw_questions, row
-):
-    # Iterate through the columns of responses.  If it matches the question and has a response, insert it into the db
-    for question, response in zip(raw_questions.values(), row):
-        logging.debug(f"question_id: {question_id}")
-        logging.debug(f"question_text: {question_text}")
-        if question["question description"] == question_text and response:
-            logging.debug(
-                f'{question["question context"]} response: {response}'
-            )
-            add_to_table(
-                conn,
-                tablename="question_open_responses",
-                respondent_id=row[0],
-                question_id=question_id,
-                grammar=question["question context"] == "Grammar School",
-                middle=question["question context"] == "Middle School",
-                high=question["question context"] == "High School",
-                whole_school=question["question context"] == "Whole School",
-                response=response,
-            )
+    def add(self, conn, tablename: str, **kwargs) -> None:
+        columns, rows = self.tables.setdefault(tablename, (list(kwargs), []))
+        rows.append([kwargs[column] for column in columns])
 
+    def flush(self, conn) -> None:
+        """
+        Send every buffered row to the database and empty the buffer.
+        Must be called inside the same transaction as the rest of the ingest.
+        """
+        for tablename in sorted(
+            self.tables,
+            key=lambda t: self.TABLE_ORDER.index(t)
+            if t in self.TABLE_ORDER
+            else len(self.TABLE_ORDER),
+        ):
+            columns, rows = self.tables.pop(tablename)
+            logging.info("Loading %s rows into %s", len(rows), tablename)
+            copy_to_table(conn, tablename, columns, rows, self.upsert)
 
-def add_to_table(conn, tablename: str, **kwargs) -> None:
+    def discard(self) -> None:
+        """
+        Empty the buffer without loading it, e.g. after a failed flush was rolled back.
+        """
+        self.tables = {}
+
+
+def copy_to_table(
+    conn, tablename: str, columns: list, rows: list, upsert=False
+) -> None:
     """
-    Insert values into table.
-    Current data model dictates that, at a minimum, all "question_*_response" tables should have the following in kwargs:
-        * question_id
-        * respondent_id
+    Load many rows into a table in one round trip using COPY FROM STDIN.
+    On DuckDB, insert them from a DataFrame instead; for any other driver, fall back to a single executemany INSERT.
 
     :param conn: connection to database
     :param tablename: name of the table into which the values will be inserted
-    :param kwargs: values are inserted into a column with the same name as the key
+    :param columns: column names, in the same order as the values in each row
+    :param rows: list of rows, each a list of values
+    :param upsert: update rows which already exist, matching on the primary key.
+                   COPY can't do that, so the rows are copied into a temporary table and upserted from there.
     :return: None
     """
-    keys = kwargs.keys()
-    query = text(
-        f'INSERT INTO {tablename} ({", ".join(list(keys))}) '
-        f'VALUES ({", ".join([":" + k for k in keys])})'
+    if not rows:
+        return
+
+    cursor = conn.connection.cursor()
+    if not hasattr(cursor, "copy_expert") and hasattr(
+        conn.connection.connection, "register"
+    ):
+        # DuckDB: scan the rows as a DataFrame rather than inserting them one at a time
+        conn.connection.connection.register(
+            "copy_rows", pd.DataFrame(rows, columns=columns)
+        )
+        conn.execute(
+            text(
+                f'INSERT INTO {tablename} ({", ".join(columns)}) '
+                f'SELECT {", ".join(columns)} FROM copy_rows '
+                + (on_conflict_clause(tablename, columns) if upsert else "")
+            )
+        )
+        conn.connection.connection.unregister("copy_rows")
+        return
+    if not hasattr(cursor, "copy_expert"):
+        query = text(
+            f'INSERT INTO {tablename} ({", ".join(columns)}) '
+            f'VALUES ({", ".join([":" + c for c in columns])}) '
+            + (on_conflict_clause(tablename, columns) if upsert else "")
+        )
+        conn.execute(query, [dict(zip(columns, row)) for row in rows])
+        return
+
+    if upsert:
+        staging_table = f"staging_{tablename}"
+        conn.execute(
+            text(f"CREATE TEMPORARY TABLE {staging_table} (LIKE {tablename});")
+        )
+        copy_to_table(conn, staging_table, columns, rows)
+        conn.execute(
+            text(
+                f'INSERT INTO {tablename} ({", ".join(columns)}) '
+                f'SELECT {", ".join(columns)} FROM {staging_table} '
+                + on_conflict_clause(tablename, columns)
+            )
+        )
+        conn.execute(text(f"DROP TABLE {staging_table};"))
+        return
+
+    # Postgres text format, so NULLs and empty strings stay distinct
+    data = StringIO()
+    for row in rows:
+        data.write("\t".join(to_copy_text(value) for value in row) + "\n")
+    data.seek(0)
+    cursor.copy_expert(
+        f'COPY {tablename} ({", ".join(columns)}) FROM STDIN', data
     )
-    conn.execute(query, {**{"tablename": tablename}, **kwargs})
+    STATS.count("statements")
 
 
-def convert_to_bool(value):
-    return True if value == "Yes" else False if value == "No" else None
+def to_copy_text(value) -> str:
+    """
+    Format a python value the way COPY's text format expects it.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
 
 
-def convert_to_int(value):
-    if value.startswith("Extremely") or value.startswith("Strongly"):
-        return 4
-    if value.startswith("Somewhat"):
-        return 2
-    if value.startswith("Not"):
-        return 1
-    if len(value) == 0:
-        return None
-    return 3
+class IngestStats:
+    """
+    Timers and counters for each stage of the ingest, so we can see where the time goes.
+    """
 
+    def __init__(self):
+        self.reset()
 
-if __name__ == "__main__":
-    main()
+    def reset(self):
+        self.start = time.perf_counter()
+        self.stage_seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Add the time spent in this context to the named stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += time.perf_counter() - start
+
+    def timed(self, name, iterable):
+        """
+        Yield from an iterable, adding the time spent waiting on each item to the named stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def summary(self):
+        """
+        :return: dict with the totals, and each stage from slowest to fastest
+        """
+        total_seconds = time.perf_counter() - self.start
+        return {
+            "total_seconds": round(total_seconds, 3),
+            "rows": self.counters["rows"],
+            "rows_per_second": round(self.counters["rows"] / total_seconds, 1),
+            "statements": self.counters["statements"],
+            "stages": [
+                {
+                    "stage": name,
+                    "seconds": round(seconds, 3),
+                    "pct": round(100 * seconds / total_seconds, 1),
+                }
+                for name, seconds in sorted(
+                    self.stage_seconds.items(),
+                    key=lambda stage: stage[1],
+                    reverse=True,
+                )
+            ],
+            "counters": dict(self.counters),
+        }
+
+    def report(self, json_filepath=None):
+        """
+        Log the summary, and optionally save it as json.
+
+        :return: the summary
+        """
+        summary = self.summary()
+        logging.info(
+            "Ingested %s rows in %s s (%s rows/s) with %s statements",
+            summary["rows"],
+            summary["total_seconds"],
+            summary["rows_per_second"],
+            summary["statements"],
+        )
+        for stage in summary["stages"]:
+            logging.info(
+                "    %-12s %9.3f s %6.1f%%",
+                stage["stage"],
+                stage["seconds"],
+                stage["pct"],
+            )
+        if json_filepath:
+            with open(json_filepath, "w") as f_out:
+                json.dump(summary, f_out, indent=2)
+        return summary
+
+
+STATS = IngestStats()
+
+# rows between progress messages
+PROGRESS_INTERVAL = 10000
+
+# rows written under one savepoint by RejectLane
+SAVEPOINT_ROWS = 1000
+
+# how Survey Monkey writes start and end dates, e.g. 01/15/2024 09:05:00 AM
+SURVEY_DATETIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+# the same format for Postgres' to_timestamp(), used by load_with_sql()
+SQL_DATETIME_FORMAT = "MM/DD/YYYY HH12:MI:SS AM"
+SURVEY_DATETIME_PATTERN = re.compile(
+    r"(\d\d)/(\d\d)/(\d{4}) (\d\d):(\d\d):(\d\d) ([AP]M)"
+)
+
+
+def main(
+    bulk=False,
+    use_plan_cache=True,
+    workers=1,
+    chunk_size=1000,
+    engine="rows",
+    incremental=False,
+    stats_json=None,
+    reader="arrow",
+    batch_size=None,
+    resume=False,
+    reject=False,
+):
+    """
+    Insert rows of data into the database.  Tables must already exist.
+
+    :param bulk: buffer every row in memory and load each table with a single COPY instead of one INSERT per cell
+    :param use_plan_cache: reuse the saved column plan for this header, if there is one
+    :param workers: number of processes used to parse rows; 1 parses in this process, 0 uses every core
+    :param chunk_size: number of rows sent to a worker process at a time
+    :param engine: "rows" parses the export one row at a time; "pandas" parses it all at once with vectorized
+                   operations and always loads with COPY; "sql" stages the raw export and unpivots it in Postgres,
+                   see load_with_sql()
+    :param incremental: only load rows which are new or changed since the last ingest, according to the
+                        ingest_watermarks table.  Changed rows are upserted.
+    :param stats_json: also save the timing summary to this json file
+    :param reader: "arrow" parses the export a block at a time into columns; "csv" uses the csv module.
+                   See iter_export_rows()
+    :param batch_size: commit every batch_size rows, with a checkpoint in ingest_checkpoints, instead of loading
+                       the whole file in one transaction.  A bad row then only rolls back its own batch.
+    :param resume: with batch_size, skip the rows committed by an earlier run of the same file
+    :param reject: set aside rows which fail conversion or constraints in the rejected_rows table, and keep
+                   loading the rest.  See RejectLane.
+    :return: timing summary from IngestStats.summary()
+    """
+    assert not (
+        incremental and engine != "rows"
+    ), "Incremental ingest is only supported by the rows engine"
+    assert not (
+        engine == "sql" and "postgresql" not in DATABASE_CONNECTION_STRING
+    ), "The sql engine needs Postgres"
+    assert not (
+        batch_size and (engine != "rows" or incremental)
+    ), "Batches are only supported by the rows engine, without --incremental"
+    assert batch_size or not resume, "Resuming needs --batch-size"
+    assert not (
+        reject and (engine != "rows" or incremental)
+    ), "Rejecting rows is only supported by the rows engine, without --incremental"
+    assert not (
+        reject and is_duckdb(DATABASE_CONNECTION_STRING)
+    ), "Rejecting rows needs savepoints, which DuckDB doesn't support"
+
+    loader = BulkLoader(upsert=incremental) if bulk else None
+    write = (
+        loader.add
+        if bulk
+        else upsert_to_table
+        if incremental
+        else add_to_table
+    )
+
+    STATS.reset()
+    eng = create_engine(DATABASE_CONNECTION_STRING)
+    event.listen(
+        eng,
+        "before_cursor_execute",
+        lambda *_: STATS.count("statements"),
+    )
+    with eng.connect() as conn:
+        with STATS.stage("header"):
+            plan = load_column_plan(
+                conn, use_cache=use_plan_cache, reader=reader
+            )
+
+        # database setup.  Everything is loaded in this transaction, or one per batch with batch_size
+        transaction = conn.begin()
+        conn.execute(text(f"SET SCHEMA '{DATABASE_SCHEMA}';"))
+        logging.info("Writing to schema: %s", DATABASE_SCHEMA)
+
+        if engine == "pandas":
+            load_with_pandas(conn, plan, reader)
+        elif engine == "sql":
+            load_with_sql(conn, plan)
+        else:
+            # since the questions have been fixed, the header rows are skipped here
+            rows = iter_export_rows(reader)
+            if incremental:
+                with STATS.stage("delta"):
+                    rows = select_new_or_changed_rows(conn, rows)
+                if is_duckdb(DATABASE_CONNECTION_STRING):
+                    # DuckDB won't update a respondent until the deletion of its responses is committed
+                    transaction.commit()
+                    transaction = conn.begin()
+            rows_done = 0
+            if batch_size:
+                rows_done = start_from_checkpoint(conn, resume)
+                rows = islice(rows, rows_done, None)
+
+            decoder = RowDecoder(plan, load_answer_scores(conn))
+            parse = parse_row
+            lane = None
+            if reject:
+                lane = RejectLane(write, loader)
+                if not resume:
+                    lane.clear(conn)
+                parse = parse_checked_row
+
+            # each row represents one respondent's answers to every question.
+            # Parse each row into separate tables; parsing can be spread across processes, but only this one writes
+            if workers == 1:
+                parsed_rows = (parse(decoder, row) for row in rows)
+            else:
+                parsed_rows = parse_in_parallel(
+                    decoder, rows, workers, chunk_size, parse
+                )
+            committed_rows = rows_done
+            try:
+                for i, parsed in enumerate(
+                    STATS.timed("parse", parsed_rows), start=rows_done
+                ):
+                    logging.debug("Processing row %s", i)
+                    if i and i % PROGRESS_INTERVAL == 0:
+                        logging.info("Processed %s rows", i)
+                    STATS.count("rows")
+
+                    with STATS.stage("write"):
+                        if lane is not None:
+                            lane.add(conn, i, *parsed)
+                        else:
+                            write_respondent(conn, write, *parsed)
+                    rows_done = i + 1
+
+                    if batch_size and rows_done % batch_size == 0:
+                        with STATS.stage("commit"):
+                            if lane is not None:
+                                lane.flush(conn)
+                            transaction = commit_batch(
+                                conn, transaction, loader, rows_done
+                            )
+                        committed_rows = rows_done
+            except Exception:
+                if batch_size:
+                    logging.error(
+                        "Ingest stopped after committing %s rows.  "
+                        "Fix the export and rerun with --resume to continue from there",
+                        committed_rows,
+                    )
+                raise
+
+            if lane is not None:
+                with STATS.stage("write"):
+                    lane.flush(conn)
+            if bulk:
+                with STATS.stage("load"):
+                    loader.flush(conn)
+            if incremental:
+                with STATS.stage("watermarks"):
+                    update_watermarks(conn, rows)
+            if batch_size:
+                save_checkpoint(conn, rows_done, completed=True)
+
+        # in the same transaction, so reports never see new rows with old aggregates
+        with STATS.stage("refresh"):
+            refresh_aggregate_views(conn, DATABASE_SCHEMA)
+        with STATS.stage("commit"):
+            transaction.commit()
+
+    return STATS.report(stats_json)
+
+
+def write_respondent(conn, write, respondent, rank_responses, open_responses):
+    """
+    Write one respondent and their responses with write(), i.e. add_to_table(), upsert_to_table() or BulkLoader.add()
+    """
+    write(conn, tablename="respondents", **respondent)
+    for rank_response in rank_responses:
+        write(conn, tablename="question_rank_responses", **rank_response)
+    for open_response in open_responses:
+        write(conn, tablename="question_open_responses", **open_response)
+
+
+class RejectLane:
+    """
+    Write parsed rows a group at a time under a savepoint, setting aside rows which can't be loaded in the
+    rejected_rows table instead of aborting the ingest.
+
+    Rows which failed conversion (see parse_checked_row()) or repeat a respondent_id are rejected before they reach
+    the database.  If a group still fails a constraint, only that group is rolled back and retried one row at a
+    time, each under its own savepoint, so clean groups keep the speed of the normal path.
+    """
+
+    def __init__(self, write, loader=None):
+        """
+        :param write: add_to_table(), upsert_to_table() or BulkLoader.add()
+        :param loader: the BulkLoader, if write buffers rows in one
+        """
+        self.write = write
+        self.loader = loader
+        self.pending = []  # (row_number, row, parsed)
+        self.rejects = []
+        self.respondent_ids = set()
+
+    def clear(self, conn) -> None:
+        """
+        Remove rejects from an earlier ingest of this file.
+        """
+        conn.execute(
+            text("DELETE FROM rejected_rows WHERE input_file = :input_file"),
+            {"input_file": Path(INPUT_FILEPATH).name},
+        )
+
+    def add(self, conn, row_number, row, parsed, errors) -> None:
+        """
+        :param row_number: position of the row in the export, after the header rows
+        :param row, parsed, errors: from parse_checked_row()
+        """
+        if not errors and row[0] in self.respondent_ids:
+            errors = [(0, f"Duplicate respondent_id {row[0]}")]
+        if errors:
+            for column_index, error in errors:
+                self.reject(row_number, row, column_index, error)
+            return
+
+        self.respondent_ids.add(row[0])
+        self.pending.append((row_number, row, parsed))
+        if len(self.pending) >= SAVEPOINT_ROWS:
+            self.flush(conn)
+
+    def flush(self, conn) -> None:
+        """
+        Write the pending rows, then save the rejects.  Call before committing.
+        """
+        if self.pending:
+            savepoint = conn.begin_nested()
+            try:
+                self._write(conn, [parsed for _, _, parsed in self.pending])
+                savepoint.commit()
+            except database_errors(conn):
+                savepoint.rollback()
+                self._retry_each_row(conn)
+            self.pending = []
+
+        if self.rejects:
+            logging.warning("Rejected %s rows", len(self.rejects))
+            STATS.count("rejected", len(self.rejects))
+            conn.execute(
+                text(
+                    "INSERT INTO rejected_rows (input_file, row_number, respondent_id, column_index, error, raw_row) "
+                    "VALUES (:input_file, :row_number, :respondent_id, :column_index, :error, :raw_row)"
+                ),
+                self.rejects,
+            )
+            self.rejects = []
+
+    def reject(self, row_number, row, column_index, error) -> None:
+        logging.info("Rejected row %s: %s", row_number, error)
+        self.rejects.append(
+            dict(
+                input_file=Path(INPUT_FILEPATH).name,
+                row_number=row_number,
+                respondent_id=row[0] if row else None,
+                column_index=column_index,
+                error=error,
+                raw_row=list(row),
+            )
+        )
+
+    def _retry_each_row(self, conn) -> None:
+        for row_number, row, parsed in self.pending:
+            savepoint = conn.begin_nested()
+            try:
+                self._write(conn, [parsed])
+                savepoint.commit()
+            except database_errors(conn) as e:
+                savepoint.rollback()
+                error = str(getattr(e, "orig", e)).splitlines()[0]
+                self.reject(row_number, row, None, error)
+
+    def _write(self, conn, parsed_rows) -> None:
+        for parsed in parsed_rows:
+            write_respondent(conn, self.write, *parsed)
+        if self.loader is not None:
+            try:
+                self.loader.flush(conn)
+            finally:
+                # anything left after a failed COPY belongs to the rows being rolled back
+                self.loader.discard()
+
+
+def database_errors(conn):
+    """
+    Errors raised by a failed statement: wrapped by sqlalchemy, or straight from the driver for COPY
+    """
+    return DBAPIError, conn.dialect.dbapi.Error
+
+
+def load_answer_scores(conn, catalog=None):
+    """
+    :param conn: sqlalchemy connection; may be None if catalog is given
+    :param catalog: question catalog from load_catalog(), to use instead of the question_response_mapping table
+    :return: dict of question_id: {answer text: response_value} from question_response_mapping
+    """
+    if catalog is not None:
+        mapping = catalog["question_response_mapping"]
+    else:
+        mapping = conn.execute(
+            text(
+                "SELECT question_id, response_value, response_text FROM question_response_mapping"
+            )
+        )
+
+    scores = defaultdict(dict)
+    for question_id, response_value, response_text in mapping:
+        scores[question_id][response_text] = response_value
+    return dict(scores)
+
+
+def start_from_checkpoint(conn, resume):
+    """
+    Find where a batched ingest of this file should start.
+
+    :param conn: sqlalchemy connection, with the schema already set
+    :param resume: continue after the rows committed by an earlier run; otherwise start from the first row
+    :return rows_done: number of rows to skip
+    """
+    checkpoint = conn.execute(
+        text(
+            "SELECT rows_done, completed FROM ingest_checkpoints WHERE input_file = :input_file"
+        ),
+        {"input_file": Path(INPUT_FILEPATH).name},
+    ).first()
+    if checkpoint is None:
+        return 0
+
+    rows_done, completed = checkpoint
+    if not resume:
+        if not completed:
+            logging.warning(
+                "An earlier ingest of %s stopped after %s rows; starting from the first row.  "
+                "Use --resume to continue from the checkpoint instead",
+                Path(INPUT_FILEPATH).name,
+                rows_done,
+            )
+        return 0
+
+    if completed:
+        logging.info("%s was already ingested", Path(INPUT_FILEPATH).name)
+    else:
+        logging.info("Resuming after row %s", rows_done)
+    return rows_done
+
+
+def commit_batch(conn, transaction, loader, rows_done):
+    """
+    Commit the batch along with a checkpoint of the rows done so far, so the checkpoint is never ahead of or
+    behind the data.
+
+    :param conn: sqlalchemy connection
+    :param transaction: the batch's transaction
+    :param loader: BulkLoader to flush first, or None
+    :param rows_done: rows of the export written so far, including earlier batches
+    :return: transaction for the next batch
+    """
+    if loader is not None:
+        loader.flush(conn)
+    save_checkpoint(conn, rows_done)
+    transaction.commit()
+    logging.info("Committed %s rows", rows_done)
+    return conn.begin()
+
+
+def save_checkpoint(conn, rows_done, completed=False):
+    upsert_to_table(
+        conn,
+        "ingest_checkpoints",
+        input_file=Path(INPUT_FILEPATH).name,
+        rows_done=rows_done,
+        completed=completed,
+    )
+
+
+def dry_run(
+    catalog_filepath="01_build_database.sql",
+    reader="arrow",
+    json_filepath=None,
+):
+    """
+    Check an export without a database: fix and validate the header against the question catalog, convert every row
+    in memory with the same checks as --reject, and print what would be loaded.
+
+    :param catalog_filepath: see load_catalog()
+    :param reader: "arrow" or "csv", see iter_export_rows()
+    :param json_filepath: also save the report to this json file
+    :return report: dict with row counts, unmapped answers, errors, and the fill rate of each column
+    """
+    start = time.perf_counter()
+    catalog = load_catalog(catalog_filepath)
+    questions = inspect_header(None, reader, catalog)
+    plan = build_column_plan(questions)
+    answer_scores = load_answer_scores(None, catalog)
+    decoder = RowDecoder(plan, answer_scores)
+    survey = read_export_dataframe(reader)
+
+    errors = Counter()
+    rejected = 0
+    respondent_ids = set()
+    for row in iter_export_rows(reader):
+        _, _, row_errors = parse_checked_row(decoder, row)
+        if row[0] in respondent_ids:
+            row_errors.append((0, f"Duplicate respondent_id {row[0]}"))
+        respondent_ids.add(row[0])
+        if row_errors:
+            rejected += 1
+            errors.update(row_errors)
+
+    # answers which aren't in question_response_mapping, by question
+    unmapped = Counter()
+    for i, column in enumerate(plan):
+        if column is None or column[3] != "int":
+            continue
+        responses = survey[i][survey[i] != ""]
+        for response, count in (
+            responses[~responses.isin(list(answer_scores.get(column[0], {})))]
+            .value_counts()
+            .items()
+        ):
+            unmapped[(column[0], response)] += count
+
+    fill_rates = (survey != "").mean()
+    report = {
+        "input_file": str(INPUT_FILEPATH),
+        "rows": len(survey),
+        "would_load": len(survey) - rejected,
+        "would_reject": rejected,
+        "unmapped_answers": [
+            {"question_id": question_id, "response": response, "count": count}
+            for (question_id, response), count in unmapped.most_common()
+        ],
+        "errors": [
+            {"column": column_index, "error": error, "count": count}
+            for (column_index, error), count in errors.most_common()
+        ],
+        "fill_rates": [
+            {
+                "column": i,
+                "question": questions[i]["question description"],
+                "context": questions[i]["question context"],
+                "fill_rate": round(float(fill_rates[i]), 4),
+            }
+            for i in range(len(questions))
+        ],
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+    print(
+        f"{report['input_file']}: {report['rows']} rows, {report['would_load']} would load, "
+        f"{report['would_reject']} would be rejected ({report['seconds']} s)"
+    )
+    if unmapped:
+        print("Unmapped answers (these would not be scored or loaded):")
+        for answer in report["unmapped_answers"]:
+            print(
+                f"    question {answer['question_id']}: {answer['response']!r} x{answer['count']}"
+            )
+    if errors:
+        print("Errors:")
+        for error in report["errors"]:
+            print(
+                f"    column {error['column']}: {error['error']} x{error['count']}"
+            )
+    print("Fill rate by column:")
+    for column in report["fill_rates"]:
+        print(
+            f"    {column['column']:>4} {100 * column['fill_rate']:6.1f}%  {column['question']}"
+            + (f" ({column['context']})" if column["context"] else "")
+        )
+
+    if json_filepath:
+        with open(json_filepath, "w") as f_out:
+            json.dump(report, f_out, indent=2)
+    return report
+
+
+def ingest_all_years(
+    year_exports,
+    log_level="WARNING",
+    stats_json=None,
+    ingest=None,
+    **ingest_options,
+):
+    """
+    Ingest several years of exports at once, each into its own schema, with one process (and connection) per year.
+    Rebuilding history then takes about as long as the slowest year.
+
+    :param year_exports: list of (input filepath, schema) pairs, e.g. [("2023.csv", "sac_survey_2023"), ...]
+    :param log_level: logging level in each year's process; messages are prefixed with the schema.  Each year's
+                      start, finish and failure are logged as warnings, so they show at the default level
+    :param stats_json: also save the timing summary of every year to this json file, keyed by schema
+    :param ingest: function which ingests a year; default is main().  Must be picklable, e.g.
+                   partial(reload_through_shadow, before_swap=[...])
+    :param ingest_options: keyword arguments to ingest(), used for every year
+    :return: dict of schema: timing summary
+    """
+    schemas = [schema for _, schema in year_exports]
+    assert len(set(schemas)) == len(
+        schemas
+    ), "Each year must be loaded into a different schema"
+
+    summaries = {}
+    failed = []
+    # a DuckDB file can only be written by one process at a time, so its years are loaded one after another
+    max_workers = (
+        1 if is_duckdb(DATABASE_CONNECTION_STRING) else len(year_exports)
+    )
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                ingest_year,
+                input_filepath,
+                schema,
+                log_level,
+                ingest_options,
+                ingest or main,
+            ): schema
+            for input_filepath, schema in year_exports
+        }
+        for future in as_completed(futures):
+            schema = futures[future]
+            try:
+                summaries[schema] = future.result()
+            except Exception:
+                # the other years keep going; this year's transaction was not committed
+                logging.exception("%s failed", schema)
+                failed.append(schema)
+                continue
+            logging.warning(
+                "%s finished: %s rows in %s s (%s of %s years done)",
+                schema,
+                summaries[schema]["rows"],
+                summaries[schema]["total_seconds"],
+                len(summaries) + len(failed),
+                len(futures),
+            )
+
+    if stats_json:
+        with open(stats_json, "w") as f_out:
+            json.dump(summaries, f_out, indent=2)
+    if failed:
+        raise RuntimeError(f"Ingest failed for {', '.join(sorted(failed))}")
+    return summaries
+
+
+def ingest_year(input_filepath, schema, log_level, ingest_options, ingest):
+    """
+    Run in a worker process: ingest one year's export into its schema with ingest(**ingest_options).
+    """
+    global INPUT_FILEPATH, DATABASE_SCHEMA
+    INPUT_FILEPATH, DATABASE_SCHEMA = input_filepath, schema
+    logging.basicConfig(
+        level=log_level,
+        format=f"{schema}: %(levelname)s %(message)s",
+        force=True,
+    )
+    logging.warning("Started loading %s", input_filepath)
+    return ingest(**ingest_options)
+
+
+# suffixes of the schemas used by reload_through_shadow()
+SHADOW_SUFFIX = "_shadow"
+PREVIOUS_SUFFIX = "_previous"
+
+
+def reload_through_shadow(
+    before_swap=(),
+    build_scripts=(
+        "01_build_database.sql",
+        "01b_build_aggregate_views.sql",
+    ),
+    **ingest_options,
+):
+    """
+    Reload the survey without touching the live schema until the new data is complete: build an empty copy of the
+    schema, ingest into it with main(), run any before_swap scripts on it, then swap it in place of the live schema
+    with swap_schemas().  Readers of the live schema, like the charts, neither wait for the reload nor see it half
+    done.
+
+    :param before_swap: SQL scripts to run on the new schema before it's swapped in, e.g. 03_QA_Checks.sql.  The
+                        SCRIPT_SCHEMA in them is replaced with the shadow schema
+    :param build_scripts: SQL scripts which build the schema, run in order; the SCRIPT_SCHEMA in them is replaced
+                          too
+    :param ingest_options: keyword arguments to main()
+    :return: timing summary from main()
+    """
+    global DATABASE_SCHEMA
+    assert (
+        "postgresql" in DATABASE_CONNECTION_STRING
+    ), "Swapping schemas needs Postgres"
+    assert not (
+        ingest_options.get("incremental") or ingest_options.get("resume")
+    ), "The shadow schema is loaded from scratch, so --incremental and --resume don't apply"
+
+    live_schema = DATABASE_SCHEMA
+    shadow_schema = live_schema + SHADOW_SUFFIX
+    # the scripts name SCRIPT_SCHEMA, so any year (e.g. with --year) can be reloaded
+    replacements = {SCRIPT_SCHEMA: shadow_schema}
+    eng = create_engine(DATABASE_CONNECTION_STRING)
+
+    # a shadow schema left by a failed reload is replaced
+    with eng.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {shadow_schema} CASCADE;"))
+    for filepath in build_scripts:
+        run_sql_script(filepath, DATABASE_CONNECTION_STRING, replacements)
+    logging.info("Built %s from %s", shadow_schema, ", ".join(build_scripts))
+
+    DATABASE_SCHEMA = shadow_schema
+    try:
+        summary = main(**ingest_options)
+    finally:
+        DATABASE_SCHEMA = live_schema
+
+    for filepath in before_swap:
+        logging.info("Running %s on %s", filepath, shadow_schema)
+        run_sql_script(filepath, DATABASE_CONNECTION_STRING, replacements)
+
+    swap_schemas(eng, live_schema, shadow_schema)
+    return summary
+
+
+def swap_schemas(eng, live_schema, shadow_schema) -> None:
+    """
+    Put shadow_schema in place of live_schema, in one transaction.  Renaming a schema doesn't lock its tables, so
+    queries already running on the live schema finish on the old tables, and every query after the commit sees the
+    new ones.
+
+    The old live schema is kept as live_schema + PREVIOUS_SUFFIX until the next swap, so a bad reload can be undone
+    by renaming it back.
+    """
+    previous_schema = live_schema + PREVIOUS_SUFFIX
+    with eng.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {previous_schema} CASCADE;"))
+        live_exists = conn.execute(
+            text(
+                "SELECT 1 FROM information_schema.schemata WHERE schema_name = :schema_name"
+            ),
+            {"schema_name": live_schema},
+        ).scalar()
+        if live_exists:
+            conn.execute(
+                text(
+                    f"ALTER SCHEMA {live_schema} RENAME TO {previous_schema};"
+                )
+            )
+        conn.execute(
+            text(f"ALTER SCHEMA {shadow_schema} RENAME TO {live_schema};")
+        )
+    logging.info(
+        "Swapped %s in as %s; the old data is in %s",
+        shadow_schema,
+        live_schema,
+        previous_schema,
+    )
+
+
+def select_new_or_changed_rows(conn, rows):
+    """
+    Compare each row against the ingest watermark and keep only the rows which are new, or which have changed since
+    they were loaded (e.g. a respondent edited their survey).
+    Responses already loaded for changed respondents are deleted, since an answer may have been cleared; everything
+    else for those respondents is upserted.
+
+    DuckDB rejects updating a respondent while any responses reference it, even ones deleted earlier in the same
+    transaction, so main() commits these deletions before loading.  Their watermarks are deleted too, so if the
+    load then fails, the next incremental ingest loads those respondents again.
+
+    :param conn: sqlalchemy connection, with the schema already set
+    :param rows: iterable of rows from the survey export, after the header
+    :return rows: list of rows to load
+    """
+    ingested = dict(
+        conn.execute(
+            text("SELECT respondent_id, row_hash FROM ingest_watermarks;")
+        ).fetchall()
+    )
+    latest_end_datetime = conn.execute(
+        text("SELECT MAX(end_datetime) FROM ingest_watermarks;")
+    ).scalar()
+    logging.info(
+        "Watermark: %s respondents loaded, latest response ended %s",
+        len(ingested),
+        latest_end_datetime,
+    )
+
+    new_or_changed_rows = []
+    changed_respondent_ids = []
+    for row in rows:
+        loaded_hash = ingested.get(int(row[0]))
+        if loaded_hash == hash_row(row):
+            continue
+        if loaded_hash is not None:
+            changed_respondent_ids.append(int(row[0]))
+        new_or_changed_rows.append(row)
+    logging.info(
+        "%s new rows, %s changed rows",
+        len(new_or_changed_rows) - len(changed_respondent_ids),
+        len(changed_respondent_ids),
+    )
+
+    if changed_respondent_ids:
+        tablenames = ["question_rank_responses", "question_open_responses"]
+        if is_duckdb(DATABASE_CONNECTION_STRING):
+            tablenames.append("ingest_watermarks")
+        for tablename in tablenames:
+            conn.execute(
+                text(
+                    f"DELETE FROM {tablename} WHERE respondent_id = ANY(:respondent_ids);"
+                ),
+                {"respondent_ids": changed_respondent_ids},
+            )
+    return new_or_changed_rows
+
+
+def update_watermarks(conn, rows):
+    """
+    Record the rows which were loaded, so the next incremental ingest can skip them.
+
+    :param conn: sqlalchemy connection, with the schema already set
+    :param rows: rows from the survey export which were loaded
+    :return: None
+    """
+    copy_to_table(
+        conn,
+        "ingest_watermarks",
+        ["respondent_id", "end_datetime", "row_hash"],
+        [[row[0], convert_to_datetime(row[3]), hash_row(row)] for row in rows],
+        upsert=True,
+    )
+
+
+def hash_row(row) -> str:
+    """
+    Fingerprint of a raw row, to tell if it changed between exports.
+    """
+    return hashlib.sha256("\x1f".join(row).encode()).hexdigest()
+
+
+def load_with_pandas(conn, plan, reader="arrow"):
+    """
+    Alternative to parsing row by row: read the whole export into a DataFrame, unpivot the answers into the
+    response tables and compute the per-respondent averages with vectorized operations, then COPY each table.
+    Table contents are the same as the row by row path.
+
+    :param conn: sqlalchemy connection, with the schema already set
+    :param plan: column plan from build_column_plan()
+    :param reader: "arrow" or "csv", see read_export_dataframe()
+    :return: None
+    """
+    with STATS.stage("parse"):
+        respondents, rank_responses, open_responses = parse_dataframe(
+            conn, plan, reader
+        )
+    STATS.count("rows", len(respondents))
+
+    with STATS.stage("load"):
+        for tablename, table in [
+            ("respondents", respondents),
+            (
+                "question_rank_responses",
+                rank_responses[
+                    [
+                        "respondent_id",
+                        "question_id",
+                        "grammar",
+                        "middle",
+                        "high",
+                        "response_value",
+                    ]
+                ],
+            ),
+            (
+                "question_open_responses",
+                open_responses[
+                    [
+                        "respondent_id",
+                        "question_id",
+                        "grammar",
+                        "middle",
+                        "high",
+                        "whole_school",
+                        "response",
+                    ]
+                ],
+            ),
+        ]:
+            logging.info("Loading %s rows into %s", len(table), tablename)
+            copy_dataframe_to_table(conn, tablename, table)
+
+
+def parse_dataframe(conn, plan, reader="arrow"):
+    """
+    Parse the whole export with vectorized operations.
+
+    :param conn: sqlalchemy connection, with the schema already set
+    :param plan: column plan from build_column_plan()
+    :param reader: "arrow" or "csv", see read_export_dataframe()
+    :return respondents, rank_responses, open_responses: a DataFrame for each table
+    """
+    survey = read_export_dataframe(reader)
+
+    # one row for each column which is loaded into a response table
+    columns = pd.DataFrame(
+        [
+            [i, column[0], column[3], *column[2]]
+            for i, column in enumerate(plan)
+            if column is not None
+        ],
+        columns=[
+            "column",
+            "question_id",
+            "converter",
+            "grammar",
+            "middle",
+            "high",
+            "whole_school",
+        ],
+    )
+
+    # unpivot from one column per question/level to one row per answered question/level
+    answers = survey[columns.column.tolist()].to_numpy()
+    row, column = np.nonzero(answers != "")
+    responses = columns.iloc[column].reset_index(drop=True)
+    responses["row"] = row
+    responses["respondent_id"] = survey[0].to_numpy()[row]
+    responses["response"] = answers[row, column]
+
+    # map answer text to a value with question_response_mapping; answers which aren't in it are reported, not loaded
+    rank_responses = responses[responses.converter == "int"].merge(
+        pd.read_sql(
+            sql="SELECT question_id, response_text AS response, response_value FROM question_response_mapping",
+            con=conn,
+        ),
+        how="left",
+        on=["question_id", "response"],
+    )
+    unmapped = rank_responses.response_value.isna()
+    if unmapped.any():
+        report_unknown_answers(
+            rank_responses.loc[
+                unmapped, ["question_id", "response"]
+            ].itertuples(index=False)
+        )
+        rank_responses = rank_responses[~unmapped]
+    rank_responses["response_value"] = rank_responses.response_value.astype(
+        "Int16"
+    )
+    open_responses = responses[responses.converter == "text"]
+
+    # average score for each respondent, by level and overall
+    level = rank_responses[["grammar", "middle", "high"]].idxmax(axis=1)
+    level_avgs = (
+        rank_responses.groupby(["row", level])
+        .response_value.mean()
+        .unstack()
+        .reindex(columns=["grammar", "middle", "high"])
+        .add_suffix("_avg")
+    )
+    overall_avg = rank_responses.groupby("row").response_value.mean()
+
+    respondents = pd.DataFrame(
+        {
+            "respondent_id": survey[0],
+            "collector_id": survey[1],
+            "start_datetime": pd.to_datetime(
+                survey[2], format=SURVEY_DATETIME_FORMAT
+            ),
+            "end_datetime": pd.to_datetime(
+                survey[3], format=SURVEY_DATETIME_FORMAT
+            ),
+            "num_individuals_in_response": map_unique(
+                survey[9], convert_to_num_individuals
+            ).astype("Int16"),
+            "tenure": map_unique(
+                survey[133], lambda value: int(value) if value else None
+            ).astype("Int64"),
+            "minority": map_unique(survey[135], convert_to_bool).astype(
+                "boolean"
+            ),
+            "any_support": map_unique(survey[134], convert_to_bool).astype(
+                "boolean"
+            ),
+        }
+    ).join(level_avgs)
+    respondents["overall_avg"] = overall_avg
+    return respondents, rank_responses, open_responses
+
+
+def read_export_dataframe(reader="arrow"):
+    """
+    Read the rows of the survey export after the two header rows into a DataFrame of strings, one column per
+    column of the export, labeled 0, 1, ...
+
+    :param reader: "arrow" converts the table from read_export_table(); "csv" uses pandas' own csv reader
+    :return: DataFrame
+    """
+    if reader == "arrow":
+        survey = read_export_table(INPUT_FILEPATH).slice(2).to_pandas()
+        survey.columns = range(len(survey.columns))
+        return survey
+
+    return (
+        pd.read_csv(
+            INPUT_FILEPATH, header=None, dtype=str, keep_default_na=False
+        )
+        .iloc[2:]  # header rows
+        .reset_index(drop=True)
+    )
+
+
+# frames parsed by read_survey_export(), keyed by the export's path, size and modification time
+SURVEY_EXPORT_CACHE_DIR = PLAN_CACHE_DIR / "survey_exports"
+
+
+def read_survey_export(
+    filepath=None, catalog_filepath="01_build_database.sql", use_cache=True
+):
+    """
+    Read a survey export for exploration, e.g. in a notebook, without a database.
+
+    Columns are labeled with a MultiIndex of (question, context) from the fixed and validated header, see
+    inspect_header().  The export repeats each question in every grade level section, and each respondent only
+    answers one section, so the repeated columns are combined into one.  Rank and multiple choice answers are
+    categoricals, ordered by question_response_mapping; yes/no answers are categoricals too, and open responses
+    are strings, with blanks as missing values.
+
+    The frame is saved as Parquet in SURVEY_EXPORT_CACHE_DIR, so reading the same export again is fast.
+
+    :param filepath: export to read; default is INPUT_FILEPATH
+    :param catalog_filepath: questions and answer mapping, see load_catalog()
+    :param use_cache: set False to parse the export again even if it was saved
+    :return: DataFrame with one row per respondent
+    """
+    filepath = Path(filepath or INPUT_FILEPATH)
+    stat = filepath.stat()
+    catalog_stat = Path(catalog_filepath).stat()
+    cache_key = hashlib.sha256(
+        json.dumps(
+            [
+                str(filepath.resolve()),
+                stat.st_size,
+                stat.st_mtime_ns,
+                str(catalog_filepath),
+                catalog_stat.st_mtime_ns,
+            ]
+        ).encode()
+    ).hexdigest()
+    cache_file = SURVEY_EXPORT_CACHE_DIR / f"{cache_key[:16]}.parquet"
+    if use_cache and cache_file.exists():
+        logging.info("Using saved survey export %s", cache_file)
+        return pd.read_parquet(cache_file)
+
+    catalog = load_catalog(catalog_filepath)
+    questions = inspect_header(None, "arrow", catalog, filepath)
+    answer_texts = defaultdict(list)
+    for question_id, _, response_text in sorted(
+        catalog["question_response_mapping"], key=lambda row: row[:2]
+    ):
+        answer_texts[question_id].append(response_text)
+
+    survey = read_export_table(filepath).slice(2).to_pandas()
+
+    # columns of the export for each (question, context), in the order they first appear
+    labels = defaultdict(list)
+    for i in range(len(questions)):
+        labels[
+            (
+                questions[i]["question description"],
+                questions[i]["question context"] or "",
+            )
+        ].append(i)
+
+    columns = {}
+    for label, indexes in labels.items():
+        values = survey[[str(i) for i in indexes]].to_numpy()
+        answered = values != ""
+        conflicts = int((answered.sum(axis=1) > 1).sum())
+        if conflicts:
+            logging.warning(
+                "%s rows answer %s in more than one section; keeping the first answer",
+                conflicts,
+                label,
+            )
+        # the first answered column of each row, or a blank
+        values = pd.Series(
+            values[np.arange(len(values)), answered.argmax(axis=1)]
+        )
+        columns[label] = convert_export_column(
+            values, questions[indexes[0]], answer_texts
+        )
+
+    df = pd.DataFrame(columns)
+    df.columns.names = ["question", "context"]
+
+    SURVEY_EXPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(cache_file)
+    logging.info("Saved survey export %s", cache_file)
+    return df
+
+
+def convert_export_column(values, question, answer_texts):
+    """
+    Convert one column of the export from strings, for read_survey_export().
+
+    :param values: Series of str, with blanks as empty strings
+    :param question: the column's entry from inspect_header()
+    :param answer_texts: dict of question_id: list of answer texts, ordered by response_value
+    :return: Series
+    """
+    description = question["question description"]
+    question_type = question.get("question type")
+    values = values.mask(values == "")
+
+    if description in ("Respondent ID", "Collector ID"):
+        return pd.to_numeric(values).astype("Int64")
+    if description in ("Start Date", "End Date"):
+        return pd.to_datetime(values, format=SURVEY_DATETIME_FORMAT)
+    if question_type == "numeric":
+        return pd.to_numeric(values).astype("Int16")
+    if question_type in ("rank", "multiple choice"):
+        categories = answer_texts.get(question["question_id"], [])
+        unknown = set(values.dropna()) - set(categories)
+        if not unknown:
+            return pd.Series(
+                pd.Categorical(values, categories=categories, ordered=True)
+            )
+        logging.warning(
+            "Answers to %r which aren't in question_response_mapping: %s",
+            description,
+            sorted(unknown),
+        )
+        return values.astype("category")
+    if question_type == "boolean":
+        return pd.Series(pd.Categorical(values, categories=["No", "Yes"]))
+    return values.astype("string")
+
+
+def copy_dataframe_to_table(conn, tablename: str, df: pd.DataFrame) -> None:
+    """
+    Load a DataFrame into a table with COPY, letting pandas write the CSV instead of formatting each value in python.
+    Missing values are loaded as NULL; so would empty strings, but none of the ingested columns can be empty.
+
+    :param conn: connection to database
+    :param tablename: name of the table into which the values will be inserted
+    :param df: one column per table column, named the same
+    :return: None
+    """
+    cursor = conn.connection.cursor()
+    if not hasattr(cursor, "copy_expert"):
+        copy_to_table(
+            conn,
+            tablename,
+            df.columns.tolist(),
+            df.astype(object).where(df.notna(), None).values.tolist(),
+        )
+        return
+
+    data = StringIO()
+    df.to_csv(data, index=False, header=False)
+    data.seek(0)
+    cursor.copy_expert(
+        f'COPY {tablename} ({", ".join(df.columns)}) FROM STDIN WITH (FORMAT csv)',
+        data,
+    )
+    STATS.count("statements")
+
+
+def map_unique(series, func):
+    """
+    Apply a converter once per distinct value in a Series, rather than once per row.
+    """
+    return series.map({value: func(value) for value in series.unique()})
+
+
+# staging tables for the sql engine; kept after the ingest so the raw export can be audited
+RAW_EXPORT_TABLE = "raw_survey_export"
+RAW_COLUMNS_TABLE = "raw_survey_columns"
+
+
+def load_with_sql(conn, plan):
+    """
+    Alternative to parsing in Python: COPY the raw export, unchanged, into a staging table, along with the column
+    plan, then fill the respondents and response tables with set-based INSERT ... SELECT statements which unpivot
+    the answers inside Postgres.  Answer text is mapped to values through question_response_mapping; answers which
+    aren't in it are reported and not loaded.  Table contents are the same as the row by row path.
+
+    The staging tables are replaced by each ingest, and kept afterwards for audits:
+    RAW_EXPORT_TABLE has one TEXT column per column of the export (c0, c1, ...) plus line_number; lines 1 and 2
+    are the header rows.  RAW_COLUMNS_TABLE has one row per column of the export which is loaded into a response
+    table.
+
+    :param conn: sqlalchemy connection, with the schema already set
+    :param plan: column plan from build_column_plan()
+    :return: None
+    """
+    raw_columns = [f"c{i}" for i in range(len(plan))]
+
+    with STATS.stage("load"):
+        conn.execute(text(f"DROP TABLE IF EXISTS {RAW_EXPORT_TABLE};"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {RAW_EXPORT_TABLE} (line_number BIGINT GENERATED ALWAYS AS IDENTITY, "
+                + ", ".join(f"{column} TEXT" for column in raw_columns)
+                + ");"
+            )
+        )
+        # the file is sent as is; blanks are loaded as empty strings, the same as the csv module reads them
+        with open(INPUT_FILEPATH, "rb") as f_in:
+            conn.connection.cursor().copy_expert(
+                f'COPY {RAW_EXPORT_TABLE} ({", ".join(raw_columns)}) FROM STDIN '
+                f'WITH (FORMAT csv, FORCE_NOT_NULL ({", ".join(raw_columns)}))',
+                f_in,
+            )
+        STATS.count("statements")
+
+        conn.execute(text(f"DROP TABLE IF EXISTS {RAW_COLUMNS_TABLE};"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {RAW_COLUMNS_TABLE} (column_number SMALLINT PRIMARY KEY, "
+                "question_id SMALLINT NOT NULL, question_type TEXT NOT NULL, grammar BOOLEAN NOT NULL, "
+                "middle BOOLEAN NOT NULL, high BOOLEAN NOT NULL, whole_school BOOLEAN NOT NULL);"
+            )
+        )
+        copy_to_table(
+            conn,
+            RAW_COLUMNS_TABLE,
+            [
+                "column_number",
+                "question_id",
+                "question_type",
+                "grammar",
+                "middle",
+                "high",
+                "whole_school",
+            ],
+            [
+                [i, column[0], column[1], *column[2]]
+                for i, column in enumerate(plan)
+                if column is not None
+            ],
+        )
+
+    with STATS.stage("unpivot"):
+        # one row per answered question/level; the planned columns are unpivoted with a single unnest per row
+        planned_columns = [
+            i for i, column in enumerate(plan) if column is not None
+        ]
+        conn.execute(
+            text(
+                f"""
+                CREATE TEMPORARY TABLE staged_answers AS
+                SELECT e.c0::BIGINT AS respondent_id, c.question_id, c.question_type,
+                       c.grammar, c.middle, c.high, c.whole_school, a.response,
+                       m.response_value
+                FROM {RAW_EXPORT_TABLE} e
+                CROSS JOIN LATERAL unnest(
+                    ARRAY[{", ".join(f"e.c{i}" for i in planned_columns)}],
+                    ARRAY[{", ".join(str(i) for i in planned_columns)}]
+                ) AS a(response, column_number)
+                JOIN {RAW_COLUMNS_TABLE} c USING (column_number)
+                LEFT JOIN question_response_mapping m
+                    ON c.question_type = 'rank'
+                    AND m.question_id = c.question_id
+                    AND m.response_text = a.response
+                WHERE e.line_number > 2  -- header rows
+                  AND a.response <> '';
+                """
+            )
+        )
+
+        unmapped = conn.execute(
+            text(
+                "SELECT question_id, response FROM staged_answers "
+                "WHERE question_type = 'rank' AND response_value IS NULL;"
+            )
+        ).fetchall()
+        if unmapped:
+            report_unknown_answers(unmapped)
+
+        # Survey Monkey dates are parsed with an explicit format, like convert_to_datetime(), rather than by the
+        # server's DateStyle.  In UTC, converting to_timestamp()'s TIMESTAMPTZ to TIMESTAMP keeps the same wall clock
+        # time, even across daylight saving changes
+        conn.execute(text("SET LOCAL TIME ZONE 'UTC';"))
+
+        # respondents first, for the foreign keys.  Averages only count rank answers; each belongs to one level
+        inserted = conn.execute(
+            text(
+                f"""
+                INSERT INTO respondents (respondent_id, collector_id, start_datetime, end_datetime,
+                                         num_individuals_in_response, tenure, minority, any_support,
+                                         grammar_avg, middle_avg, high_avg, overall_avg)
+                SELECT e.c0::BIGINT, e.c1::BIGINT,
+                       to_timestamp(NULLIF(e.c2, ''), '{SQL_DATETIME_FORMAT}')::TIMESTAMP,
+                       to_timestamp(NULLIF(e.c3, ''), '{SQL_DATETIME_FORMAT}')::TIMESTAMP,
+                       CASE e.c9
+                           WHEN 'Each parent or guardian will submit a separate survey, and we will submit two surveys.' THEN 1
+                           WHEN 'All parents and guardians will coordinate responses, and we will submit only one survey.' THEN 2
+                       END,
+                       NULLIF(e.c133, '')::INTEGER,
+                       CASE e.c135 WHEN 'Yes' THEN TRUE WHEN 'No' THEN FALSE END,
+                       CASE e.c134 WHEN 'Yes' THEN TRUE WHEN 'No' THEN FALSE END,
+                       avgs.grammar_avg, avgs.middle_avg, avgs.high_avg, avgs.overall_avg
+                FROM {RAW_EXPORT_TABLE} e
+                LEFT JOIN (
+                    SELECT respondent_id,
+                           AVG(response_value) FILTER (WHERE grammar) AS grammar_avg,
+                           AVG(response_value) FILTER (WHERE middle AND NOT grammar) AS middle_avg,
+                           AVG(response_value) FILTER (WHERE high AND NOT grammar AND NOT middle) AS high_avg,
+                           AVG(response_value) AS overall_avg
+                    FROM staged_answers
+                    WHERE question_type = 'rank'
+                    GROUP BY respondent_id
+                ) avgs ON avgs.respondent_id = e.c0::BIGINT
+                WHERE e.line_number > 2;
+                """
+            )
+        )
+        STATS.count("rows", inserted.rowcount)
+
+        conn.execute(
+            text(
+                """
+                INSERT INTO question_rank_responses (respondent_id, question_id, grammar, middle, high,
+                                                     response_value)
+                SELECT respondent_id, question_id, grammar, middle, high, response_value
+                FROM staged_answers
+                WHERE question_type = 'rank'
+                  AND response_value IS NOT NULL;
+                """
+            )
+        )
+        conn.execute(
+            text(
+                """
+                INSERT INTO question_open_responses (respondent_id, question_id, grammar, middle, high,
+                                                     whole_school, response)
+                SELECT respondent_id, question_id, grammar, middle, high, whole_school, response
+                FROM staged_answers
+                WHERE question_type = 'open response';
+                """
+            )
+        )
+        conn.execute(text("DROP TABLE staged_answers;"))
+
+
+def parse_in_parallel(decoder, rows, workers, chunk_size, parse=None):
+    """
+    Parse rows in a pool of worker processes, a chunk at a time.
+    Results are yielded in the same order as the rows, and only a few chunks are in flight at once so memory stays
+    bounded for large exports.
+
+    :param decoder: RowDecoder for the export
+    :param rows: iterable of rows from the survey export, after the header
+    :param workers: number of worker processes; 0 uses every core
+    :param chunk_size: number of rows sent to a worker at a time
+    :param parse: called as parse(decoder, row) on each row; must be picklable.  Default is parse_row()
+    :return: generator of parse() results
+    """
+    parse = parse or parse_row
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        max_in_flight = 2 * workers
+        in_flight = deque()
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) < chunk_size:
+                continue
+            in_flight.append(
+                executor.submit(parse_chunk, parse, decoder, chunk)
+            )
+            chunk = []
+            if len(in_flight) >= max_in_flight:
+                yield from in_flight.popleft().result()
+        if chunk:
+            in_flight.append(
+                executor.submit(parse_chunk, parse, decoder, chunk)
+            )
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def parse_chunk(parse, decoder, rows):
+    """
+    Parse a list of rows.  Runs in a worker process, so must stay a module level function.
+    """
+    return [parse(decoder, row) for row in rows]
+
+
+# bits of RowDecoder.rank_levels and open_levels, for the levels a column of the export belongs to
+GRAMMAR, MIDDLE, HIGH, WHOLE_SCHOOL = 1, 2, 4, 8
+
+
+class RowDecoder:
+    """
+    Decode rows of the export into DecodedRow records, using lookup tables built once from the column plan and
+    question_response_mapping.
+
+    Rank answers are scored by looking them up in their question's mapping, rather than guessing from the text like
+    convert_to_int().  Answers which aren't in the mapping are listed on the record instead of being scored.
+    """
+
+    __slots__ = (
+        "rank_columns",
+        "rank_question_ids",
+        "rank_levels",
+        "rank_lookups",
+        "open_columns",
+        "open_question_ids",
+        "open_levels",
+        "rank_keys",
+        "open_keys",
+        "average_levels",
+        "rank_values",
+        "open_values",
+    )
+
+    def __init__(self, plan, answer_scores):
+        """
+        :param plan: column plan from build_column_plan()
+        :param answer_scores: from load_answer_scores()
+        """
+        self.rank_columns = array("H")
+        self.rank_question_ids = array("h")
+        self.rank_levels = array("B")
+        # {answer text: score}, shared by the columns of each question
+        self.rank_lookups = []
+        # which average each rank column counts towards: 0 grammar, 1 middle, 2 high, 3 none
+        self.average_levels = array("b")
+        self.open_columns = array("H")
+        self.open_question_ids = array("h")
+        self.open_levels = array("B")
+        # question_id and level columns of the response table rows from each column, so only the answer is added
+        # when parsing
+        self.rank_keys = []
+        self.open_keys = []
+
+        for i, column in enumerate(plan):
+            if column is None:
+                continue
+            question_id, _, levels, converter = column
+            level_bits = sum(
+                bit
+                for bit, in_level in zip(
+                    (GRAMMAR, MIDDLE, HIGH, WHOLE_SCHOOL), levels
+                )
+                if in_level
+            )
+            if converter == "int":
+                self.rank_columns.append(i)
+                self.rank_question_ids.append(question_id)
+                self.rank_levels.append(level_bits)
+                self.rank_lookups.append(answer_scores.get(question_id, {}))
+                self.average_levels.append(
+                    levels[:3].index(True) if any(levels[:3]) else 3
+                )
+                self.rank_keys.append(level_columns(question_id, level_bits))
+            else:
+                self.open_columns.append(i)
+                self.open_question_ids.append(question_id)
+                self.open_levels.append(level_bits)
+                self.open_keys.append(
+                    level_columns(question_id, level_bits, whole_school=True)
+                )
+
+        # fetch every rank or open response value of a row at once
+        self.rank_values = itemgetter(*self.rank_columns)
+        self.open_values = itemgetter(*self.open_columns)
+
+    def decode(self, row, answers=None):
+        """
+        :param row: list(str) of raw values from the survey export
+        :param answers: decode_answers(row), if it has already been called
+        :return: DecodedRow
+        """
+        answers = answers or self.decode_answers(row)
+        scores, open_responses, unknown_answers = answers
+        return DecodedRow(
+            respondent_id=row[0],
+            collector_id=row[1],
+            start_datetime=convert_to_datetime(row[2]),
+            end_datetime=convert_to_datetime(row[3]),
+            num_individuals_in_response=convert_to_num_individuals(row[9]),
+            tenure=int(row[133]) if row[133] else None,
+            minority=convert_to_bool(row[135]),
+            any_support=convert_to_bool(row[134]),
+            scores=scores,
+            open_responses=open_responses,
+            unknown_answers=unknown_answers,
+        )
+
+    def decode_answers(self, row):
+        """
+        :param row: list(str) of raw values from the survey export
+        :return scores, open_responses, unknown_answers: see DecodedRow
+        """
+        responses = self.rank_values(row)
+        scores = array("b", bytes(len(responses)))
+        unknown_answers = []
+        # only the answered columns are visited; each respondent answers one section of the survey
+        for j in compress(range(len(responses)), responses):
+            score = self.rank_lookups[j].get(responses[j])
+            if score is None:
+                unknown_answers.append(
+                    (
+                        self.rank_columns[j],
+                        self.rank_question_ids[j],
+                        responses[j],
+                    )
+                )
+            else:
+                scores[j] = score
+
+        responses = self.open_values(row)
+        open_responses = [
+            (j, responses[j])
+            for j in compress(range(len(responses)), responses)
+        ]
+        return scores, open_responses, unknown_answers
+
+
+def level_columns(question_id, levels, whole_school=False):
+    """
+    :param question_id: question of a column of the export
+    :param levels: bitmask of the levels the column belongs to
+    :param whole_school: include the whole_school column, which only question_open_responses has
+    :return: dict of the question_id and level columns of the response tables
+    """
+    columns = dict(
+        question_id=question_id,
+        grammar=bool(levels & GRAMMAR),
+        middle=bool(levels & MIDDLE),
+        high=bool(levels & HIGH),
+    )
+    if whole_school:
+        columns["whole_school"] = bool(levels & WHOLE_SCHOOL)
+    return columns
+
+
+class DecodedRow:
+    """
+    One respondent, decoded by RowDecoder.decode().
+
+    scores has one int8 per rank column of the export, in the order of RowDecoder.rank_columns, with 0 for no
+    answer.  open_responses is a list of (position in RowDecoder.open_columns, text) for the answered open response
+    columns, and unknown_answers a list of (column index, question_id, text) for rank answers which weren't scored.
+    """
+
+    __slots__ = (
+        "respondent_id",
+        "collector_id",
+        "start_datetime",
+        "end_datetime",
+        "num_individuals_in_response",
+        "tenure",
+        "minority",
+        "any_support",
+        "scores",
+        "open_responses",
+        "unknown_answers",
+    )
+
+    def __init__(
+        self,
+        respondent_id,
+        collector_id,
+        start_datetime,
+        end_datetime,
+        num_individuals_in_response,
+        tenure,
+        minority,
+        any_support,
+        scores,
+        open_responses,
+        unknown_answers,
+    ):
+        self.respondent_id = respondent_id
+        self.collector_id = collector_id
+        self.start_datetime = start_datetime
+        self.end_datetime = end_datetime
+        self.num_individuals_in_response = num_individuals_in_response
+        self.tenure = tenure
+        self.minority = minority
+        self.any_support = any_support
+        self.scores = scores
+        self.open_responses = open_responses
+        self.unknown_answers = unknown_answers
+
+
+def parse_row(decoder, row):
+    """
+    Parse one row of the survey (one respondent) into rows for the respondents, question_rank_responses, and
+    question_open_responses tables.
+
+    :param decoder: RowDecoder for the export
+    :param row: list(str) of raw values from the survey export
+    :return respondent, rank_responses, open_responses: dict of column values, and a list of those for each response
+    """
+    decoded = decoder.decode(row)
+    if decoded.unknown_answers:
+        report_unknown_answers(
+            (question_id, response)
+            for _, question_id, response in decoded.unknown_answers
+        )
+    return tables_from_decoded(decoder, decoded)
+
+
+def tables_from_decoded(decoder, decoded):
+    """
+    :param decoder: RowDecoder which decoded the row
+    :param decoded: DecodedRow
+    :return respondent, rank_responses, open_responses: see parse_row()
+    """
+    respondent_id = decoded.respondent_id
+    scores = decoded.scores
+    rank_keys = decoder.rank_keys
+    average_levels = decoder.average_levels
+    rank_responses = []
+    grammar_rank_questions = []
+    middle_rank_questions = []
+    high_rank_questions = []
+    # indexed by RowDecoder.average_levels
+    level_scores = (
+        grammar_rank_questions,
+        middle_rank_questions,
+        high_rank_questions,
+        [],
+    )
+    # only the answered columns are visited; unanswered ones score 0
+    for j in compress(range(len(scores)), scores):
+        score = scores[j]
+        rank_responses.append(
+            dict(
+                rank_keys[j], respondent_id=respondent_id, response_value=score
+            )
+        )
+        level_scores[average_levels[j]].append(score)
+
+    open_keys = decoder.open_keys
+    open_responses = [
+        dict(open_keys[j], respondent_id=respondent_id, response=response)
+        for j, response in decoded.open_responses
+    ]
+
+    all_rank_questions = (
+        grammar_rank_questions + middle_rank_questions + high_rank_questions
+    )
+
+    # Create the respondent, including demographic information
+    respondent = dict(
+        respondent_id=respondent_id,
+        collector_id=decoded.collector_id,
+        start_datetime=decoded.start_datetime,
+        end_datetime=decoded.end_datetime,
+        num_individuals_in_response=decoded.num_individuals_in_response,
+        tenure=decoded.tenure,
+        minority=decoded.minority,
+        any_support=decoded.any_support,
+        grammar_avg=(
+            sum(grammar_rank_questions) / len(grammar_rank_questions)
+            if len(grammar_rank_questions) > 0
+            else None
+        ),
+        middle_avg=(
+            sum(middle_rank_questions) / len(middle_rank_questions)
+            if len(middle_rank_questions) > 0
+            else None
+        ),
+        high_avg=(
+            sum(high_rank_questions) / len(high_rank_questions)
+            if len(high_rank_questions) > 0
+            else None
+        ),
+        overall_avg=(
+            sum(all_rank_questions) / len(all_rank_questions)
+            if len(all_rank_questions) > 0
+            else None
+        ),
+    )
+    return respondent, rank_responses, open_responses
+
+
+def parse_checked_row(decoder, row):
+    """
+    Same as parse_row(), but first check the values which the converters would silently turn into the wrong value
+    or None, and catch conversion errors, so the row can be rejected instead of failing the ingest.  Answers which
+    aren't in question_response_mapping are errors here, rather than being left out.
+
+    :param decoder: RowDecoder for the export
+    :param row: list(str) of raw values from the survey export
+    :return row, parsed, errors: parsed is the result of parse_row(), or None if there are errors, which are a list
+             of (column index or None, message)
+    """
+    answers = decoder.decode_answers(row)
+    _, _, unknown_answers = answers
+    errors = []
+    if not row[0].isdigit():
+        errors.append((0, f"respondent_id is not a number: {row[0]!r}"))
+    for i, question_id, response in unknown_answers:
+        errors.append(
+            (i, f"Unknown answer to question {question_id}: {response!r}")
+        )
+    if row[9] and convert_to_num_individuals(row[9]) is None:
+        errors.append((9, f"Unknown method of submission: {row[9]!r}"))
+    if row[133] and not row[133].isdigit():
+        errors.append((133, f"tenure is not a number: {row[133]!r}"))
+    for i in (2, 3):
+        try:
+            convert_to_datetime(row[i])
+        except ValueError:
+            errors.append((i, f"Not a date: {row[i]!r}"))
+    for i in (134, 135):
+        if row[i] and convert_to_bool(row[i]) is None:
+            errors.append((i, f"Expected Yes or No: {row[i]!r}"))
+    if errors:
+        return row, None, errors
+
+    try:
+        decoded = decoder.decode(row, answers)
+    except (ValueError, IndexError) as e:
+        return row, None, [(None, f"{type(e).__name__}: {e}")]
+    return row, tables_from_decoded(decoder, decoded), []
+
+
+def report_unknown_answers(unknown_answers) -> None:
+    """
+    Warn about rank answers which aren't in question_response_mapping, and so aren't scored or loaded.  Add them to
+    the mapping in 01_build_database.sql to load them.
+
+    :param unknown_answers: iterable of (question_id, answer text)
+    """
+    counts = Counter(
+        (int(question_id), response)
+        for question_id, response in unknown_answers
+    )
+    STATS.count("unknown answers", sum(counts.values()))
+    for (question_id, response), count in counts.most_common():
+        logging.warning(
+            "Not scoring %s answer(s) to question %s which aren't in question_response_mapping: %r",
+            count,
+            question_id,
+            response,
+        )
+
+
+def convert_to_num_individuals(value):
+    return (
+        1
+        if value
+        == "Each parent or guardian will submit a separate survey, and we will submit two surveys."
+        else (
+            2
+            if value
+            == "All parents and guardians will coordinate responses, and we will submit only one survey."
+            else None
+        )
+    )
+
+
+def convert_to_datetime(value):
+    if not value:
+        return None
+    # strptime() is slow, so the usual zero padded dates are parsed directly; anything else, including errors, is
+    # left to it
+    match = SURVEY_DATETIME_PATTERN.fullmatch(value)
+    if match:
+        month, day, year, hour, minute, second, am_pm = match.groups()
+        hour = int(hour)
+        if 1 <= hour <= 12:
+            try:
+                return datetime(
+                    int(year),
+                    int(month),
+                    int(day),
+                    hour % 12 + (12 if am_pm == "PM" else 0),
+                    int(minute),
+                    int(second),
+                )
+            except ValueError:
+                pass
+    return datetime.strptime(value, SURVEY_DATETIME_FORMAT)
+
+
+def convert_to_bool(value):
+    return True if value == "Yes" else False if value == "No" else None
+
+
+def convert_to_int(value):
+    if value.startswith("Extremely") or value.startswith("Strongly"):
+        return 4
+    if value.startswith("Somewhat"):
+        return 2
+    if value.startswith("Not"):
+        return 1
+    if len(value) == 0:
+        return None
+    return 3
+
+
+def argument_parser():
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Load the Survey Monkey export into the database"
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Buffer all rows and load each table with one COPY; default is one INSERT per value",
+    )
+    parser.add_argument(
+        "--no-plan-cache",
+        dest="use_plan_cache",
+        action="store_false",
+        help="Rebuild the column plan from the header even if a saved plan exists",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to parse rows; 0 uses every core; default is 1 (no worker processes)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="Number of rows sent to a worker process at a time; default is 1000",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["rows", "pandas", "sql"],
+        default="rows",
+        help="rows: parse one row at a time; pandas: parse the whole export with vectorized operations, "
+        "then load with COPY; sql: COPY the raw export into a staging table and unpivot it inside Postgres; "
+        "default is rows",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only load rows which are new or changed since the last ingest into this schema; changed rows are upserted",
+    )
+    parser.add_argument(
+        "--stats-json",
+        type=str,
+        default=None,
+        help="Save the timing summary (rows/sec, statements, time in each stage) to this json file",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING"],
+        default="WARNING",
+        help="INFO shows progress and the timing summary; default is WARNING",
+    )
+    parser.add_argument(
+        "--reader",
+        choices=["arrow", "csv"],
+        default="arrow",
+        help="arrow parses the export a block at a time into columns; csv uses the csv module; default is arrow",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Commit every N rows with a checkpoint, instead of the whole file in one transaction",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="With --batch-size, continue after the rows committed by an earlier run of the same file",
+    )
+    parser.add_argument(
+        "--reject",
+        action="store_true",
+        help="Set aside rows which fail conversion or constraints in the rejected_rows table and load the rest",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Don't connect to the database; validate the header and convert every row in memory, then report "
+        "row counts, unmapped answers, errors and the fill rate of each column",
+    )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        default="01_build_database.sql",
+        help="With --dry-run, read the questions and answer mapping from this SQL or json file; "
+        "default is 01_build_database.sql",
+    )
+    parser.add_argument(
+        "--shadow",
+        action="store_true",
+        help="Load into a fresh copy of the schema, then swap it in place of the live one in one transaction, so "
+        "charts and queries can keep running during the reload.  The old data is kept in SCHEMA_previous",
+    )
+    parser.add_argument(
+        "--before-swap",
+        action="append",
+        default=[],
+        metavar="SCRIPT",
+        help="With --shadow, run this SQL script (e.g. 03_QA_Checks.sql) on the new schema before swapping it in; "
+        "may be repeated",
+    )
+    parser.add_argument(
+        "--year",
+        dest="year_exports",
+        nargs=2,
+        action="append",
+        metavar=("INPUT_FILEPATH", "SCHEMA"),
+        help="Ingest this export into this schema instead of the ones in .env; repeat to load several years concurrently",
+    )
+    parser.add_argument(
+        "--input",
+        dest="input_filepath",
+        metavar="INPUT_FILEPATH",
+        help="Read this export instead of INPUT_FILEPATH in .env",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = vars(argument_parser())
+    log_level = args.pop("log_level")
+    logging.basicConfig(level=log_level)
+    year_exports = args.pop("year_exports")
+    catalog = args.pop("catalog")
+    before_swap = args.pop("before_swap")
+    input_filepath = args.pop("input_filepath")
+    assert not (
+        input_filepath and year_exports
+    ), "--year gives each export, so --input doesn't apply"
+    if input_filepath:
+        INPUT_FILEPATH = input_filepath
+    dry = args.pop("dry_run")
+    # --dry-run needs no database, and --year gives each export and schema
+    load_env_vars(
+        required=[]
+        if dry
+        else ["DATABASE_CONNECTION_STRING"]
+        if year_exports
+        else ["DATABASE_SCHEMA", "DATABASE_CONNECTION_STRING"]
+    )
+    assert (
+        INPUT_FILEPATH or year_exports
+    ), "Give the export with --input, or INPUT_FILEPATH in .env"
+    ingest = main
+    if args.pop("shadow"):
+        ingest = partial(reload_through_shadow, before_swap=before_swap)
+    else:
+        assert not before_swap, "--before-swap needs --shadow"
+    if dry:
+        dry_run(
+            catalog, reader=args["reader"], json_filepath=args["stats_json"]
+        )
+    elif year_exports:
+        ingest_all_years(
+            year_exports, log_level=log_level, ingest=ingest, **args
+        )
+    else:
+        ingest(**args)
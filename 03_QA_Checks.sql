@@ -23,6 +23,25 @@ WHERE responses_by_respondents.respondent_id = respondents.respondent_id
   AND NOT has_rank_response
 ;
 
+-- Refresh the aggregate views from 01b_build_aggregate_views.sql, so reports leave out the soft deleted respondents.
+-- Only the ones which have been built; 01b is optional
+DO
+$$
+    DECLARE
+        view_name TEXT;
+    BEGIN
+        FOREACH view_name IN ARRAY ARRAY ['respondent_segments', 'rank_response_aggregates']
+            LOOP
+                IF EXISTS(SELECT
+                          FROM pg_matviews
+                          WHERE schemaname = current_schema()
+                            AND matviewname = view_name) THEN
+                    EXECUTE format('REFRESH MATERIALIZED VIEW CONCURRENTLY %I', view_name);
+                END IF;
+            END LOOP;
+    END
+$$;
+
 -- Look at those who didn't do any ranked choice, but did do open response.  What were their responses?
 SELECT respondent_id,
        ROUND(EXTRACT(EPOCH FROM end_datetime - start_datetime) / 60, 1) AS minutes_elapsed,
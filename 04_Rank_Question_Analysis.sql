@@ -1,5 +1,8 @@
 /*
  Summary of ranked questions
+
+ Responses are counted from the rank_response_aggregates view (01b_build_aggregate_views.sql), which 02 refreshes
+ after each ingest and 03 after the soft deletes.
  */
 
 -- Set search path to the survey schema
@@ -8,40 +11,47 @@ SET search_path to sac_survey_2024;
 WITH question_totals AS
          (
              SELECT question_id,
-                    COUNT(0)::NUMERIC                                  AS question_total,
-                    COUNT(0) FILTER ( WHERE grammar )::NUMERIC         AS grammar_total,
-                    COUNT(0) FILTER ( WHERE high )::NUMERIC            AS high_total,
-                    COUNT(0) FILTER ( WHERE minority )::NUMERIC        AS minority_total,
-                    COUNT(0) FILTER ( WHERE NOT minority )::NUMERIC    AS not_minority_total,
-                    COUNT(0) FILTER ( WHERE any_support )::NUMERIC     AS recieves_support_total,
-                    COUNT(0) FILTER ( WHERE NOT any_support )::NUMERIC AS no_support_total,
-                    COUNT(0) FILTER ( WHERE tenure = 1)::NUMERIC       AS first_year_family_total,
-                    COUNT(0) FILTER ( WHERE tenure > 1)::NUMERIC       AS not_first_year_family_total,
-                    COUNT(0) FILTER ( WHERE tenure <= 3)::NUMERIC      AS third_or_less_year_family_total,
-                    COUNT(0) FILTER ( WHERE tenure > 3)::NUMERIC       AS more_than_third_year_family_total
-             FROM question_rank_responses
-                      LEFT JOIN
-                  respondents USING (respondent_id)
+                    SUM(num_responses)::NUMERIC                                                                AS question_total,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE level = 'Grammar' ), 0)::NUMERIC                AS grammar_total,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE level = 'High' ), 0)::NUMERIC                   AS high_total,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE minority_segment = 'Minority' ), 0)::NUMERIC    AS minority_total,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE minority_segment = 'Not Minority' ), 0)::NUMERIC AS not_minority_total,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE support_segment = 'Received Support' ), 0)::NUMERIC                AS recieves_support_total,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE support_segment = 'Did not Receive Support' ), 0)::NUMERIC         AS no_support_total,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE first_year_segment = 'First Year Family' ), 0)::NUMERIC            AS first_year_family_total,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE tenure_bucket IN ('2-3 Years', 'More than 3 Years') ), 0)::NUMERIC AS not_first_year_family_total,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE tenure_bucket IN ('1 Year', '2-3 Years') ), 0)::NUMERIC            AS third_or_less_year_family_total,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE tenure_bucket = 'More than 3 Years' ), 0)::NUMERIC                 AS more_than_third_year_family_total
+             FROM rank_response_aggregates
              GROUP BY question_id
          ),
      response_totals AS
          (
              SELECT question_id,
                     response_value,
-                    COUNT(0)                                      AS total,
-                    COUNT(0) FILTER ( WHERE grammar )             AS grammar,
-                    COUNT(0) FILTER ( WHERE high )                AS high,
-                    COUNT(0) FILTER ( WHERE minority )            AS minority,
-                    COUNT(0) FILTER ( WHERE NOT minority )        AS not_minority,
-                    COUNT(0) FILTER ( WHERE any_support )         AS recieves_support,
-                    COUNT(0) FILTER ( WHERE NOT any_support )     AS no_support,
-                    COUNT(0) FILTER ( WHERE tenure = 1)::NUMERIC  AS first_year_family,
-                    COUNT(0) FILTER ( WHERE tenure > 1)::NUMERIC  AS not_first_year_family,
-                    COUNT(0) FILTER ( WHERE tenure <= 3)::NUMERIC AS third_year_family,
-                    COUNT(0) FILTER ( WHERE tenure > 3)::NUMERIC  AS not_third_year_family
-             FROM question_rank_responses
-                      LEFT JOIN
-                  respondents USING (respondent_id)
+                    SUM(num_responses)                                                                         AS total,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE level = 'Grammar' ), 0)                         AS grammar,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE level = 'High' ), 0)                            AS high,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE minority_segment = 'Minority' ), 0)             AS minority,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE minority_segment = 'Not Minority' ), 0)         AS not_minority,
+                    COALESCE(SUM(num_responses) FILTER ( WHERE support_segment = 'Received Support' ), 0)      AS recieves_support,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE support_segment = 'Did not Receive Support' ), 0)                  AS no_support,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE first_year_segment = 'First Year Family' ), 0)::NUMERIC            AS first_year_family,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE tenure_bucket IN ('2-3 Years', 'More than 3 Years') ), 0)::NUMERIC AS not_first_year_family,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE tenure_bucket IN ('1 Year', '2-3 Years') ), 0)::NUMERIC            AS third_year_family,
+                    COALESCE(SUM(num_responses)
+                             FILTER ( WHERE tenure_bucket = 'More than 3 Years' ), 0)::NUMERIC                 AS not_third_year_family
+             FROM rank_response_aggregates
              GROUP BY question_id, response_value
          )
 SELECT question_id,
@@ -82,30 +92,22 @@ ORDER BY question_id, response_value
 
 
 -- What % of responses are Satisfied or Very Satisfied (weighted by # individuals)?
-SELECT ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 ) /
-             SUM(family.num_individuals_in_response), 1)                           AS overall,
+SELECT ROUND(100. * SUM(weighted_responses) FILTER ( WHERE response_value >= 3 ) /
+             SUM(weighted_responses), 1)                                                   AS overall,
 
-       ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.grammar) /
-             SUM(family.num_individuals_in_response) FILTER ( WHERE q.grammar), 1) AS grammar,
+       ROUND(100. * SUM(weighted_responses) FILTER ( WHERE response_value >= 3 AND level = 'Grammar') /
+             SUM(weighted_responses) FILTER ( WHERE level = 'Grammar'), 1)                 AS grammar,
 
-       ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.middle) /
-             SUM(family.num_individuals_in_response) FILTER ( WHERE q.middle ), 1) AS middle,
+       ROUND(100. * SUM(weighted_responses) FILTER ( WHERE response_value >= 3 AND level = 'Middle') /
+             SUM(weighted_responses) FILTER ( WHERE level = 'Middle' ), 1)                 AS middle,
 
-       ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.high) /
-             SUM(family.num_individuals_in_response) FILTER ( WHERE q.high ), 1)   AS high,
+       ROUND(100. * SUM(weighted_responses) FILTER ( WHERE response_value >= 3 AND level = 'High') /
+             SUM(weighted_responses) FILTER ( WHERE level = 'High' ), 1)                   AS high,
 
-       ROUND(100. * (
-                       SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.middle) +
-                       SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.high)
-           ) / (
-                             SUM(family.num_individuals_in_response) FILTER ( WHERE q.middle) +
-                             SUM(family.num_individuals_in_response) FILTER ( WHERE q.high)
-                 ), 1)                                                             AS upper
-FROM respondents AS family
-         JOIN
-     question_rank_responses AS q USING (respondent_id)
+       ROUND(100. * SUM(weighted_responses) FILTER ( WHERE response_value >= 3 AND level IN ('Middle', 'High')) /
+             SUM(weighted_responses) FILTER ( WHERE level IN ('Middle', 'High')), 1)       AS upper
+FROM rank_response_aggregates
 WHERE NOT soft_delete
-  AND overall_avg IS NOT NULL
 ;
 
 -- What % of parents/guardians had an average score of 3 or above, broken out by grammar/middle/high.
@@ -154,10 +156,8 @@ FROM satisfaction_per_group
 WITH responses AS
          (
              SELECT response_value,
-                    SUM(num_individuals_in_response) AS num_responses
-             FROM question_rank_responses
-                      JOIN
-                  respondents USING (respondent_id)
+                    SUM(weighted_responses) AS num_responses
+             FROM rank_response_aggregates
              WHERE NOT soft_delete
              GROUP BY response_value
              ORDER BY response_value DESC
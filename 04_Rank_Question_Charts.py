@@ -1,23 +1,41 @@
+import argparse
+import logging
+import re
+import textwrap
+from concurrent.futures import ProcessPoolExecutor
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache, partial
 from pathlib import Path
 
+import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine.base import Engine as sqlalchemy_Engine
 
-from utilities import load_env_vars
+from utilities import (
+    existing_aggregate_views,
+    is_rendered,
+    load_env_vars,
+    load_render_manifest,
+    render_key,
+    save_render_manifest,
+)
 
 _, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
 
 
-def query_to_bar_chart(
+def query_to_chart(
     conn: sqlalchemy_Engine,
     title: str,
     x_axis_label: str,
     x_data_label_query: str,
     proportion_query: str,
     subfolder: Path = None,
-) -> None:
+) -> dict:
     """
     Execute two queries and modify results to feed the creation of a stacked bar chart.
     :param conn:
@@ -26,7 +44,7 @@ def query_to_bar_chart(
     :param x_data_label_query:
     :param proportion_query:
     :param subfolder:
-    :return:
+    :return: chart, the keyword arguments to create_stacked_bar_chart()
     """
 
     x_data_labels = pd.read_sql(
@@ -34,7 +52,7 @@ def query_to_bar_chart(
     ).title.tolist()
     proportions = pd.read_sql(con=conn, sql=proportion_query)
 
-    create_stacked_bar_chart(
+    return dict(
         title=title,
         x_axis_label=x_axis_label,
         x_data_labels=x_data_labels,
@@ -43,254 +61,536 @@ def query_to_bar_chart(
     )
 
 
+# Response values from the top of each bar down, which is also the order of the legend: (value, label, color).
+# A tuple, so it can key the cached legend and template; pass another like it to chart other categories.
+RESPONSE_STYLES = (
+    (4, "Very", "#6caf40"),
+    (3, "Satisfied", "#4080af"),
+    (2, "Somewhat", "#f6c100"),
+    (1, "Not", "#ae3f3f"),
+)
+
+
 def create_stacked_bar_chart(
     title: str,
     x_axis_label: str,
     x_data_labels: list,
     proportions: pd.DataFrame,
     subfolder: Path = None,
-) -> None:
+    file_format: str = "png",
+    show: bool = True,
+    styles: tuple = RESPONSE_STYLES,
+) -> Path:
     """
     Save a stacked bar chart to ./artifacts/
 
+    With show, the chart is drawn on a new pyplot figure and shown, e.g. in a notebook, then closed.  Without it,
+    the chart is drawn on this process's stacked_bar_template() and nothing is left open, so saving many charts in a
+    row doesn't use more memory or time for each.
+
     :param x_axis_label:
     :param title:
     :param x_data_labels:
-    :param proportions: {bottom_color_in_each_bar: [col1, col2, col3...],
-                         second_from_bottom_color_in_each_bar: [col1, col2, col3...], ...}
+    :param proportions: DataFrame with a row for each response_value, and pct, a list of its proportion in each bar
+    :param subfolder: Optional, otherwise use the title
+    :param file_format: any format matplotlib can save, e.g. png, svg or pdf
+    :param show: also show the chart
+    :param styles: the categories stacked in each bar, like RESPONSE_STYLES
+    :return: path of the saved chart
+    """
+    if show:
+        fig, ax = plt.subplots()
+        style_axes(ax, styles)
+    else:
+        fig, ax = stacked_bar_template(styles)
+        # clear the bars of the last chart; the legend and y axis stay
+        for container in list(ax.containers):
+            container.remove()
+
+    draw_stacked_bars(
+        ax, title, x_axis_label, x_data_labels, proportions, styles
+    )
+
+    fig.tight_layout()
+    filepath = chart_filepath(title, subfolder, file_format)
+    fig.savefig(filepath, format=file_format, transparent=True)
+    if show:
+        plt.show()
+        plt.close(fig)
+    return filepath
+
+
+def create_small_multiples(
+    title: str,
+    charts: list,
+    ncols: int = 3,
+    subfolder: Path = None,
+    file_format: str = "png",
+    show: bool = True,
+    styles: tuple = RESPONSE_STYLES,
+) -> Path:
+    """
+    Save a grid of stacked bar charts as one figure, e.g. every rank question by grade level, with one legend and a
+    shared y axis.
+
+    :param title: of the whole figure, and its file name
+    :param charts: list of keyword arguments to create_stacked_bar_chart(), e.g. from by_grade_level(), one per panel
+    :param ncols: panels in each row
     :param subfolder: Optional, otherwise use the title
-    :return:
-    """
-    r1 = proportions[proportions.response_value == 1].pct.values.tolist()[0]
-    r2 = proportions[proportions.response_value == 2].pct.values.tolist()[0]
-    r3 = proportions[proportions.response_value == 3].pct.values.tolist()[0]
-    r4 = proportions[proportions.response_value == 4].pct.values.tolist()[0]
-
-    fig, ax = plt.subplots()
-    ax.bar(
-        x_data_labels,
-        r4,
-        label="Very",
-        color="#6caf40",
-        bottom=[q1 + q2 + q3 for q1, q2, q3 in zip(r1, r2, r3)],
-    )
-    ax.bar(
-        x_data_labels,
-        r3,
-        label="Satisfied",
-        color="#4080af",
-        bottom=[q1 + q2 for q1, q2 in zip(r1, r2)],
-    )
-    ax.bar(x_data_labels, r2, label="Somewhat", color="#f6c100", bottom=r1)
-    ax.bar(x_data_labels, r1, label="Not", color="#ae3f3f")
+    :param file_format: see create_stacked_bar_chart()
+    :param show: also show the figure
+    :param styles: see create_stacked_bar_chart()
+    :return: path of the saved figure
+    """
+    nrows = -(-len(charts) // ncols)
+    figsize = (4 * ncols, 3.5 * nrows + 1)
+    if show:
+        fig = plt.figure(figsize=figsize, layout="constrained")
+    else:
+        fig = Figure(figsize=figsize, layout="constrained")
+    axes = fig.subplots(nrows, ncols, sharey=True, squeeze=False)
+
+    for ax, chart in zip(axes.flat, charts):
+        draw_stacked_bars(
+            ax,
+            textwrap.fill(chart["title"].replace("_", " "), 40),
+            chart["x_axis_label"],
+            chart["x_data_labels"],
+            chart["proportions"],
+            styles,
+        )
+    for ax in axes.flat[len(charts) :]:
+        ax.remove()
+    for ax in axes[:, 0]:
+        ax.set_ylabel("Proportion")
+    fig.suptitle(title)
+    fig.legend(
+        handles=legend_handles(styles),
+        loc="outside lower center",
+        ncol=len(styles),
+    )
+
+    filepath = chart_filepath(title, subfolder, file_format)
+    fig.savefig(filepath, format=file_format, transparent=True)
+    if show:
+        plt.show()
+        plt.close(fig)
+    return filepath
+
+
+def small_multiples(title, charts, ncols=3, subfolder=None):
+    """
+    :return: chart, the keyword arguments to create_small_multiples(), which render_charts() also accepts
+    """
+    return dict(title=title, charts=charts, ncols=ncols, subfolder=subfolder)
+
+
+def draw_stacked_bars(
+    ax,
+    title,
+    x_axis_label,
+    x_data_labels,
+    proportions,
+    styles=RESPONSE_STYLES,
+):
+    """
+    Draw the bars, title, and x axis of a chart from create_stacked_bar_chart() on axes styled by style_axes().
+    """
+    # stack the categories from the bottom of each bar up: each starts where the ones below it add up to
+    heights = proportions_matrix(
+        proportions, [value for value, _, _ in reversed(styles)]
+    )
+    bottoms = np.zeros_like(heights)
+    bottoms[1:] = np.cumsum(heights[:-1], axis=0)
+
+    # bars are placed by position rather than by label, so a reused axes doesn't keep the last chart's labels
+    x = np.arange(len(x_data_labels))
+    for (_, _, color), height, bottom in zip(
+        reversed(styles), heights, bottoms
+    ):
+        ax.bar(x, height, color=color, bottom=bottom)
+    ax.set_xticks(x, x_data_labels)
 
     ax.set_title(title)
-    ax.legend(loc="upper center", ncol=4)
     ax.set_xlabel(x_axis_label)
+    # fit the axes to these bars only
+    ax.relim()
+    ax.autoscale_view()
+
+
+def proportions_matrix(proportions, response_values):
+    """
+    :param proportions: see create_stacked_bar_chart()
+    :param response_values: the rows to return, in order
+    :return: float array with a row for each response value and a column for each bar
+    """
+    return np.array(
+        proportions.set_index("response_value")
+        .pct.loc[list(response_values)]
+        .tolist(),
+        dtype=float,
+    )
+
+
+def style_axes(ax, styles=RESPONSE_STYLES):
+    """
+    Add what every stacked bar chart has in common: the legend and the y axis.
+    """
+    ax.legend(
+        handles=legend_handles(styles), loc="upper center", ncol=len(styles)
+    )
     ax.set_ylabel("Proportion")
 
-    plt.tight_layout()
-    plt.savefig(
-        subfolder / title if subfolder else f"artifacts/{title}",
-        transparent=True,
+
+@lru_cache(maxsize=None)
+def legend_handles(styles=RESPONSE_STYLES):
+    """
+    Legend entries for the categories, made once and shared by every chart.
+    """
+    return tuple(
+        Patch(facecolor=color, label=label) for _, label, color in styles
     )
-    plt.show()
 
 
-def create_question_summary(conn):
-    query_to_bar_chart(
-        conn=conn,
-        title="Response Breakdown by Question",
-        x_axis_label="Question ID\n(avg score)",
-        x_data_label_query="""
-            WITH question_avg_score AS
-                     (
-                         SELECT question_id::TEXT,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                         GROUP BY question_id
-            
-                     UNION ALL
-            
-                         SELECT 'Total'                                                                                                 AS question_id,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-            
-                         ORDER BY question_id
-                     )
-            SELECT CONCAT(question_id, E'\n',
-                          '(', avg_score, ')'
-                       ) AS title
-            FROM question_avg_score
-            """,
-        proportion_query="""
-            WITH question_response_counts AS
-                     (
-                         SELECT question_id::TEXT,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                         GROUP BY question_id, response_value
-            
-                         UNION ALL
-            
-                         SELECT 'Total'                          AS question_id,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                         GROUP BY response_value
-                     ),
-                 question_totals AS
-                     (
-                         SELECT question_id,
-                                SUM(num_responses) AS total
-                         FROM question_response_counts
-                         GROUP BY question_id
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY question_id) AS pct
-            FROM question_response_counts
+@lru_cache(maxsize=None)
+def stacked_bar_template(styles=RESPONSE_STYLES):
+    """
+    A figure and axes, styled by style_axes(), which every chart saved by this process without show is drawn on.
+    It is a plain Figure rather than a pyplot one, so pyplot never holds a reference to it.
+
+    :param styles: see create_stacked_bar_chart(); there is a template for each
+    :return fig, ax: Figure, Axes
+    """
+    fig = Figure()
+    ax = fig.add_subplot()
+    style_axes(ax, styles)
+    return fig, ax
+
+
+def chart_filepath(title, subfolder=None, file_format="png", **_):
+    """
+    Where create_stacked_bar_chart() saves a chart.  Takes the same keyword arguments, so a chart's can be passed.
+    """
+    return (subfolder or Path("artifacts")) / f"{title}.{file_format}"
+
+
+def chart_render_key(chart, file_format="png"):
+    """
+    render_key() of everything a chart is drawn from: its data and labels, the response colors, and the figure
+    settings.
+    """
+    return render_key(
+        chart=chart,
+        file_format=file_format,
+        styles=RESPONSE_STYLES,
+        dpi=[
+            matplotlib.rcParams["figure.dpi"],
+            matplotlib.rcParams["savefig.dpi"],
+        ],
+        figsize=matplotlib.rcParams["figure.figsize"],
+    )
+
+
+def render_charts(
+    charts, workers=1, file_format="png", show=False, use_cache=True
+):
+    """
+    Save charts.  With more than one worker, they are rendered in a pool of processes using the non-interactive Agg
+    backend, since matplotlib is the slow part of regenerating every chart.
+
+    Charts which were saved before from the same data and settings, according to the render manifest in
+    artifacts/, aren't rendered again; e.g. after a soft delete in 03_QA_Checks.sql, only the charts including that
+    respondent are.
+
+    :param charts: list of keyword arguments to create_stacked_bar_chart(), e.g. from create_grade_summary(), or
+                   create_small_multiples(), from small_multiples()
+    :param workers: number of processes to render in; 1 renders in this process, 0 uses every core
+    :param file_format: see create_stacked_bar_chart()
+    :param show: show each chart as it's saved, for a preview; they are rendered in this process, one at a time
+    :param use_cache: set False to render every chart, even unchanged ones
+    :return: list of the paths of the saved charts, in the same order
+    """
+    filepaths = [
+        chart_filepath(**chart, file_format=file_format) for chart in charts
+    ]
+    keys = [chart_render_key(chart, file_format) for chart in charts]
+    manifest = load_render_manifest()
+    stale = [
+        chart
+        for chart, filepath, key in zip(charts, filepaths, keys)
+        if show or not use_cache or not is_rendered(manifest, filepath, key)
+    ]
+    logging.info("Rendering %s of %s charts", len(stale), len(charts))
+
+    render = partial(render_chart, file_format=file_format, show=show)
+    if workers == 1 or show or len(stale) < 2:
+        for chart in stale:
+            render(chart)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers or None,
+            initializer=matplotlib.use,
+            initargs=("Agg",),
+        ) as executor:
+            list(executor.map(render, stale))
+
+    save_render_manifest(dict(zip(filepaths, keys)))
+    return filepaths
+
+
+def render_chart(chart, file_format="png", show=False):
+    """
+    Save one chart, or grid of them from small_multiples(), for render_charts().  Runs in a worker process, so
+    must stay a module level function.
+    """
+    if "charts" in chart:
+        return create_small_multiples(
+            **chart, file_format=file_format, show=show
+        )
+    return create_stacked_bar_chart(
+        **chart, file_format=file_format, show=show
+    )
+
+
+# Dimensions of the response cube: columns of rank_response_aggregates (see 01b_build_aggregate_views.sql), and the
+# same labels computed from the raw tables for databases without the view, like DuckDB
+RESPONSE_CUBE_DIMENSIONS = {
+    "question_id": "question_id",
+    "level": """
+        CASE WHEN grammar THEN 'Grammar'
+             WHEN middle THEN 'Middle'
+             WHEN high THEN 'High'
+             END""",
+    "support_segment": """
+        CASE WHEN any_support THEN 'Received Support'
+             WHEN NOT any_support THEN 'Did not Receive Support'
+             ELSE 'Did not answer'
+             END""",
+    "minority_segment": """
+        CASE WHEN minority THEN 'Minority'
+             WHEN NOT minority THEN 'Not Minority'
+             ELSE 'Did not answer'
+             END""",
+    "first_year_segment": """
+        CASE WHEN tenure = 1 THEN 'First Year Family'
+             WHEN NOT tenure = 1 THEN 'Returning Family'
+             ELSE 'Did not answer'
+             END""",
+}
+
+# Combinations of dimensions the charts break responses out by; () is the total over every rank question
+RESPONSE_CUBE_GROUPING_SETS = [
+    (),
+    ("question_id",),
+    ("level",),
+    ("question_id", "level"),
+    ("question_id", "support_segment"),
+    ("question_id", "minority_segment"),
+    ("question_id", "first_year_segment"),
+]
+
+RESPONSE_VALUES = [1, 2, 3, 4]
+
+
+def load_response_cube(conn, schema=DATABASE_SCHEMA) -> pd.DataFrame:
+    """
+    Count the responses to every rank question by each of the grouping sets the charts use, in one query.  The
+    counts are rolled up from the precomputed rank_response_aggregates view if it has been built, otherwise from
+    one scan of question_rank_responses JOIN respondents.  Responses are weighted by num_individuals_in_response,
+    and soft-deleted respondents are left out.
+
+    :param conn: sqlalchemy connection, with the survey schema set
+    :param schema: the survey schema
+    :return: DataFrame with a column for each of RESPONSE_CUBE_DIMENSIONS (None where it was rolled up),
+             response_value, num_responses, and grouped_by, the tuple of dimensions from RESPONSE_CUBE_GROUPING_SETS
+    """
+    dimensions = list(RESPONSE_CUBE_DIMENSIONS)
+    if "rank_response_aggregates" in existing_aggregate_views(conn, schema):
+        responses = f"""
+            SELECT {", ".join(dimensions)},
+                   response_value,
+                   weighted_responses
+            FROM rank_response_aggregates
+            WHERE NOT soft_delete"""
+    else:
+        responses = f"""
+            SELECT {", ".join(f"{expression} AS {name}" for name, expression in RESPONSE_CUBE_DIMENSIONS.items())},
+                   response_value,
+                   num_individuals_in_response AS weighted_responses
+            FROM question_rank_responses
                      JOIN
-                 question_totals USING (question_id)
-            GROUP BY response_value
+                 respondents USING (respondent_id)
+            WHERE NOT soft_delete"""
+    grouping_sets = ", ".join(
+        f"({', '.join(['response_value', *grouping_set])})"
+        for grouping_set in RESPONSE_CUBE_GROUPING_SETS
+    )
+    cube = pd.read_sql(
+        con=conn,
+        sql=f"""
+            WITH responses AS ({responses})
+            SELECT {", ".join(dimensions)},
+                   response_value,
+                   SUM(weighted_responses) AS num_responses,
+                   GROUPING({", ".join(dimensions)}) AS grouping_id
+            FROM responses
+            GROUP BY GROUPING SETS ({grouping_sets})
             """,
     )
 
+    # GROUPING() has a bit for each dimension, first dimension highest, which is set if it was rolled up
+    grouping_ids = {
+        sum(
+            1 << (len(dimensions) - 1 - i)
+            for i, dimension in enumerate(dimensions)
+            if dimension not in grouping_set
+        ): grouping_set
+        for grouping_set in RESPONSE_CUBE_GROUPING_SETS
+    }
+    cube["grouped_by"] = cube.pop("grouping_id").map(grouping_ids)
+    cube["question_id"] = cube.question_id.astype("Int16")
+    return cube
+
+
+def response_counts(
+    cube: pd.DataFrame, by: str = None, question_id: int = None
+) -> pd.DataFrame:
+    """
+    Slice the counts for one chart out of the response cube.
+
+    :param cube: from load_response_cube()
+    :param by: dimension to break the responses out by, or None for the total
+    :param question_id: only count responses to this question, or None for every rank question
+    :return: DataFrame with a row for each value of by ("Total" if None), and a column for each response value
+    """
+    grouped_by = tuple(
+        dimension
+        for dimension in RESPONSE_CUBE_DIMENSIONS
+        if dimension == by
+        or (dimension == "question_id" and question_id is not None)
+    )
+    rows = cube[cube.grouped_by == grouped_by]
+    if question_id is not None:
+        rows = rows[rows.question_id == question_id]
+    return (
+        rows.groupby(
+            [rows[by] if by else pd.Series("Total", index=rows.index)]
+            + ["response_value"]
+        )
+        .num_responses.sum()
+        .unstack(fill_value=0)
+        .reindex(columns=RESPONSE_VALUES, fill_value=0)
+    )
+
+
+def average_score(score_sum, total) -> Decimal:
+    """
+    The average score in a bar label, rounded half up like ROUND() on a NUMERIC in SQL, e.g. 3.125 -> 3.13.  Formatting
+    a float rounds half to even, or by its binary value, which would give 3.12.
+
+    :param score_sum: sum of the response values
+    :param total: number of responses
+    :return: average, to 2 places
+    """
+    return (Decimal(int(score_sum)) / Decimal(int(total))).quantize(
+        Decimal("0.01"), ROUND_HALF_UP
+    )
+
+
+def counts_to_chart(
+    title: str,
+    x_axis_label: str,
+    counts: pd.DataFrame,
+    subfolder: Path = None,
+) -> dict:
+    """
+    Feed a stacked bar chart with one bar per row of counts, labeled with the row and its average score.
+    Rows without any responses are left out.
+
+    :param title:
+    :param x_axis_label:
+    :param counts: from response_counts(), in the order of the bars
+    :param subfolder:
+    :return: chart, the keyword arguments to create_stacked_bar_chart()
+    """
+    counts = counts[counts.sum(axis=1) > 0]
+    totals = counts.sum(axis=1)
+    score_sums = (counts * counts.columns).sum(axis=1)
+
+    return dict(
+        title=title,
+        x_axis_label=x_axis_label,
+        x_data_labels=[
+            f"{label}\n({average_score(score_sums[label], totals[label])})"
+            for label in counts.index
+        ],
+        proportions=pd.DataFrame(
+            {
+                "response_value": counts.columns,
+                "pct": [
+                    (counts[response_value] / totals).tolist()
+                    for response_value in counts.columns
+                ],
+            }
+        ),
+        subfolder=subfolder,
+    )
+
+
+def create_question_summary(cube):
+    counts = response_counts(cube, "question_id")
+    return counts_to_chart(
+        title="Response Breakdown by Question",
+        x_axis_label="Question ID\n(avg score)",
+        counts=pd.concat([counts.sort_index(), response_counts(cube)]),
+    )
+
 
-def create_grade_summary(conn):
-    query_to_bar_chart(
-        conn=conn,
+def create_grade_summary(cube):
+    counts = response_counts(cube, "level")
+    return counts_to_chart(
         title="Response_Breakdown_by_Grade_Level",
         x_axis_label="Grade Level\n(avg score)",
-        x_data_label_query="""
-            WITH question_avg_score AS
-                 (
-                     SELECT 'Grammar'                                                                                               AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            1                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND grammar
-        
-                     UNION ALL
-                     SELECT 'Middle'                                                                                               AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            2                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND middle
-        
-                     UNION ALL
-                     SELECT 'High'                                                                                               AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            3                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND high
-       
-                     UNION ALL
-                     SELECT 'Total'                                                                                                 AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            4                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                 )
-            SELECT CONCAT(question_id, E'\n',
-                          '(', avg_score, ')'
-                       ) AS title
-            FROM question_avg_score
-            ORDER BY order_id
-            """,
-        proportion_query="""
-            WITH level_response_counts AS
-                 (
-                     SELECT 'Grammar'                        AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            1                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete AND grammar
-                     GROUP BY response_value
-        
-                     UNION ALL
-                     SELECT 'Middle'                         AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            2                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete AND middle
-                     GROUP BY response_value
-        
-                     UNION ALL
-                     SELECT 'High'                           AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            3                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete AND high
-                     GROUP BY response_value
-        
-                     UNION ALL
-        
-                     SELECT 'Total'                          AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            4                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                     GROUP BY response_value
-                 ),
-             level_totals AS
-                 (
-                     SELECT level_name,
-                            SUM(num_responses) AS total
-                     FROM level_response_counts
-                     GROUP BY level_name
-                 )
-        SELECT response_value,
-               ARRAY_AGG(num_responses::NUMERIC / total 
-                         ORDER BY level_order) AS pct,
-               ARRAY_AGG(level_name
-                         ORDER BY level_order) AS level_names
-        FROM level_response_counts
-                 JOIN
-             level_totals USING (level_name)
-        GROUP BY response_value
-        ;
-        """,
-    )
-
-
-def breakout_by_question(conn):
+        counts=pd.concat(
+            [
+                counts.reindex(["Grammar", "Middle", "High"], fill_value=0),
+                response_counts(cube),
+            ]
+        ),
+    )
+
+
+def breakout_by_question(conn, cube, yearly):
     # iterate over each question
+    charts = []
+    for question_id, summarized_text in rank_questions(conn):
+        charts += [
+            by_grade_level(cube, question_id, summarized_text),
+            by_support_summary(cube, question_id, summarized_text),
+            by_minority_summary(cube, question_id, summarized_text),
+            by_first_year_family_summary(cube, question_id, summarized_text),
+            yoy_question_diff(yearly, question_id, summarized_text),
+        ]
+    return charts
+
+
+def grade_level_small_multiples(conn, cube):
+    """
+    Every rank question by grade level in one figure, for the committee deck
+    """
+    return small_multiples(
+        title="Rank Response by Grade Level",
+        charts=[
+            by_grade_level(cube, question_id, summarized_text)
+            for question_id, summarized_text in rank_questions(conn)
+        ],
+    )
+
+
+def rank_questions(conn):
+    """
+    :return: list of (question_id, summarized question text) for the rank questions, shortened to fit chart titles
+    """
     questions = pd.read_sql_query(
         sql="""
             SELECT question_id,
@@ -300,6 +600,7 @@ def breakout_by_question(conn):
             """,
         con=conn,
     )
+    summarized = []
     for question_id, question_text in questions.itertuples(
         index=False, name=None
     ):
@@ -318,625 +619,369 @@ def breakout_by_question(conn):
             summarized_text = "Communication with teachers"
         elif question_id == 8:
             summarized_text = "Communication with school leadership"
+        summarized.append((question_id, summarized_text))
+    return summarized
 
-        by_grade_level(conn, question_id, summarized_text)
-        by_support_summary(conn, question_id, summarized_text)
-        by_minority_summary(conn, question_id, summarized_text)
-        by_first_year_family_summary(conn, question_id, summarized_text)
-        yoy_question_diff(conn, question_id, summarized_text)
 
-
-def by_grade_level(conn, question_id, summarized_text):
+def by_grade_level(cube, question_id, summarized_text):
     """
     Given a question_id, create a chart breaking out each grade into its own column
     """
     subfolder = Path("artifacts/Rank Response - Grade Level")
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return counts_to_chart(
         title=f"{question_id}:_" + summarized_text,
         subfolder=subfolder,
         x_axis_label="Grade Level",
-        x_data_label_query=f"""
-            SELECT CASE WHEN grammar THEN 'Grammar'
-                        WHEN middle THEN 'Middle'
-                        WHEN high THEN 'High'
-                        END || 
-                        E'\n(' ||
-                        ROUND(
-                            SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                SUM(num_individuals_in_response),
-                            2) || 
-                        ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY grammar, middle, high
-            ORDER BY grammar DESC, middle DESC, high DESC
-                """,
-        proportion_query=f"""
-            WITH expected_values AS
-                     (
-                         SELECT levels.column1          AS level,
-                                levels.column2          AS level_order,
-                                response_values.column1 AS response_value
-                         FROM (VALUES ('Grammar', 1), ('Middle', 2), ('High', 3)) AS levels,
-                              (VALUES (1), (2), (3), (4)) AS response_values
-                     ),
-                 sum_by_grade AS
-                     (
-                         SELECT CASE
-                                    WHEN grammar THEN 'Grammar'
-                                    WHEN middle THEN 'Middle'
-                                    WHEN high THEN 'High'
-                                    END                          AS level,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE question_id = {question_id}
-                         GROUP BY level, response_value
-                     ),
-                 fill_in_blanks AS
-                     (
-                         -- If a level doesn't have any responses, fill it in as 0
-                         SELECT level,
-                                level_order,
-                                response_value,
-                                COALESCE(num_responses, 0) AS num_responses
-                         FROM expected_values
-                                  LEFT JOIN
-                              sum_by_grade USING (level, response_value)
-                     ),
-                 sum_w_totals AS
-                     (
-                         SELECT level,
-                                SUM(num_responses) AS total
-                         FROM fill_in_blanks
-                         GROUP BY level
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY level_order) AS pct
-            FROM fill_in_blanks
-                     JOIN
-                 sum_w_totals USING (level)
-            GROUP BY response_value
-            ;""",
+        counts=response_counts(cube, "level", question_id).reindex(
+            ["Grammar", "Middle", "High"], fill_value=0
+        ),
     )
 
 
-def by_support_summary(conn, question_id, summarized_text):
+def by_support_summary(cube, question_id, summarized_text):
     """
     Given a question_id, create a chart breaking out students who received support services from those who did not
     """
     subfolder = Path("artifacts/Rank Response - Student Services")
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return counts_to_chart(
         title=f"{question_id}:_" + summarized_text,
         subfolder=subfolder,
         x_axis_label="Grade Level",
-        x_data_label_query=f"""
-            SELECT CASE
-                       WHEN respondents.any_support THEN 'Received Support'
-                       WHEN NOT any_support THEN 'Did not Receive Support'
-                       ELSE 'Did not answer'
-                       END ||
-                   E'\n(' ||
-                   ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                            SUM(num_individuals_in_response),
-                         2) ||
-                   ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY any_support
-            ORDER BY any_support DESC NULLS LAST
-                """,
-        proportion_query=f"""
-            WITH expected_values AS
-                     (
-                         SELECT demographics.column1    AS demographic,
-                                demographics.column2    AS demographic_order, -- any_support desc nulls last
-                                response_values.column1 AS response_value
-                         FROM (VALUES ('Received Support', 1),
-                                      ('Did not Receive Support', 2),
-                                      ('Did not answer', 3)) AS demographics,
-                              (VALUES (1), (2), (3), (4)) AS response_values
-                     ),
-                 sum_by_demographic AS
-                     (
-                         SELECT CASE
-                                    WHEN any_support THEN 'Received Support'
-                                    WHEN NOT any_support THEN 'Did not Receive Support'
-                                    ELSE 'Did not answer'
-                                    END                          AS demographic,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE question_id = {question_id}
-                         GROUP BY demographic, response_value
-                     ),
-                 fill_in_blanks AS
-                     (
-                         -- If a demographic doesn't have any responses, fill it in as 0
-                         SELECT demographic,
-                                demographic_order,
-                                response_value,
-                                COALESCE(num_responses, 0) AS num_responses
-                         FROM expected_values
-                                  LEFT JOIN
-                              sum_by_demographic USING (demographic, response_value)
-                     ),
-                 sum_w_totals AS
-                     (
-                         SELECT demographic,
-                                SUM(num_responses) AS total
-                         FROM fill_in_blanks
-                         GROUP BY demographic
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY demographic_order) AS pct
-            FROM fill_in_blanks
-                     JOIN
-                 sum_w_totals USING (demographic)
-            GROUP BY response_value
-            ;""",
+        counts=response_counts(cube, "support_segment", question_id).reindex(
+            ["Received Support", "Did not Receive Support", "Did not answer"],
+            fill_value=0,
+        ),
     )
 
 
-def by_minority_summary(conn, question_id, summarized_text):
+def by_minority_summary(cube, question_id, summarized_text):
     subfolder = Path("artifacts/Rank Response - Minority")
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return counts_to_chart(
         title=f"{question_id}:_" + summarized_text,
         subfolder=subfolder,
         x_axis_label="Grade Level",
-        x_data_label_query=f"""
-            SELECT CASE
-                       WHEN minority THEN 'Minority'
-                       WHEN NOT minority THEN 'Not Minority'
-                       ELSE 'Did not answer'
-                       END ||
-                   E'\n(' ||
-                   ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                            SUM(num_individuals_in_response),
-                         2) ||
-                   ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY minority
-            ORDER BY minority DESC NULLS LAST
-                    """,
-        proportion_query=f"""
-                WITH expected_values AS
-                         (
-                             SELECT demographics.column1    AS demographic,
-                                    demographics.column2    AS demographic_order, -- any_support desc nulls last
-                                    response_values.column1 AS response_value
-                             FROM (VALUES ('Minority', 1),
-                                          ('Not Minority', 2),
-                                          ('Did not answer', 3)) AS demographics,
-                                  (VALUES (1), (2), (3), (4)) AS response_values
-                         ),
-                     sum_by_demographic AS
-                         (
-                             SELECT CASE
-                                        WHEN minority THEN 'Minority'
-                                        WHEN NOT minority THEN 'Not Minority'
-                                        ELSE 'Did not answer'
-                                        END                          AS demographic,
-                                    response_value,
-                                    SUM(num_individuals_in_response) AS num_responses
-                             FROM question_rank_responses
-                                      JOIN
-                                  respondents USING (respondent_id)
-                             WHERE question_id = {question_id}
-                             GROUP BY demographic, response_value
-                         ),
-                     fill_in_blanks AS
-                         (
-                             -- If a demographic doesn't have any responses, fill it in as 0
-                             SELECT demographic,
-                                    demographic_order,
-                                    response_value,
-                                    COALESCE(num_responses, 0) AS num_responses
-                             FROM expected_values
-                                      LEFT JOIN
-                                  sum_by_demographic USING (demographic, response_value)
-                         ),
-                     sum_w_totals AS
-                         (
-                             SELECT demographic,
-                                    SUM(num_responses) AS total
-                             FROM fill_in_blanks
-                             GROUP BY demographic
-                         )
-                SELECT response_value,
-                       ARRAY_AGG(num_responses::NUMERIC / total ORDER BY demographic_order) AS pct
-                FROM fill_in_blanks
-                         JOIN
-                     sum_w_totals USING (demographic)
-                GROUP BY response_value
-                ;""",
-    )
-
-
-def by_first_year_family_summary(conn, question_id, summarized_text):
+        counts=response_counts(cube, "minority_segment", question_id).reindex(
+            ["Minority", "Not Minority", "Did not answer"], fill_value=0
+        ),
+    )
+
+
+def by_first_year_family_summary(cube, question_id, summarized_text):
     subfolder = Path("artifacts/Rank Response - First Year Families")
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return counts_to_chart(
         title=f"{question_id}:_" + summarized_text,
         subfolder=subfolder,
         x_axis_label="Grade Level",
-        x_data_label_query=f"""
-            SELECT CASE
-                       WHEN tenure = 1 THEN 'First Year Family'
-                       WHEN not tenure = 1 THEN 'Returning Family'
-                       ELSE 'Did not answer'
-                       END ||
-                   E'\n(' ||
-                   ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                            SUM(num_individuals_in_response),
-                         2) ||
-                   ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY tenure = 1
-            ORDER BY tenure = 1 DESC NULLS LAST
-                    """,
-        proportion_query=f"""
-                WITH expected_values AS
-                         (
-                             SELECT demographics.column1    AS demographic,
-                                    demographics.column2    AS demographic_order, -- any_support desc nulls last
-                                    response_values.column1 AS response_value
-                             FROM (VALUES ('First Year Family', 1),
-                                          ('Returning Family', 2),
-                                          ('Did not answer', 3)) AS demographics,
-                                  (VALUES (1), (2), (3), (4)) AS response_values
-                         ),
-                     sum_by_demographic AS
-                         (
-                             SELECT CASE
-                                        WHEN tenure = 1 THEN 'First Year Family'
-                                        WHEN NOT tenure = 1 THEN 'Returning Family'
-                                        ELSE 'Did not answer'
-                                        END                          AS demographic,
-                                    response_value,
-                                    SUM(num_individuals_in_response) AS num_responses
-                             FROM question_rank_responses
-                                      JOIN
-                                  respondents USING (respondent_id)
-                             WHERE question_id = {question_id}
-                             GROUP BY tenure = 1, response_value
-                         ),
-                     fill_in_blanks AS
-                         (
-                             -- If a demographic doesn't have any responses, fill it in as 0
-                             SELECT demographic,
-                                    demographic_order,
-                                    response_value,
-                                    COALESCE(num_responses, 0) AS num_responses
-                             FROM expected_values
-                                      LEFT JOIN
-                                  sum_by_demographic USING (demographic, response_value)
-                         ),
-                     sum_w_totals AS
-                         (
-                             SELECT demographic,
-                                    SUM(num_responses) AS total
-                             FROM fill_in_blanks
-                             GROUP BY demographic
-                         )
-                SELECT response_value,
-                       ARRAY_AGG(num_responses::NUMERIC / total ORDER BY demographic_order) AS pct
-                FROM fill_in_blanks
-                         JOIN
-                     sum_w_totals USING (demographic)
-                GROUP BY response_value
-                ;""",
-    )
-
-
-def q5_student_services(conn):
-    query_to_bar_chart(
-        conn=conn,
+        counts=response_counts(
+            cube, "first_year_segment", question_id
+        ).reindex(
+            ["First Year Family", "Returning Family", "Did not answer"],
+            fill_value=0,
+        ),
+    )
+
+
+def q5_student_services(cube):
+    support = response_counts(cube, "support_segment", question_id=5)
+    return counts_to_chart(
         title="Q5_(Virtues)_with_Services_Received",
         x_axis_label="Group Status\n(avg score)",
-        x_data_label_query="""
-            WITH question_avg_score AS
-                 (
-                     SELECT 'Total'                                                                                                 AS secton_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-        
-                     UNION ALL
-                     SELECT 'Support Services'                                                                                      AS secton_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-                       AND any_support
-                 )
-            SELECT CONCAT(secton_id, E'\n',
-                          '(', avg_score, ')'
-                       ) AS title
-            FROM question_avg_score
-            ORDER BY secton_id
+        counts=pd.concat(
+            [
+                support.reindex(["Received Support"], fill_value=0).rename(
+                    index={"Received Support": "Support Services"}
+                ),
+                response_counts(cube, question_id=5),
+            ]
+        ),
+    )
+
+
+# Each prior year's response counts are saved here after they're first queried, named after the year's fingerprint,
+# so they're queried again if the year is reloaded or changed by QA
+YOY_CACHE_DIR = Path("cache/yoy")
+
+
+def survey_schemas(conn, current=DATABASE_SCHEMA):
+    """
+    Every survey year in the database: the schemas named like sac_survey_2024 with the survey tables, plus the
+    current one.
+
+    :param conn: sqlalchemy connection
+    :param current: the schema of this year's survey
+    :return: list of schemas, oldest first
+    """
+    schemas = pd.read_sql(
+        con=conn,
+        sql="""
+            SELECT DISTINCT table_schema
+            FROM information_schema.tables
+            WHERE table_name = 'question_rank_responses'
             """,
-        proportion_query="""
-            WITH question_response_counts AS
-                 (
-                     SELECT 'Total'                          AS question_id,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-                     GROUP BY response_value
-        
-                     UNION ALL
-                     SELECT 'Support Services'               AS question_id,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-                       AND any_support
-                     GROUP BY response_value
-                 ),
-                 question_totals AS
-                 (
-                     SELECT question_id,
-                            SUM(num_responses) AS total
-                     FROM question_response_counts
-                     GROUP BY question_id
-                 )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY question_id) AS pct,
-                   ARRAY_AGG(question_id ORDER BY question_id)                    AS question_order
-            FROM question_response_counts
+    ).table_schema
+    years = {
+        schema
+        for schema in schemas
+        if re.fullmatch(r"sac_survey_\d{4}", schema)
+    }
+    return sorted(years | {current})
+
+
+def load_yearly_counts(
+    conn, schemas=None, current=DATABASE_SCHEMA, use_cache=True
+) -> pd.DataFrame:
+    """
+    Count the responses to every rank question in each survey year, in one UNION ALL query with a scan per year.
+    Years other than the current one are saved in YOY_CACHE_DIR under their fingerprints(), so after the first run
+    only the current year, and any year which has changed since, is queried.  Responses are weighted by
+    num_individuals_in_response, and soft-deleted respondents are left out.
+
+    :param conn: sqlalchemy connection
+    :param schemas: survey schemas to compare, default survey_schemas()
+    :param current: the schema of this year's survey, which is never cached, since QA can still change it
+    :param use_cache: set False to query every year again
+    :return: DataFrame with columns survey_schema, question_id, response_value, num_responses, in the order of
+             schemas
+    """
+    schemas = schemas or survey_schemas(conn, current)
+    cache_files = {
+        schema: YOY_CACHE_DIR / f"{schema}-{fingerprint}.parquet"
+        for schema, fingerprint in fingerprints(
+            conn, [schema for schema in schemas if schema != current]
+        ).items()
+    }
+    cached = {
+        schema: pd.read_parquet(cache_file)
+        for schema, cache_file in cache_files.items()
+        if use_cache and cache_file.exists()
+    }
+    to_query = [schema for schema in schemas if schema not in cached]
+
+    if to_query:
+        queried = pd.read_sql(
+            con=conn,
+            sql="\nUNION ALL\n".join(
+                yearly_counts_query(conn, schema) for schema in to_query
+            ),
+        )
+        YOY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for schema in to_query:
+            counts = queried[queried.survey_schema == schema]
+            cached[schema] = counts
+            if schema in cache_files:
+                for stale_file in YOY_CACHE_DIR.glob(f"{schema}-*.parquet"):
+                    stale_file.unlink()
+                counts.to_parquet(cache_files[schema], index=False)
+
+    counts = pd.concat(
+        [cached[schema] for schema in schemas], ignore_index=True
+    )
+    counts["question_id"] = counts.question_id.astype("Int16")
+    return counts
+
+
+def fingerprints(conn, schemas):
+    """
+    A hash of each year's respondents, which changes when the year is reloaded with different data, or QA soft
+    deletes a respondent: the respondents table is small, but has each respondent's weight, soft_delete and average
+    scores.
+
+    :param conn: sqlalchemy connection
+    :param schemas: survey schemas
+    :return: dict of schema: md5 hex digest
+    """
+    if not schemas:
+        return {}
+    hashes = pd.read_sql(
+        con=conn,
+        sql="\nUNION ALL\n".join(
+            f"""
+            SELECT '{schema}' AS survey_schema,
+                   MD5(COALESCE(STRING_AGG(
+                       CONCAT_WS(',', respondent_id, end_datetime, num_individuals_in_response, soft_delete,
+                                 grammar_avg, middle_avg, high_avg, overall_avg),
+                       ';' ORDER BY respondent_id), '')) AS fingerprint
+            FROM {schema}.respondents"""
+            for schema in schemas
+        ),
+    )
+    return dict(zip(hashes.survey_schema, hashes.fingerprint))
+
+
+def survey_year(schema):
+    """
+    The label of a survey year in the charts, e.g. 2024 for sac_survey_2024.
+    """
+    return schema.replace("sac_survey_", "", 1)
+
+
+def yearly_counts_query(conn, schema):
+    """
+    Count one year's responses for load_yearly_counts(), from its rank_response_aggregates view if it has been
+    built, otherwise from the raw tables.
+    """
+    if "rank_response_aggregates" in existing_aggregate_views(conn, schema):
+        return f"""
+            SELECT '{schema}'              AS survey_schema,
+                   question_id,
+                   response_value,
+                   SUM(weighted_responses) AS num_responses
+            FROM {schema}.rank_response_aggregates
+            WHERE NOT soft_delete
+            GROUP BY question_id, response_value"""
+    return f"""
+            SELECT '{schema}'                       AS survey_schema,
+                   question_id,
+                   response_value,
+                   SUM(num_individuals_in_response) AS num_responses
+            FROM {schema}.question_rank_responses
                      JOIN
-                 question_totals USING (question_id)
-            GROUP BY response_value
-            """,
+                 {schema}.respondents USING (respondent_id)
+            WHERE NOT soft_delete
+            GROUP BY question_id, response_value"""
+
+
+def yearly_response_counts(
+    yearly: pd.DataFrame, question_id: int = None
+) -> pd.DataFrame:
+    """
+    :param yearly: from load_yearly_counts()
+    :param question_id: only count responses to this question, or None for every rank question
+    :return: DataFrame with a row for each survey year, in the order loaded, and a column for each response value
+    """
+    if question_id is not None:
+        yearly = yearly[yearly.question_id == question_id]
+    counts = (
+        yearly.groupby(["survey_schema", "response_value"])
+        .num_responses.sum()
+        .unstack(fill_value=0)
+        .reindex(
+            index=yearly.survey_schema.unique(),
+            columns=RESPONSE_VALUES,
+            fill_value=0,
+        )
     )
+    return counts.rename(index=survey_year)
 
 
-def yoy_question_diff(conn, question_id, summarized_text):
+def yoy_question_diff(yearly, question_id, summarized_text):
     subfolder = Path("artifacts/yoy_comparison")
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return counts_to_chart(
         title=f"{question_id}:_" + summarized_text,
         subfolder=subfolder,
-        x_axis_label="",
-        x_data_label_query=f"""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id} 
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id}
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2024), 2) AS pct
-                         FROM pop_2024
-
-                         UNION ALL
-
-                         SELECT '2023'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2023), 2) AS pct
-                         FROM pop_2023
-                     )
-            SELECT CONCAT(yr, E'\n',
-                          '(', pct, ')'
-                       ) AS title
-            FROM distribution
-            ORDER BY yr
-            """,
-        proportion_query=f"""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id}
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id}
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2024) AS pct
-                         FROM pop_2024
-                         GROUP BY response_value
-
-                         UNION ALL
-
-                         SELECT '2023'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2023) AS pct
-                         FROM pop_2023
-                         GROUP BY response_value
-
-                         ORDER BY response_value
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(pct ORDER BY yr)  AS pct,
-                   ARRAY_AGG(yr ORDER BY yr) AS year_order
-            FROM distribution
-            GROUP BY response_value
-            """,
+        x_axis_label="Survey Year\n(avg score)",
+        counts=yearly_response_counts(yearly, question_id),
     )
 
 
-def yoy_total_diff(conn):
+def yoy_total_diff(yearly):
     subfolder = Path("artifacts/yoy_comparison")
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return counts_to_chart(
         title="YoY_total_difference",
         subfolder=subfolder,
-        x_axis_label="",
-        x_data_label_query="""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2024), 2) AS pct
-                         FROM pop_2024
-
-                         UNION ALL
-
-                         SELECT '2023'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2023), 2) AS pct
-                         FROM pop_2023
-                     )
-            SELECT CONCAT(yr, E'\n',
-                          '(', pct, ')'
-                       ) AS title
-            FROM distribution
-            ORDER BY yr
-            """,
-        proportion_query="""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2024) AS pct
-                         FROM pop_2024
-                         GROUP BY response_value
-
-                         UNION ALL
-
-                         SELECT '2023'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2023) AS pct
-                         FROM pop_2023
-                         GROUP BY response_value
-
-                         ORDER BY response_value
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(pct ORDER BY yr)  AS pct,
-                   ARRAY_AGG(yr ORDER BY yr) AS year_order
-            FROM distribution
-            GROUP BY response_value
-            """,
+        x_axis_label="Survey Year\n(avg score)",
+        counts=yearly_response_counts(yearly),
+    )
+
+
+def yoy_small_multiples(conn, yearly):
+    """
+    Every rank question across every survey year in one figure, for the committee deck
+    """
+    return small_multiples(
+        title="Rank Response by Year",
+        charts=[
+            yoy_question_diff(yearly, question_id, summarized_text)
+            for question_id, summarized_text in rank_questions(conn)
+        ],
+        subfolder=Path("artifacts/yoy_comparison"),
     )
 
 
-def main():
+def main(
+    workers=0, file_format="png", show=False, use_cache=True, yoy_schemas=None
+):
+    """
+    Query the data for every chart first, then render them all.
+
+    :param workers: see render_charts()
+    :param file_format: see create_stacked_bar_chart()
+    :param show: see render_charts()
+    :param use_cache: see render_charts() and load_yearly_counts()
+    :param yoy_schemas: survey schemas to compare year over year, default every year in the database
+    :return: list of the paths of the saved charts
+    """
     with create_engine(DATABASE_CONNECTION_STRING).connect() as conn:
         conn.execute(text(f"SET SCHEMA '{DATABASE_SCHEMA}'"))
 
-        # create_question_summary(conn)
-        create_grade_summary(conn)
-        # q5_student_services(conn)
-        # breakout_by_question(conn)
-        # yoy_total_diff(conn)
+        cube = load_response_cube(conn)
+
+        # every year's counts are only queried if a year over year chart is made, and only once
+        yearly = lru_cache()(
+            partial(load_yearly_counts, conn, yoy_schemas, use_cache=use_cache)
+        )
+
+        charts = [create_grade_summary(cube)]
+        # charts.append(create_question_summary(cube))
+        # charts.append(q5_student_services(cube))
+        # charts += breakout_by_question(conn, cube, yearly())
+        # charts.append(grade_level_small_multiples(conn, cube))
+        # charts.append(yoy_total_diff(yearly()))
+        # charts.append(yoy_small_multiples(conn, yearly()))
+
+    return render_charts(charts, workers, file_format, show, use_cache)
+
+
+def argument_parser():
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Save the rank question charts to artifacts/"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of processes to render charts in; 1 renders in this process; default is 0, every core",
+    )
+    parser.add_argument(
+        "--format",
+        dest="file_format",
+        type=str,
+        default="png",
+        help="File format of the charts, e.g. png, svg, or pdf; default is png",
+    )
+    parser.add_argument(
+        "--show",
+        action="store_true",
+        help="Show each chart as it's saved, rendering them one at a time in this process",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="Render every chart, even those unchanged since they were last saved, and query every survey year again",
+    )
+    parser.add_argument(
+        "--yoy-schemas",
+        nargs="+",
+        help="Survey schemas to compare year over year, e.g. sac_survey_2023 sac_survey_2024; default is every "
+        "sac_survey_YYYY schema in the database",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO)
+    args = argument_parser()
+    if not args.show:
+        # save the charts without opening a window for each
+        matplotlib.use("Agg")
+    main(**vars(args))
@@ -1,23 +1,48 @@
+import argparse
+import logging
+from pathlib import Path
+
 import pandas as pd
 from sqlalchemy import create_engine, text
 from wordcloud import STOPWORDS, WordCloud
 
-from utilities import load_env_vars
+from utilities import (
+    is_rendered,
+    load_env_vars,
+    load_render_manifest,
+    render_key,
+    save_render_manifest,
+)
 
 _, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
 
+WORDCLOUD_OPTIONS = dict(
+    max_words=50,
+    min_word_length=3,
+    relative_scaling=1,  # frequency determines word size
+    scale=4,  # image size
+    colormap="PuOr",  # semi-close to GVCA colors.  Can also try YlGnBu
+    background_color=None,
+    mode="RGBA",  # transparent background
+)
+
 
-def main():
+def main(use_cache=True):
     eng = create_engine(DATABASE_CONNECTION_STRING)
     with eng.connect() as conn:
         conn.execute(text(f"SET SCHEMA '{DATABASE_SCHEMA}';"))
-        build_wordclouds(conn)
+        build_wordclouds(conn, use_cache)
 
 
-def build_wordclouds(conn):
+def build_wordclouds(conn, use_cache=True):
     """
     Create wordclouds for each open response section.
     Have separate plots for each grade level, as well as one with all results together.
+    Wordclouds whose responses haven't changed since they were last saved, according to the render manifest in
+    artifacts/, aren't generated again.
+
+    :param conn: sqlalchemy connection
+    :param use_cache: set False to generate every wordcloud, even unchanged ones
     """
     # Curate a list of stopwords
     stopwords = set(STOPWORDS)
@@ -44,6 +69,9 @@ def build_wordclouds(conn):
         ]
     )
 
+    manifest = load_render_manifest() if use_cache else {}
+    rendered = {}
+
     # Separate plots for each grade level (and one for all responses together)
     for grade_level, subtitle in [
         (None, "All Response"),
@@ -75,7 +103,16 @@ def build_wordclouds(conn):
             )
             title = df[df.question_id == question_id].question_text.values[0]
 
-            build_wordcloud(text, stopwords, title, subtitle)
+            filepath = Path(f"artifacts/Open Response/{title} - {subtitle}.png")
+            key = render_key(
+                text=text, stopwords=stopwords, options=WORDCLOUD_OPTIONS
+            )
+            if not is_rendered(manifest, filepath, key):
+                build_wordcloud(text, stopwords, title, subtitle)
+                rendered[filepath] = key
+
+    logging.info("Generated %s wordclouds", len(rendered))
+    save_render_manifest(rendered)
 
 
 def build_wordcloud(text, stopwords, title, subtitle):
@@ -83,16 +120,9 @@ def build_wordcloud(text, stopwords, title, subtitle):
     Generate a word cloud image with a transparent background.
     Save as a file in the artifacts/ folder.
     """
-    wordcloud = WordCloud(
-        stopwords=stopwords,
-        max_words=50,
-        min_word_length=3,
-        relative_scaling=1,  # frequency determines word size
-        scale=4,  # image size
-        colormap="PuOr",  # semi-close to GVCA colors.  Can also try YlGnBu
-        background_color=None,
-        mode="RGBA",  # transparent background
-    ).generate(text)
+    wordcloud = WordCloud(stopwords=stopwords, **WORDCLOUD_OPTIONS).generate(
+        text
+    )
     wordcloud.to_file(f"artifacts/Open Response/{title} - {subtitle}.png")
 
 
@@ -132,15 +162,13 @@ def manual_categorization(eng):
         VALUES (NULL, NULL, NULL, NULL, NULL, NULL, NULL) 
         """
 
-    with eng.connect() as conn:
-        conn.execute(text("BEGIN TRANSACTION;"))
+    # one transaction, which also works on DuckDB
+    with eng.begin() as conn:
         conn.execute(text(f"SET SCHEMA '{DATABASE_SCHEMA}'"))
         conn.execute(text("TRUNCATE open_response_categories;"))
 
         conn.execute(text(_entries))
 
-        conn.execute(text("END TRANSACTION;"))
-
     # Big stories:
     # Upper school attrition,
     # upper school stress,
@@ -154,5 +182,22 @@ def manual_categorization(eng):
     # People don't know about student services
 
 
+def argument_parser():
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Save the open response wordclouds to artifacts/Open Response/"
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="Generate every wordcloud, even those unchanged since they were last saved",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO)
+    main(**vars(argument_parser()))
@@ -1,7 +1,12 @@
 # %%
+import importlib
+
 import pandas as pd
 
-df = pd.read_csv(
+ingest = importlib.import_module("02_data_ingest")
+
+# columns are (question, context); answers are ordered categoricals
+df = ingest.read_survey_export(
     "/workspaces/gvca_survey_analytics/2024 Parent Satisfaction Survey.csv"
 )
 pd.set_option("display.max_columns", None)
@@ -0,0 +1,261 @@
+"""
+Benchmark each ingest mode of 02_data_ingest.py against synthetic survey exports.
+
+For every export size and ingest mode, a fresh schema is built from 01_build_database.sql in the database from
+DATABASE_CONNECTION_STRING, the export is ingested in a separate process, and the throughput, number of round trips
+to the database, and peak memory are reported.  The schema is dropped afterwards.
+
+usage: python benchmark_ingest.py --respondents 1000 100000 --modes bulk pandas --json benchmark.json
+"""
+
+import argparse
+import importlib
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import psycopg2.extensions
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import Pool
+
+from generate_synthetic_survey import generate_survey_export
+from utilities import SCRIPT_SCHEMA, load_env_vars, run_sql_script
+
+_, _, DATABASE_CONNECTION_STRING = load_env_vars()
+
+BENCHMARK_SCHEMA = "benchmark_ingest"
+
+# synthetic exports are kept here and reused, since the large ones take a while to write
+EXPORT_CACHE_DIR = Path("cache/synthetic_exports")
+
+# keyword arguments to 02_data_ingest.main() for each mode
+INGEST_MODES = {
+    "rows": {},
+    "bulk": {"bulk": True},
+    "bulk-workers": {"bulk": True, "workers": 0},
+    "pandas": {"engine": "pandas"},
+    "sql": {"engine": "sql"},
+}
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """
+    psycopg2 cursor which counts the round trips made to the database.
+    """
+
+    round_trips = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.round_trips += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        # psycopg2 sends each set of parameters as a separate statement
+        vars_list = list(vars_list)
+        CountingCursor.round_trips += len(vars_list)
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        CountingCursor.round_trips += 1
+        return super().copy_expert(sql, file, size)
+
+
+def main(respondent_counts, modes, open_response_rate=0.3, json_filepath=None):
+    """
+    Run every mode against an export of every size, and print a summary.
+
+    :param respondent_counts: list of export sizes (rows) to benchmark
+    :param modes: list of keys from INGEST_MODES
+    :param open_response_rate: chance that each open response box is filled in
+    :param json_filepath: optionally save the results here
+    :return: list of results, one dict per size and mode
+    """
+    eng = create_engine(DATABASE_CONNECTION_STRING)
+
+    results = []
+    for num_respondents in respondent_counts:
+        filepath = synthetic_export(num_respondents, open_response_rate)
+        for mode in modes:
+            build_schema(eng)
+            try:
+                result = run_in_subprocess(filepath, mode)
+            finally:
+                drop_schema(eng)
+            result.update(
+                respondents=num_respondents,
+                mode=mode,
+                rows_per_second=round(num_respondents / result["seconds"], 1),
+            )
+            print(
+                f"{num_respondents:>9} respondents  {mode:<13}"
+                f"{result['seconds']:>9.2f} s"
+                f"{result['rows_per_second']:>12.1f} rows/s"
+                f"{result['round_trips']:>10} round trips"
+                f"{result['peak_rss_mb']:>9.1f} MB peak"
+                + (
+                    f" ({result['worker_peak_rss_mb']:.1f} MB largest worker)"
+                    if result["worker_peak_rss_mb"]
+                    else ""
+                )
+            )
+            results.append(result)
+
+    if json_filepath:
+        with open(json_filepath, "w") as f_out:
+            json.dump(results, f_out, indent=2)
+    return results
+
+
+def synthetic_export(num_respondents, open_response_rate):
+    """
+    Get the path to a synthetic export of the given size, writing it first if it hasn't been already.
+    """
+    filepath = (
+        EXPORT_CACHE_DIR
+        / f"synthetic_{num_respondents}_{open_response_rate}.csv"
+    )
+    if not filepath.exists():
+        EXPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        generate_survey_export(
+            filepath,
+            num_respondents=num_respondents,
+            open_response_rate=open_response_rate,
+        )
+    return filepath
+
+
+def build_schema(eng):
+    """
+    Build an empty copy of the survey schema to benchmark against.
+    """
+    drop_schema(eng)
+    run_sql_script(
+        "01_build_database.sql",
+        DATABASE_CONNECTION_STRING,
+        {SCRIPT_SCHEMA: BENCHMARK_SCHEMA},
+    )
+
+
+def drop_schema(eng):
+    with eng.begin() as conn:
+        conn.execute(
+            text(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE;")
+        )
+
+
+def run_in_subprocess(filepath, mode):
+    """
+    Ingest in a fresh process, so peak memory is measured for just this run.
+
+    :return: dict with seconds, round_trips, peak_rss_mb, and worker_peak_rss_mb
+    """
+    completed = subprocess.run(
+        [sys.executable, __file__, "--child", str(filepath), mode],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    # the result is the last line; anything before it is output from the ingest
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_ingest(filepath, mode):
+    """
+    Run in the subprocess: ingest the export into the benchmark schema, and print the measurements as json.
+    """
+    ingest = importlib.import_module("02_data_ingest")
+    ingest.INPUT_FILEPATH = str(filepath)
+    ingest.DATABASE_SCHEMA = BENCHMARK_SCHEMA
+
+    # count round trips on every connection the ingest opens
+    event.listen(
+        Pool,
+        "connect",
+        lambda dbapi_connection, _: setattr(
+            dbapi_connection, "cursor_factory", CountingCursor
+        ),
+    )
+
+    start = time.perf_counter()
+    ingest.main(**INGEST_MODES[mode])
+    seconds = time.perf_counter() - start
+
+    print(
+        json.dumps(
+            {
+                "seconds": round(seconds, 3),
+                "round_trips": CountingCursor.round_trips,
+                "peak_rss_mb": _max_rss_mb(resource.RUSAGE_SELF),
+                "worker_peak_rss_mb": _max_rss_mb(resource.RUSAGE_CHILDREN),
+            }
+        )
+    )
+
+
+def _max_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux, but bytes on macOS
+    max_rss = resource.getrusage(who).ru_maxrss
+    return round(
+        max_rss / (1024**2 if sys.platform == "darwin" else 1024), 1
+    )
+
+
+def argument_parser():
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingest modes of 02_data_ingest.py on synthetic exports"
+    )
+    parser.add_argument(
+        "-n",
+        "--respondents",
+        type=int,
+        nargs="+",
+        default=[1000, 100000],
+        help="Export sizes (rows) to benchmark; default is 1000 100000",
+    )
+    parser.add_argument(
+        "-m",
+        "--modes",
+        nargs="+",
+        choices=list(INGEST_MODES),
+        default=["bulk", "bulk-workers", "pandas", "sql"],
+        help="Ingest modes to benchmark; default is every mode except rows, which is slow for large exports",
+    )
+    parser.add_argument(
+        "--open-response-rate",
+        type=float,
+        default=0.3,
+        help="Chance that each open response box is filled in; default is 0.3",
+    )
+    parser.add_argument(
+        "--json",
+        dest="json_filepath",
+        type=str,
+        default=None,
+        help="Also save the results to this json file",
+    )
+    parser.add_argument(
+        "--child",
+        nargs=2,
+        metavar=("FILEPATH", "MODE"),
+        help=argparse.SUPPRESS,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argument_parser()
+    if args.child:
+        run_ingest(*args.child)
+    else:
+        main(
+            args.respondents,
+            args.modes,
+            open_response_rate=args.open_response_rate,
+            json_filepath=args.json_filepath,
+        )
@@ -0,0 +1,213 @@
+"""
+Export the survey tables in a schema, plus the flattened respondent x rank question view from
+export_survey_data.sql, to compressed Parquet files for the archive.
+
+Rows are streamed from a server-side cursor and written a batch at a time, so memory stays flat however big the
+tables are.  Columns keep their database types (SMALLINT response values, booleans, timestamps, ...), so reloading
+for analysis is just `pd.read_parquet("artifacts/export/sac_survey_2024/respondents.parquet")`.
+
+usage: python export_survey_data.py --schema sac_survey_2024 --output-dir artifacts/export
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, inspect, text
+
+from utilities import is_duckdb, load_env_vars
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+
+# queries from export_survey_data.sql which are exported along with the tables: file name: comment above the query
+EXPORT_QUERIES = {
+    "flattened_respondent_rank_questions": "flattened respondent_rank_questions",
+}
+
+# bookkeeping tables of 02_data_ingest.py (--incremental, --resume, --reject) and the staging tables of its sql
+# engine, which aren't survey data and aren't exported
+INGEST_TABLES = {
+    "ingest_watermarks",
+    "ingest_checkpoints",
+    "rejected_rows",
+    "raw_survey_export",
+    "raw_survey_columns",
+}
+
+# Postgres type OIDs from cursor.description, and the Arrow type each is written as
+ARROW_TYPES = {
+    16: pa.bool_(),  # boolean
+    20: pa.int64(),  # bigint
+    21: pa.int16(),  # smallint
+    23: pa.int32(),  # integer
+    25: pa.string(),  # text
+    700: pa.float32(),  # real
+    701: pa.float64(),  # double precision
+    1009: pa.list_(pa.string()),  # text[]
+    1043: pa.string(),  # varchar
+    1114: pa.timestamp("us"),  # timestamp
+    1700: pa.float64(),  # numeric, see NUMERIC_TYPE
+}
+
+# psycopg2 returns numeric values as Decimal, which pa.array() won't take for a float column, so they're converted
+# to float first
+NUMERIC_TYPE = 1700
+
+
+def main(
+    schema=DATABASE_SCHEMA, output_dir="artifacts/export", batch_size=10000
+):
+    """
+    Write one Parquet file per survey table and export query into output_dir/schema/; the INGEST_TABLES are left
+    out.
+
+    :param schema: schema to export
+    :param output_dir: parent folder of the export
+    :param batch_size: rows fetched from the cursor and written at a time
+    :return: list of the files written
+    """
+    output_dir = Path(output_dir) / schema
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    eng = create_engine(DATABASE_CONNECTION_STRING)
+    with eng.connect() as conn:
+        conn.execute(text(f"SET SCHEMA '{schema}';"))
+        queries = {
+            tablename: f"SELECT * FROM {schema}.{tablename}"
+            for tablename in sorted(
+                inspect(conn).get_table_names(schema=schema)
+            )
+            if tablename not in INGEST_TABLES
+        }
+        queries.update(
+            {
+                name: read_query("export_survey_data.sql", comment)
+                for name, comment in EXPORT_QUERIES.items()
+            }
+        )
+
+        filepaths = []
+        for name, query in queries.items():
+            filepath = output_dir / f"{name}.parquet"
+            if is_duckdb(DATABASE_CONNECTION_STRING):
+                # DuckDB writes Parquet itself, a row group at a time
+                conn.execute(
+                    text(
+                        f"COPY ({query}) TO '{filepath}' (FORMAT parquet, COMPRESSION zstd)"
+                    )
+                )
+            else:
+                export_query(conn, query, filepath, batch_size)
+            logging.info(
+                "Exported %s rows to %s",
+                pq.ParquetFile(filepath).metadata.num_rows,
+                filepath,
+            )
+            filepaths.append(filepath)
+    return filepaths
+
+
+def export_query(conn, query, filepath, batch_size=10000):
+    """
+    Stream the results of a query into a Parquet file, using a server-side cursor.
+
+    :param conn: sqlalchemy connection
+    :param query: SQL query
+    :param filepath: Parquet file to write, a Path; errors name the table after it
+    :param batch_size: rows fetched and written at a time
+    :return: None
+    """
+    result = conn.execution_options(stream_results=True).execute(text(query))
+    for column in result.cursor.description:
+        if column.type_code not in ARROW_TYPES:
+            raise TypeError(
+                f"Can't export {filepath.stem}.{column.name}: Postgres type OID {column.type_code} isn't in "
+                "ARROW_TYPES"
+            )
+    arrow_schema = pa.schema(
+        [
+            (column.name, ARROW_TYPES[column.type_code])
+            for column in result.cursor.description
+        ]
+    )
+
+    numeric = [
+        column.type_code == NUMERIC_TYPE
+        for column in result.cursor.description
+    ]
+
+    with pq.ParquetWriter(
+        filepath, arrow_schema, compression="zstd"
+    ) as writer:
+        for rows in result.partitions(batch_size):
+            columns = [
+                (
+                    [
+                        None if value is None else float(value)
+                        for value in values
+                    ]
+                    if is_numeric
+                    else values
+                )
+                for values, is_numeric in zip(zip(*rows), numeric)
+            ]
+            writer.write_table(
+                pa.Table.from_arrays(
+                    [
+                        pa.array(values, type=field.type)
+                        for values, field in zip(columns, arrow_schema)
+                    ],
+                    schema=arrow_schema,
+                )
+            )
+
+
+def read_query(filepath, comment):
+    """
+    Read one query out of a SQL file of several, each under a comment line naming it, e.g. "-- questions",
+    and ending with a line which is just ";".
+
+    :param filepath: SQL file
+    :param comment: text of the comment above the query
+    :return: the query, without the closing semicolon
+    """
+    with open(filepath, "r") as f_in:
+        lines = f_in.read().splitlines()
+    start = lines.index(f"-- {comment}") + 1
+    end = lines.index(";", start)
+    return "\n".join(lines[start:end])
+
+
+def argument_parser():
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Export the survey tables to Parquet files"
+    )
+    parser.add_argument(
+        "--schema",
+        type=str,
+        default=DATABASE_SCHEMA,
+        help="Schema to export; default is DATABASE_SCHEMA from .env",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="artifacts/export",
+        help="Files are written to OUTPUT_DIR/SCHEMA/; default is artifacts/export",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="Rows fetched from the database and written at a time; default is 10000",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(**vars(argument_parser()))
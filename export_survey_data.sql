@@ -2,8 +2,8 @@
 WITH given_num_families AS
          (
              SELECT ROW_NUMBER() OVER () AS order_by,
-                    column1              AS num_families_at_school,
-                    column2              AS grade_level
+                    num_families_at_school,
+                    grade_level
              FROM (
                       -- Fill these in based on values from the front office.
                       -- Note that the name given in the second value must match what's in the `base` CTE.
@@ -11,7 +11,7 @@ WITH given_num_families AS
                              (NULL, 'grammar'),
                              (NULL, 'middle'),
                              (NULL, 'high')
-                  ) AS provided_by_front_office
+                  ) AS provided_by_front_office (num_families_at_school, grade_level)
          ),
      base AS
          (
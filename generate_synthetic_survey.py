@@ -0,0 +1,246 @@
+"""
+Write a synthetic Survey Monkey export, with the same two row header layout as the real one, so ingest can be tested
+and benchmarked without the real survey results.
+
+Every respondent picks one combination of grade levels and only answers that section of the survey, the same as
+the technical controls in the real survey.  Answers are drawn at random, so the files are realistic in size and shape
+but not in content.
+
+usage: python generate_synthetic_survey.py synthetic_survey.csv --respondents 100000 --open-response-rate 0.3
+"""
+
+import argparse
+import random
+from csv import writer as csv_writer
+
+RANK_QUESTIONS = [
+    (
+        "How satisfied are you with the education that Golden View Classical Academy provided this year?",
+        "Satisfied",
+    ),
+    (
+        # the real export has the curly apostrophe, which fix_questions() corrects
+        "Given your children’s education level at the beginning of the year, how satisfied are you with their intellectual growth this year?",
+        "Satisfied",
+    ),
+    (
+        "GVCA emphasizes 7 core virtues: Courage, Moderation, Justice, Responsibility, Prudence, Friendship, and Wonder. How well is the school culture reflected by these virtues?",
+        "Reflected",
+    ),
+    (
+        "How satisfied are you with your children's growth in moral character and civic virtue?",
+        "Satisfied",
+    ),
+    (
+        "How effective is the communication between your family and your children's teachers?",
+        "Effective",
+    ),
+    (
+        "How effective is the communication between your family and the school leadership?",
+        "Effective",
+    ),
+    ("How welcoming is the school community?", "Welcoming"),
+]
+
+# Sections of the survey, in the order they appear in the export, and the answer given to question 2 to get there
+GRADE_LEVEL_SECTIONS = [
+    ("Grammar School only (K-6)", ["Grammar School"]),
+    (
+        "Grammar and Middle School (K-6 and 7-8)",
+        ["Grammar School", "Middle School"],
+    ),
+    (
+        "Grammar and High School (K-6 and 9-12)",
+        ["Grammar School", "High School"],
+    ),
+    (
+        "Grammar, Middle, and High School (K-6, 7-8, and 9-12)",
+        ["Grammar School", "Middle School", "High School"],
+    ),
+    ("Middle School only (7-8)", ["Middle School"]),
+    (
+        "Middle and High School (7-8 and 9-12)",
+        ["Middle School", "High School"],
+    ),
+    ("High School only (9-12)", ["High School"]),
+]
+
+# Open response pages are titled by grade level; fix_questions() turns the title into the question context
+OPEN_RESPONSE_PAGE_TITLES = {
+    "Grammar School": "Responses pertinent to Grammar School only",
+    "Middle School": "Responses pertinent to Middle School only",
+    "High School": "Responses pertinent to High School only",
+    "Whole School": "Responses generic to the whole school.",
+}
+
+SUBMISSION_METHODS = [
+    "Each parent or guardian will submit a separate survey, and we will submit two surveys.",
+    "All parents and guardians will coordinate responses, and we will submit only one survey.",
+]
+
+COLLECTOR_IDS = ["454577449", "454577492", "454577519", "454577536"]
+
+OPEN_RESPONSES = [
+    "The teachers are wonderful and really care about the kids.",
+    'Classical curriculum, "great books", and the emphasis on virtue.',
+    "Less homework in the upper grades,\nespecially over breaks.",
+    "More communication from the school leadership about policy changes.",
+    "Community events, book clubs, and parent volunteering.",
+    "N/A",
+]
+
+
+def build_header():
+    """
+    Build the two header rows, as well as where each grade level section of the survey starts and ends.
+
+    :return header, sub_header, sections: list(str), list(str), list((grades answer, levels, first column, rank
+             columns end, last column))
+    """
+    header = [
+        "Respondent ID",
+        "Collector ID",
+        "Start Date",
+        "End Date",
+        "IP Address",
+        "Email Address",
+        "First Name",
+        "Last Name",
+        "Custom Data 1",
+        "Choose a method of submission.",
+        "This academic year, in which grades are your children?",
+    ]
+    sub_header = [""] * 9 + ["Response", "Response"]
+
+    sections = []
+    for grades_answer, levels in GRADE_LEVEL_SECTIONS:
+        start = len(header)
+
+        # rank questions are a matrix with one column per grade level, unless there is only one grade level
+        for question_text, _ in RANK_QUESTIONS:
+            for i, level in enumerate(levels):
+                header.append(question_text if i == 0 else "")
+                sub_header.append("Response" if len(levels) == 1 else level)
+        rank_end = len(header)
+
+        # two pages of open response: "why is GVCA a good choice" and "where can we improve"
+        for _ in range(2):
+            for level in levels + ["Whole School"]:
+                header.append(OPEN_RESPONSE_PAGE_TITLES[level])
+                sub_header.append("Open-Ended Response")
+
+        sections.append((grades_answer, levels, start, rank_end, len(header)))
+
+    header += [
+        "How many years have you had a child at GVCA?  The current academic year counts as 1.",
+        "Do you have one or more children on an IEP, 504, ALP, or READ Plan?",
+        "Do you consider yourself or any of your children part of a racial, ethnic, or cultural minority group?",
+    ]
+    sub_header += ["Open-Ended Response", "Response", "Response"]
+    return header, sub_header, sections
+
+
+def generate_survey_export(
+    filepath, num_respondents=1000, open_response_rate=0.3, seed=0
+):
+    """
+    Write a synthetic survey export.
+
+    :param filepath: where to write the csv
+    :param num_respondents: number of rows after the header
+    :param open_response_rate: chance that any one open response box is filled in
+    :param seed: random seed, so the same arguments always write the same file
+    :return: None
+    """
+    rng = random.Random(seed)
+    header, sub_header, sections = build_header()
+
+    with open(filepath, "w", newline="") as f_out:
+        survey_writer = csv_writer(f_out)
+        survey_writer.writerow(header)
+        survey_writer.writerow(sub_header)
+
+        for i in range(num_respondents):
+            row = [""] * len(header)
+            row[0] = str(118500000000 + i)
+            row[1] = rng.choice(COLLECTOR_IDS)
+            minutes = rng.randrange(60 * 24 * 14)  # two week survey window
+            row[2] = _format_datetime(minutes)
+            row[3] = _format_datetime(minutes + rng.randrange(3, 45))
+            row[9] = rng.choice(SUBMISSION_METHODS)
+
+            grades_answer, levels, start, rank_end, end = rng.choice(sections)
+            row[10] = grades_answer
+
+            # most families answer most rank questions, with mostly positive answers
+            column = start
+            for _, answer in RANK_QUESTIONS:
+                for _ in levels:
+                    if rng.random() < 0.9:
+                        row[column] = rng.choices(
+                            [
+                                f"Extremely {answer}"
+                                if answer != "Reflected"
+                                else "Strongly Reflected",
+                                answer,
+                                f"Somewhat {answer}",
+                                f"Not {answer}",
+                            ],
+                            weights=[5, 3, 1.5, 0.5],
+                        )[0]
+                    column += 1
+
+            for column in range(rank_end, end):
+                if rng.random() < open_response_rate:
+                    row[column] = rng.choice(OPEN_RESPONSES)
+
+            row[-3] = rng.choice(["", "1", "2", "3", "4", "5", "8", "12"])
+            row[-2] = rng.choice(["", "Yes", "No", "No", "No"])
+            row[-1] = rng.choice(["", "Yes", "No", "No"])
+            survey_writer.writerow(row)
+
+
+def _format_datetime(minutes):
+    """
+    Format minutes since the start of the survey window the way Survey Monkey does, e.g. 01/15/2024 09:05:00 AM
+    """
+    day, minutes = divmod(minutes, 60 * 24)
+    hour, minute = divmod(minutes, 60)
+    return f"01/{15 + day:02d}/2024 {(hour - 1) % 12 + 1:02d}:{minute:02d}:00 {'AM' if hour < 12 else 'PM'}"
+
+
+def argument_parser():
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic Survey Monkey export"
+    )
+    parser.add_argument("filepath", type=str, help="Where to write the csv")
+    parser.add_argument(
+        "-n",
+        "--respondents",
+        type=int,
+        default=1000,
+        help="Number of respondents (rows); default is 1000",
+    )
+    parser.add_argument(
+        "--open-response-rate",
+        type=float,
+        default=0.3,
+        help="Chance that each open response box is filled in; default is 0.3",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed; default is 0"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argument_parser()
+    generate_survey_export(
+        args.filepath,
+        num_respondents=args.respondents,
+        open_response_rate=args.open_response_rate,
+        seed=args.seed,
+    )
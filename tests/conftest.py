@@ -0,0 +1,123 @@
+"""
+Fixtures shared by the tests.  The Postgres tests use DATABASE_CONNECTION_STRING from .env; each builds its own
+pytest_* schema from 01_build_database.sql and drops it afterwards.  They're skipped if it isn't Postgres or can't be
+reached.
+"""
+
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+# the scripts are run from the repository root, and import each other from there
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from generate_synthetic_survey import generate_survey_export  # noqa: E402
+from utilities import run_sql_script  # noqa: E402
+
+BUILD_SCRIPT = REPO_DIR / "01_build_database.sql"
+
+NUM_RESPONDENTS = 200
+
+
+@pytest.fixture(scope="session")
+def ingest():
+    try:
+        return importlib.import_module("02_data_ingest")
+    except AssertionError as e:
+        pytest.skip(f"02_data_ingest.py needs a .env: {e}")
+
+
+@pytest.fixture(scope="session")
+def postgres(ingest):
+    """
+    The Postgres connection string from .env
+    """
+    connection_string = ingest.DATABASE_CONNECTION_STRING
+    if not connection_string or "postgresql" not in connection_string:
+        pytest.skip("DATABASE_CONNECTION_STRING in .env isn't Postgres")
+    try:
+        create_engine(connection_string).connect().close()
+    except OperationalError as e:
+        pytest.skip(f"Can't connect to Postgres: {e}")
+    return connection_string
+
+
+@pytest.fixture(scope="session")
+def export(tmp_path_factory):
+    """
+    A synthetic export of NUM_RESPONDENTS rows
+    """
+    filepath = tmp_path_factory.mktemp("exports") / "synthetic.csv"
+    generate_survey_export(filepath, num_respondents=NUM_RESPONDENTS)
+    return filepath
+
+
+@pytest.fixture
+def new_schema(ingest, postgres):
+    """
+    Build empty pytest_* schemas, which are dropped after the test
+    """
+    schemas = []
+
+    def build(name):
+        schema = f"pytest_{name}"
+        build_schema(ingest, postgres, schema)
+        schemas.append(schema)
+        return schema
+
+    yield build
+    drop_schemas(postgres, *schemas)
+
+
+@pytest.fixture(scope="session")
+def load(ingest):
+    """
+    Ingest an export into a schema with 02_data_ingest.main(**options), or another function of it like
+    reload_through_shadow, as if in a new run of the script.  The column plan and parsed exports are saved next to
+    the export, not in the repository's cache.
+    """
+
+    def run(
+        filepath, schema, connection_string=None, function="main", **options
+    ):
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setattr(ingest, "INPUT_FILEPATH", str(filepath))
+            monkeypatch.setattr(ingest, "DATABASE_SCHEMA", schema)
+            if connection_string:
+                monkeypatch.setattr(
+                    ingest, "DATABASE_CONNECTION_STRING", connection_string
+                )
+            cache_dir = Path(filepath).parent / "cache"
+            monkeypatch.setattr(ingest, "PLAN_CACHE_DIR", cache_dir)
+            monkeypatch.setattr(
+                ingest,
+                "SURVEY_EXPORT_CACHE_DIR",
+                cache_dir / "survey_exports",
+            )
+            return getattr(ingest, function)(**options)
+
+    return run
+
+
+def build_schema(ingest, connection_string, schema):
+    drop_schemas(connection_string, schema)
+    run_sql_script(
+        BUILD_SCRIPT, connection_string, {ingest.SCRIPT_SCHEMA: schema}
+    )
+
+
+def drop_schemas(connection_string, *schemas):
+    """
+    Drop the schemas, and the copies a shadow reload leaves beside them
+    """
+    with create_engine(connection_string).begin() as conn:
+        for schema in schemas:
+            for suffix in ["", "_shadow", "_previous"]:
+                conn.execute(
+                    text(f"DROP SCHEMA IF EXISTS {schema}{suffix} CASCADE;")
+                )
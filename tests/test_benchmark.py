@@ -0,0 +1,27 @@
+import importlib
+
+from sqlalchemy import create_engine, text
+
+from conftest import BUILD_SCRIPT
+
+
+def test_benchmark(postgres, monkeypatch, tmp_path):
+    benchmark = importlib.import_module("benchmark_ingest")
+    # the benchmark is run from the repository root; the exports and column plans are written under the current folder
+    (tmp_path / BUILD_SCRIPT.name).symlink_to(BUILD_SCRIPT)
+    monkeypatch.chdir(tmp_path)
+
+    results = benchmark.main([50], ["rows", "bulk"])
+
+    assert [(result["respondents"], result["mode"]) for result in results] == [
+        (50, "rows"),
+        (50, "bulk"),
+    ]
+    assert results[1]["round_trips"] < results[0]["round_trips"]
+    with create_engine(postgres).connect() as conn:
+        assert not conn.execute(
+            text(
+                "SELECT 1 FROM information_schema.schemata WHERE schema_name = :schema_name"
+            ),
+            {"schema_name": benchmark.BENCHMARK_SCHEMA},
+        ).scalar()
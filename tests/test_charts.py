@@ -0,0 +1,144 @@
+import importlib
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+from conftest import REPO_DIR, build_schema, drop_schemas
+from generate_synthetic_survey import generate_survey_export
+from utilities import run_sql_script
+
+
+@pytest.fixture(scope="module")
+def charts():
+    return importlib.import_module("04_Rank_Question_Charts")
+
+
+@pytest.fixture(scope="module")
+def survey(ingest, postgres, export, load):
+    """
+    A schema with the synthetic export loaded, shared by the tests which only read it
+    """
+    schema = "pytest_charts"
+    build_schema(ingest, postgres, schema)
+    load(export, schema)
+    yield schema
+    drop_schemas(postgres, schema)
+
+
+def test_average_score(charts):
+    # 25 / 8 = 3.125, which formatting the float would round to 3.12
+    assert charts.average_score(25, 8) == Decimal("3.13")
+    assert f"{charts.average_score(25, 8)}" == "3.13"
+
+
+def test_counts_to_chart(charts):
+    counts = pd.DataFrame(
+        [[1, 1, 2, 4], [0, 0, 0, 0], [2, 0, 0, 0]],
+        index=["Grammar", "Middle", "High"],
+        columns=charts.RESPONSE_VALUES,
+    )
+
+    chart = charts.counts_to_chart("Title", "Level", counts)
+
+    # the bar without responses is left out
+    assert chart["x_data_labels"] == ["Grammar\n(3.13)", "High\n(1.00)"]
+    assert chart["proportions"].response_value.tolist() == [1, 2, 3, 4]
+    assert chart["proportions"].pct.tolist() == [
+        [0.125, 1.0],
+        [0.125, 0.0],
+        [0.25, 0.0],
+        [0.5, 0.0],
+    ]
+
+
+def test_response_cube(ingest, charts, postgres, survey):
+    with create_engine(postgres).begin() as conn:
+        conn.execute(text(f"SET search_path TO {survey};"))
+        cube = charts.load_response_cube(conn, survey)
+        expected = pd.read_sql(
+            con=conn,
+            sql="""
+                SELECT response_value, SUM(num_individuals_in_response) AS num_responses
+                FROM question_rank_responses
+                         JOIN
+                     respondents USING (respondent_id)
+                WHERE NOT soft_delete
+                  AND question_id = 3
+                  AND middle
+                GROUP BY response_value
+                """,
+        )
+        counts = charts.response_counts(cube, "level", question_id=3)
+        assert counts.loc["Middle"].to_dict() == {
+            response_value: num_responses
+            for response_value, num_responses in zip(
+                expected.response_value, expected.num_responses
+            )
+        }
+        assert (
+            charts.response_counts(cube).loc["Total"].sum()
+            == charts.response_counts(cube, "question_id").sum().sum()
+        )
+
+        # rolled up from the aggregate views, once they're built, it's the same
+        run_sql_script(
+            REPO_DIR / "01b_build_aggregate_views.sql",
+            postgres,
+            {ingest.SCRIPT_SCHEMA: survey},
+        )
+        from_views = charts.load_response_cube(conn, survey)
+
+    key = list(charts.RESPONSE_CUBE_DIMENSIONS) + ["response_value"]
+    pd.testing.assert_frame_equal(
+        from_views.sort_values(key).reset_index(drop=True),
+        cube.sort_values(key).reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_yearly_counts_cache(
+    charts, postgres, export, new_schema, load, monkeypatch, tmp_path
+):
+    prior, current = new_schema("yoy_prior"), new_schema("yoy_current")
+    load(export, prior)
+    other_export = tmp_path / "current.csv"
+    generate_survey_export(other_export, num_respondents=150, seed=1)
+    load(other_export, current)
+    monkeypatch.setattr(charts, "YOY_CACHE_DIR", tmp_path / "yoy")
+    queried = []
+
+    def yearly_counts_query(conn, schema):
+        queried.append(schema)
+        return original_query(conn, schema)
+
+    original_query = charts.yearly_counts_query
+    monkeypatch.setattr(charts, "yearly_counts_query", yearly_counts_query)
+
+    def load_counts(**options):
+        queried.clear()
+        with create_engine(postgres).begin() as conn:
+            return charts.load_yearly_counts(
+                conn, [prior, current], current=current, **options
+            )
+
+    counts = load_counts()
+    assert queried == [prior, current]
+    # the prior year is read from the cache; the current one never is
+    assert load_counts().equals(counts)
+    assert queried == [current]
+
+    # a soft delete in the prior year changes its fingerprint
+    with create_engine(postgres).begin() as conn:
+        conn.execute(
+            text(
+                f"UPDATE {prior}.respondents SET soft_delete = TRUE "
+                f"WHERE respondent_id = (SELECT MIN(respondent_id) FROM {prior}.respondents)"
+            )
+        )
+    changed = load_counts()
+    assert queried == [prior, current]
+    assert not changed.equals(counts)
+    assert changed.equals(load_counts(use_cache=False))
+    assert len(list((tmp_path / "yoy").glob(f"{prior}-*.parquet"))) == 1
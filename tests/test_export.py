@@ -0,0 +1,22 @@
+import importlib
+
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine
+
+
+def test_export_numeric(postgres, tmp_path):
+    export = importlib.import_module("export_survey_data")
+    filepath = tmp_path / "numeric.parquet"
+
+    with create_engine(postgres).connect() as conn:
+        export.export_query(
+            conn,
+            "SELECT 1 AS id, ROUND(7 / 3.0, 3) AS response_pct UNION ALL SELECT 2, NULL",
+            filepath,
+            batch_size=1,
+        )
+
+    assert pq.read_table(filepath).to_pylist() == [
+        {"id": 1, "response_pct": 2.333},
+        {"id": 2, "response_pct": None},
+    ]
@@ -0,0 +1,392 @@
+"""
+Ingest the same synthetic export with each engine and option of 02_data_ingest.py, and check that they all leave the
+same table contents as the original row by row ingest.
+
+usage: python -m pytest tests
+"""
+
+import csv
+import json
+import logging
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+from conftest import (
+    BUILD_SCRIPT,
+    NUM_RESPONDENTS,
+    REPO_DIR,
+    build_schema,
+    drop_schemas,
+)
+from generate_synthetic_survey import generate_survey_export
+from utilities import run_sql_script
+
+# tables filled by the ingest, which must come out the same whichever way it's run
+SURVEY_TABLES = [
+    "collectors",
+    "respondents",
+    "questions",
+    "question_rank_responses",
+    "question_open_responses",
+]
+
+
+@pytest.fixture(scope="module")
+def reference(ingest, postgres, export, load):
+    """
+    The tables after the original ingest, one INSERT per row and cell
+    """
+    schema = "pytest_reference"
+    build_schema(ingest, postgres, schema)
+    try:
+        load(export, schema)
+        return snapshot(postgres, schema)
+    finally:
+        drop_schemas(postgres, schema)
+
+
+def snapshot(connection_string, schema):
+    """
+    :return: dict of table name: DataFrame of its rows, sorted by every column
+    """
+    tables = {}
+    with create_engine(connection_string).connect() as conn:
+        for tablename in SURVEY_TABLES:
+            table = pd.read_sql(
+                con=conn, sql=f"SELECT * FROM {schema}.{tablename}"
+            )
+            tables[tablename] = table.sort_values(
+                list(table.columns)
+            ).reset_index(drop=True)
+    return tables
+
+
+def assert_same_tables(actual, expected):
+    for tablename in SURVEY_TABLES:
+        pd.testing.assert_frame_equal(
+            actual[tablename], expected[tablename], obj=tablename
+        )
+
+
+def read_rows(filepath):
+    with open(filepath, "r", newline="") as f_in:
+        return list(csv.reader(f_in))
+
+
+def write_rows(filepath, rows):
+    with open(filepath, "w", newline="") as f_out:
+        csv.writer(f_out).writerows(rows)
+
+
+def test_bulk(postgres, export, reference, new_schema, load):
+    schema = new_schema("bulk")
+    load(export, schema, bulk=True)
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+def test_plan_cache_follows_questions(
+    ingest, postgres, export, new_schema, monkeypatch, tmp_path
+):
+    schema = new_schema("plan")
+    monkeypatch.setattr(ingest, "INPUT_FILEPATH", str(export))
+    monkeypatch.setattr(ingest, "DATABASE_SCHEMA", schema)
+    monkeypatch.setattr(ingest, "PLAN_CACHE_DIR", tmp_path)
+
+    with create_engine(postgres).begin() as conn:
+        plan = ingest.load_column_plan(conn)
+        assert ingest.load_column_plan(conn) == plan
+        conn.execute(
+            text(
+                f"UPDATE {schema}.questions SET question_type = 'open response' WHERE question_id = 3;"
+            )
+        )
+        changed = ingest.load_column_plan(conn)
+
+    assert changed != plan
+    assert {column[3] for column in changed if column and column[0] == 3} == {
+        "text"
+    }
+    assert len(list(tmp_path.glob("column_plan_*.json"))) == 2
+
+
+def test_workers(postgres, export, reference, new_schema, load):
+    schema = new_schema("workers")
+    load(export, schema, workers=2, chunk_size=30)
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+def test_pandas_engine(postgres, export, reference, new_schema, load):
+    schema = new_schema("pandas")
+    load(export, schema, engine="pandas")
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+@pytest.mark.parametrize("bulk", [False, True], ids=["rows", "bulk"])
+def test_incremental(
+    postgres, export, reference, new_schema, load, tmp_path, bulk
+):
+    schema = new_schema("incremental")
+    # the same respondent ids, with different answers and collectors, and fewer respondents
+    first = tmp_path / "first.csv"
+    generate_survey_export(first, num_respondents=150, seed=1)
+
+    load(first, schema, incremental=True, bulk=bulk)
+    load(export, schema, incremental=True, bulk=bulk)
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+def test_all_years(
+    ingest,
+    postgres,
+    export,
+    reference,
+    new_schema,
+    monkeypatch,
+    tmp_path,
+    caplog,
+):
+    schemas = [new_schema("year_a"), new_schema("year_b")]
+    bad_schema = new_schema("year_bad")
+    rows = read_rows(export)
+    rows[2 + 10][2] = "not a date"
+    bad_export = tmp_path / "bad.csv"
+    write_rows(bad_export, rows)
+    monkeypatch.setattr(ingest, "PLAN_CACHE_DIR", tmp_path / "cache")
+
+    # a year which fails doesn't stop the others
+    with pytest.raises(RuntimeError, match=bad_schema):
+        ingest.ingest_all_years(
+            [(str(export), schema) for schema in schemas]
+            + [(str(bad_export), bad_schema)]
+        )
+
+    for schema in schemas:
+        assert_same_tables(snapshot(postgres, schema), reference)
+    # progress shows at the default log level
+    assert {
+        record.getMessage().split()[0]
+        for record in caplog.records
+        if record.levelno >= logging.WARNING
+    } == set(schemas + [bad_schema])
+
+
+def test_csv_reader(postgres, export, reference, new_schema, load):
+    schema = new_schema("csv_reader")
+    load(export, schema, reader="csv")
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+def test_arrow_reader_streams_blocks(ingest, export, monkeypatch):
+    monkeypatch.setattr(ingest, "INPUT_FILEPATH", str(export))
+    # smaller than the header rows, so they span blocks too
+    monkeypatch.setattr(ingest, "EXPORT_BLOCK_SIZE", 4096)
+    assert len(list(ingest.stream_export_batches(export))) > 10
+
+    assert ingest.read_header("arrow") == ingest.read_header("csv")
+    assert [
+        list(row) for row in ingest.iter_export_rows("arrow", batch_size=7)
+    ] == list(ingest.iter_export_rows("csv"))
+
+
+def test_sql_engine(postgres, export, reference, new_schema, load):
+    schema = new_schema("sql")
+    load(export, schema, engine="sql")
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+def test_batches(postgres, export, reference, new_schema, load):
+    schema = new_schema("batches")
+    load(export, schema, batch_size=37)
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+def test_resume_after_bad_row(
+    postgres, export, reference, new_schema, load, tmp_path
+):
+    schema = new_schema("resume")
+    rows = read_rows(export)
+    filepath = tmp_path / "survey.csv"
+
+    # the batch with the bad row is rolled back; the two before it stay committed
+    bad_rows = [row.copy() for row in rows]
+    bad_rows[2 + 120][2] = "not a date"
+    write_rows(filepath, bad_rows)
+    with pytest.raises(ValueError):
+        load(filepath, schema, batch_size=50)
+    with create_engine(postgres).connect() as conn:
+        assert (
+            conn.execute(
+                text(f"SELECT COUNT(*) FROM {schema}.respondents")
+            ).scalar()
+            == 100
+        )
+
+    write_rows(filepath, rows)
+    load(filepath, schema, batch_size=50, resume=True)
+    assert_same_tables(snapshot(postgres, schema), reference)
+
+
+def test_reject_sets_bad_rows_aside(
+    postgres, export, reference, new_schema, load, tmp_path
+):
+    schema = new_schema("reject")
+    rows = read_rows(export)
+    rows[2 + 10][2] = "not a date"
+    rows[2 + 20][133] = "lots"
+    filepath = tmp_path / "survey.csv"
+    write_rows(filepath, rows)
+
+    load(filepath, schema, reject=True)
+
+    rejected_ids = {int(rows[2 + 10][0]), int(rows[2 + 20][0])}
+    expected = {
+        tablename: (
+            table[~table.respondent_id.isin(rejected_ids)].reset_index(
+                drop=True
+            )
+            if "respondent_id" in table
+            else table
+        )
+        for tablename, table in reference.items()
+    }
+    assert_same_tables(snapshot(postgres, schema), expected)
+    with create_engine(postgres).connect() as conn:
+        rejected = conn.execute(
+            text(
+                f"SELECT row_number, column_index FROM {schema}.rejected_rows ORDER BY row_number"
+            )
+        ).fetchall()
+    assert [tuple(row) for row in rejected] == [(10, 2), (20, 133)]
+
+
+def test_dry_run(ingest, export, monkeypatch, tmp_path):
+    rows = read_rows(export)
+    rows[2 + 10][2] = "not a date"
+    rows[2 + 20][133] = "lots"
+    # an answer which isn't in question_response_mapping
+    row, column = next(
+        (i, row.index("Satisfied"))
+        for i, row in enumerate(rows[2 + 21 :], 2 + 21)
+        if "Satisfied" in row
+    )
+    rows[row][column] = "Ecstatic"
+    filepath = tmp_path / "survey.csv"
+    write_rows(filepath, rows)
+    monkeypatch.setattr(ingest, "INPUT_FILEPATH", str(filepath))
+    # no database at all
+    monkeypatch.setattr(ingest, "DATABASE_CONNECTION_STRING", None)
+
+    report = ingest.dry_run(str(REPO_DIR / "01_build_database.sql"))
+
+    assert (report["rows"], report["would_load"], report["would_reject"]) == (
+        len(rows) - 2,
+        len(rows) - 5,
+        3,
+    )
+    assert sorted(error["column"] for error in report["errors"]) == [
+        2,
+        column,
+        133,
+    ]
+    assert [answer["response"] for answer in report["unmapped_answers"]] == [
+        "Ecstatic"
+    ]
+
+    # the export can be given on the command line instead of in .env
+    stats_filepath = tmp_path / "dry_run.json"
+    subprocess.run(
+        [
+            sys.executable,
+            "02_data_ingest.py",
+            "--dry-run",
+            "--input",
+            str(filepath),
+            "--stats-json",
+            str(stats_filepath),
+        ],
+        cwd=REPO_DIR,
+        check=True,
+        capture_output=True,
+    )
+    with open(stats_filepath) as f_in:
+        assert json.load(f_in)["would_reject"] == 3
+
+
+@pytest.mark.parametrize("bulk", [False, True], ids=["rows", "bulk"])
+def test_incremental_duckdb(ingest, load, tmp_path, bulk):
+    pytest.importorskip("duckdb_engine")
+    # the same respondent ids, with different answers and collectors, and more respondents
+    first = tmp_path / "first.csv"
+    generate_survey_export(first, num_respondents=150, seed=1)
+    second = tmp_path / "second.csv"
+    generate_survey_export(second, num_respondents=NUM_RESPONDENTS)
+
+    schema = ingest.SCRIPT_SCHEMA
+    incremental = f"duckdb:///{tmp_path / 'incremental.duckdb'}"
+    fresh = f"duckdb:///{tmp_path / 'fresh.duckdb'}"
+    for connection_string in [incremental, fresh]:
+        run_sql_script(BUILD_SCRIPT, connection_string)
+
+    load(first, schema, incremental, incremental=True, bulk=bulk)
+    load(second, schema, incremental, incremental=True, bulk=bulk)
+    load(second, schema, fresh)
+
+    assert_same_tables(snapshot(incremental, schema), snapshot(fresh, schema))
+
+
+def test_decoder_lists_unknown_answers(ingest, export, monkeypatch):
+    monkeypatch.setattr(ingest, "INPUT_FILEPATH", str(export))
+    catalog = ingest.load_catalog(str(BUILD_SCRIPT))
+    plan = ingest.build_column_plan(
+        ingest.inspect_header(None, "csv", catalog)
+    )
+    answer_scores = ingest.load_answer_scores(None, catalog)
+    decoder = ingest.RowDecoder(plan, answer_scores)
+    row = next(row for row in read_rows(export)[2:] if "Satisfied" in row)
+    column = row.index("Satisfied")
+    question_id = plan[column][0]
+    position = list(decoder.rank_columns).index(column)
+
+    decoded = decoder.decode(row)
+    assert decoded.unknown_answers == []
+    assert decoded.scores[position] == answer_scores[question_id]["Satisfied"]
+    assert ingest.parse_checked_row(decoder, row)[2] == []
+
+    row[column] = "Ecstatic"
+    decoded = decoder.decode(row)
+    # left unscored, not guessed from the text
+    assert decoded.unknown_answers == [(column, question_id, "Ecstatic")]
+    assert decoded.scores[position] == 0
+    _, parsed, errors = ingest.parse_checked_row(decoder, row)
+    assert parsed is None
+    assert errors == [
+        (column, f"Unknown answer to question {question_id}: 'Ecstatic'")
+    ]
+
+
+def test_shadow_reload(
+    ingest, postgres, export, reference, new_schema, load, tmp_path
+):
+    schema = new_schema("shadow")
+    rows = read_rows(export)
+    filepath = tmp_path / "survey.csv"
+    write_rows(filepath, rows[:102])
+    load(filepath, schema)
+
+    load(export, schema, function="reload_through_shadow")
+
+    assert_same_tables(snapshot(postgres, schema), reference)
+    # the schema it replaced is kept
+    with create_engine(postgres).connect() as conn:
+        assert (
+            conn.execute(
+                text(
+                    f"SELECT COUNT(*) FROM {schema}{ingest.PREVIOUS_SUFFIX}.respondents"
+                )
+            ).scalar()
+            == 100
+        )
@@ -0,0 +1,53 @@
+from sqlalchemy import create_engine, text
+
+from conftest import REPO_DIR
+from utilities import run_sql_script
+
+QA_SCRIPT = REPO_DIR / "03_QA_Checks.sql"
+
+
+def test_qa_checks_without_aggregate_views(
+    ingest, postgres, export, new_schema, load
+):
+    schema = new_schema("qa")
+    load(export, schema)
+
+    # 01b is optional, so there may be no views to refresh
+    run_sql_script(QA_SCRIPT, postgres, {ingest.SCRIPT_SCHEMA: schema})
+
+
+def test_qa_checks_refresh_aggregate_views(
+    ingest, postgres, export, new_schema, load
+):
+    schema = new_schema("qa_views")
+    run_sql_script(
+        REPO_DIR / "01b_build_aggregate_views.sql",
+        postgres,
+        {ingest.SCRIPT_SCHEMA: schema},
+    )
+    load(export, schema)
+    with create_engine(postgres).begin() as conn:
+        respondent_id = conn.execute(
+            text(f"SELECT MIN(respondent_id) FROM {schema}.respondents")
+        ).scalar()
+        # nothing but the mandatory questions, so QA soft deletes it
+        for tablename in [
+            "question_rank_responses",
+            "question_open_responses",
+        ]:
+            conn.execute(
+                text(
+                    f"DELETE FROM {schema}.{tablename} WHERE respondent_id = :respondent_id"
+                ),
+                {"respondent_id": respondent_id},
+            )
+
+    run_sql_script(QA_SCRIPT, postgres, {ingest.SCRIPT_SCHEMA: schema})
+
+    with create_engine(postgres).connect() as conn:
+        assert conn.execute(
+            text(
+                f"SELECT soft_delete FROM {schema}.respondent_segments WHERE respondent_id = :respondent_id"
+            ),
+            {"respondent_id": respondent_id},
+        ).scalar()